@@ -0,0 +1,143 @@
+"""Offline benchmark across BiRefNet model drops: ORT (fp32/fp16/QDQ-int8 .onnx) and MNN (w4/w8 .mnn).
+
+Every (model, threads, size) combination runs in a fresh process so load time and peak RSS are
+isolated. Inputs are synthetic (`synth_image`), so no dataset or network is needed.
+
+    python models/birefnet/birefnet_bench.py \
+        --models resources/birefnet/raw/model.onnx resources/birefnet/raw/model_int8_qdq.onnx \
+                 resources/birefnet/mnn/birefnet_w4_nostat.mnn resources/birefnet/mnn/birefnet_w8_nostat.mnn \
+        --threads 1 2 4 --sizes 512 --warmup 3 --runs 20 --json bench.json --csv bench.csv
+"""
+import argparse
+import csv
+import json
+import multiprocessing as mp
+import os
+import platform
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from birefnet_io import max_rss_mb, synth_image
+from birefnet_preprocess import Preprocessor
+
+FIELDS = ["model", "backend", "threads", "size", "load_ms", "warmup", "runs", "p50_ms", "p90_ms", "p99_ms",
+          "mean_ms", "throughput_ips", "peak_rss_mb", "error"]
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.224, 0.225)
+
+
+def backend_of(model_path: str) -> str:
+    return "mnn" if model_path.lower().endswith(".mnn") else "ort"
+
+
+def _import_backend(model_path: str):
+    if backend_of(model_path) == "mnn":
+        import birefnet_infer_mnn as mod
+    else:
+        import birefnet_infer_local as mod
+    return mod
+
+
+def _load(mod, model_path: str, threads: int, providers: Optional[List[str]]):
+    """Return an `infer(x) -> logits` callable for the model (runs in the child process)."""
+    if backend_of(model_path) == "mnn":
+        return mod.BiRefNetMNN(model_path, threads=threads).run
+
+    os.environ["ORT_NUM_THREADS"] = str(threads)  # read by make_session
+    sess = mod.make_session(model_path, providers=providers)
+    inp = sess.get_inputs()[0]
+    out_name = sess.get_outputs()[0].name
+    dtype = np.float16 if "float16" in inp.type else np.float32
+    return lambda x: sess.run([out_name], {inp.name: x.astype(dtype, copy=False)})[0]
+
+
+def bench_one(model_path: str, threads: int, size: int, warmup: int, runs: int,
+              providers: Optional[List[str]] = None) -> Dict:
+    """Benchmark one configuration; meant to run in its own process."""
+    row = {"model": os.path.basename(model_path), "backend": backend_of(model_path), "threads": threads,
+           "size": size, "warmup": warmup, "runs": runs, "error": ""}
+    try:
+        x, _ = Preprocessor((size, size), 1.0 / 255.0, MEAN, STD)(synth_image(size, size))
+        mod = _import_backend(model_path)  # keep library import time out of load_ms
+        t0 = time.perf_counter()
+        infer = _load(mod, model_path, threads, providers)
+        row["load_ms"] = 1000 * (time.perf_counter() - t0)
+        for _ in range(warmup):
+            infer(x)
+        lat = []
+        t_all = time.perf_counter()
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            infer(x)
+            lat.append(1000 * (time.perf_counter() - t0))
+        total = time.perf_counter() - t_all
+        p50, p90, p99 = np.percentile(lat, [50, 90, 99])
+        row.update(p50_ms=p50, p90_ms=p90, p99_ms=p99, mean_ms=float(np.mean(lat)),
+                   throughput_ips=runs / total if total > 0 else 0.0)
+    except Exception as e:
+        row["error"] = " ".join(f"{type(e).__name__}: {e}".split())
+    row["peak_rss_mb"] = max_rss_mb()
+    return row
+
+
+def run_matrix(models: List[str], threads: List[int], sizes: List[int], warmup: int, runs: int,
+               providers: Optional[List[str]] = None) -> List[Dict]:
+    ctx = mp.get_context("spawn")
+    rows = []
+    for model in models:
+        for t in threads:
+            for size in sizes:
+                with ctx.Pool(1) as pool:
+                    row = pool.apply(bench_one, (model, t, size, warmup, runs, providers))
+                rows.append(row)
+                print(format_row(row), flush=True)
+    return rows
+
+
+def _fmt(v, spec=".1f"):
+    return "-" if v is None else format(v, spec)
+
+
+def format_row(r: Dict) -> str:
+    if r.get("error"):
+        return f"{r['model']:<32} {r['backend']:<4} t={r['threads']:<3} {r['size']:>5}  ERROR {r['error']}"
+    return (f"{r['model']:<32} {r['backend']:<4} t={r['threads']:<3} {r['size']:>5}  "
+            f"load {_fmt(r.get('load_ms')):>7} ms  p50 {_fmt(r.get('p50_ms')):>7}  p90 {_fmt(r.get('p90_ms')):>7}  "
+            f"p99 {_fmt(r.get('p99_ms')):>7} ms  {_fmt(r.get('throughput_ips'), '.2f'):>6} img/s  "
+            f"RSS {_fmt(r.get('peak_rss_mb'), '.0f')} MiB")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark BiRefNet ORT/MNN model variants on synthetic inputs.")
+    ap.add_argument("--models", nargs="+", required=True, help=".onnx (ORT) and/or .mnn (MNN) model files.")
+    ap.add_argument("--threads", type=int, nargs="+", default=[1, 4])
+    ap.add_argument("--sizes", type=int, nargs="+", default=[512], help="Square input sizes.")
+    ap.add_argument("--warmup", type=int, default=3)
+    ap.add_argument("--runs", type=int, default=20)
+    ap.add_argument("--providers", default="CPUExecutionProvider", help="ORT providers (comma-separated).")
+    ap.add_argument("--json", default=None, help="Write results (with host info) to this JSON file.")
+    ap.add_argument("--csv", default=None, help="Write results to this CSV file.")
+    a = ap.parse_args()
+
+    providers = [p.strip() for p in a.providers.split(",") if p.strip()]
+    rows = run_matrix(a.models, a.threads, a.sizes, a.warmup, a.runs, providers)
+
+    if a.json:
+        host = {"platform": platform.platform(), "machine": platform.machine(), "cpus": os.cpu_count(),
+                "python": platform.python_version(), "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        with open(a.json, "w", encoding="utf-8") as f:
+            json.dump({"host": host, "results": rows}, f, indent=2)
+        print(f"Saved JSON: {a.json}")
+    if a.csv:
+        with open(a.csv, "w", newline="", encoding="utf-8") as f:
+            w = csv.DictWriter(f, fieldnames=FIELDS)
+            w.writeheader()
+            for r in rows:
+                w.writerow({k: r.get(k, "") for k in FIELDS})
+        print(f"Saved CSV: {a.csv}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Aspect-ratio shape buckets for BiRefNet inputs.
+
+Preprocessing squashes every image to the square model size, so a 3:1 banner spends most of its
+input on horizontally compressed pixels. Buckets are a small set of input shapes; each image goes to
+the bucket whose aspect ratio is closest to its own, which samples both axes evenly. The defaults are
+512x512, 704x384 and 384x704 (about the square's pixel count, so no FLOP saving for near-square or
+16:9 images, only less distortion) plus 768x256 and 256x768 for 3:1 and wider, which use 0.75x the
+square's pixels and are the only buckets that cut compute. A square input with the same density
+along the long axis would need max(h, w)**2 pixels.
+`--buckets WxH,...` shapes are used exactly as written; `--buckets default` scales the defaults
+(written for 512x512) to the model size.
+
+Needs a model with dynamic height/width (ORT), or an MNN model that accepts resizeTensor; sessions
+are warmed once per bucket so no request pays the first-run cost of a new shape. ORT bucketing is in
+birefnet_infer_local.py; the MNN scripts (infer_mnn, server, pipeline, video, refine) take --buckets
+and run on BucketedMNN, one session per bucket on a shared interpreter.
+
+    python models/birefnet/birefnet_buckets.py --model model.onnx --input assets/products/   # square vs buckets
+    python models/birefnet/birefnet_buckets.py --backend mnn --mnn model.mnn --buckets 512x512,704x384,384x704
+    python models/birefnet/birefnet_buckets.py --model model_1024.onnx --size 1024   # defaults scaled to 1024
+"""
+import argparse
+import math
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from birefnet_io import collect_inputs, load_image_reduced, synth_image
+
+Shape = Tuple[int, int]  # (height, width), like PreprocConfig.size
+DEFAULT_BUCKETS = "512x512,704x384,384x704,768x256,256x768"  # WxH for a 512x512 model; scaled for other model sizes
+
+
+def default_buckets(base: Optional[Shape] = None, multiple: int = 32) -> List[Shape]:
+    """DEFAULT_BUCKETS as [(h, w), ...], scaled from 512x512 to the model size `base`."""
+    s = math.sqrt(base[0] * base[1] / 512**2) if base is not None else 1.0
+    shapes = []
+    for item in DEFAULT_BUCKETS.split(","):
+        w, h = (max(multiple, round(int(v) * s / multiple) * multiple) for v in item.split("x"))
+        if (h, w) not in shapes:
+            shapes.append((h, w))
+    return shapes
+
+
+def parse_buckets(spec: str, base: Optional[Shape] = None) -> List[Shape]:
+    """'WxH,WxH,...' -> [(h, w), ...], taken literally; 'default' is default_buckets(base)."""
+    if spec.strip().lower() == "default":
+        return default_buckets(base)
+    shapes = []
+    for item in spec.split(","):
+        item = item.strip().lower()
+        if not item:
+            continue
+        w, h = (int(v) for v in item.split("x"))
+        if (h, w) not in shapes:
+            shapes.append((h, w))
+    if not shapes:
+        raise ValueError(f"no buckets in '{spec}'")
+    return shapes
+
+
+def add_bucket_args(ap: argparse.ArgumentParser):
+    ap.add_argument("--buckets", default=None,
+                    help="MNN: aspect-ratio input shapes (WxH,...; or 'default' scaled to the model size), "
+                         "one warm session per bucket on a shared interpreter.")
+
+
+def nearest_bucket(size: Tuple[int, int], shapes: Sequence[Shape]) -> Shape:
+    """Bucket for an image of `size` (w, h): smallest |log aspect difference|, ties to fewer pixels."""
+    r = math.log(size[0] / max(1, size[1]))
+    return min(shapes, key=lambda s: (abs(r - math.log(s[1] / s[0])), s[0] * s[1]))
+
+
+def max_shape(shapes: Sequence[Shape]) -> Shape:
+    """Per-axis maximum, used as the reduced-decode target so every bucket keeps its detail."""
+    return max(s[0] for s in shapes), max(s[1] for s in shapes)
+
+
+def _make_backend(args, shapes: Sequence[Shape]):
+    """(preprocessor factory per shape, infer) for the benchmark; `shapes` are every input shape used."""
+    from birefnet_preprocess import Preprocessor
+    if args.backend == "mnn":
+        from birefnet_infer_mnn import MEAN, STD, BucketedMNN
+        engine = BucketedMNN(args.mnn, shapes, threads=args.threads)
+        pre = lambda s: Preprocessor(s, 1.0 / 255.0, MEAN, STD, Image.BILINEAR)
+        return pre, engine.run
+
+    from dataclasses import replace
+    from birefnet_infer_local import make_session, resolve_preproc
+    from birefnet_preprocess import get_preprocessor
+    pp = resolve_preproc(None, args.pp_json, True)
+    sess = make_session(args.model)
+    inp, out_name = sess.get_inputs()[0], sess.get_outputs()[0].name
+    dtype = np.float16 if "float16" in inp.type else np.float32
+    return (lambda s: get_preprocessor(replace(pp, size=s), dtype)), (lambda x: sess.run([out_name], {inp.name: x})[0])
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Compare square inputs with aspect-ratio buckets (pixels and latency).")
+    ap.add_argument("--backend", choices=["ort", "mnn"], default="ort")
+    ap.add_argument("--model", default=None, help="Local ONNX model with dynamic H/W (ORT backend).")
+    ap.add_argument("--mnn", default=None, help="MNN model (MNN backend).")
+    ap.add_argument("--pp-json", default=None)
+    ap.add_argument("--threads", type=int, default=4, help="MNN threads.")
+    ap.add_argument("--input", default=None, help="Images to bucket (default: synthetic 1:1, 4:3, 16:9, 3:1, 1:3).")
+    ap.add_argument("--size", type=int, default=512, help="Square baseline size (model size).")
+    ap.add_argument("--buckets", default="default",
+                    help="Comma-separated WxH shapes, or 'default' (DEFAULT_BUCKETS scaled to --size).")
+    ap.add_argument("--runs", type=int, default=5)
+    a = ap.parse_args()
+    if (a.backend == "ort") != bool(a.model) or (a.backend == "mnn") != bool(a.mnn):
+        ap.error("--backend ort needs --model, --backend mnn needs --mnn")
+
+    square = (a.size, a.size)
+    shapes = parse_buckets(a.buckets, square)
+    if a.input:
+        imgs = [(p, load_image_reduced(p, max_shape(shapes + [square]))[0]) for p in collect_inputs(a.input)]
+    else:
+        rng = np.random.default_rng(0)
+        imgs = [(f"{w}x{h}", synth_image(h, w, rng)) for w, h in ((800, 800), (800, 600), (1280, 720),
+                                                                   (1500, 500), (500, 1500))]
+    make_pre, infer = _make_backend(a, [square] + shapes)
+    for s in [square] + shapes:  # warm every shape once, as the inference scripts do at start-up
+        infer(make_pre(s)(Image.new("RGB", (s[1], s[0])))[0])
+
+    def bench(pre, img) -> float:
+        x, _ = pre(img)
+        lat = []
+        for _ in range(a.runs):
+            t0 = time.perf_counter()
+            infer(x)
+            lat.append(1000 * (time.perf_counter() - t0))
+        return float(np.median(lat))
+
+    print(f"{'image':>24} {'size':>10} {'bucket':>9} {'px vs sq':>9} {'px vs dense sq':>15} {'square ms':>10} {'bucket ms':>10}")
+    per: Dict[Shape, List[float]] = {}
+    tot_sq = tot_b = 0.0
+    for name, img in imgs:
+        b = nearest_bucket(img.size, shapes)
+        t_sq, t_b = bench(make_pre(square), img), bench(make_pre(b), img)
+        px = b[0] * b[1]
+        dense = max(b) ** 2  # square with the bucket's sampling density along its long side
+        print(f"{name[-24:]:>24} {img.width:>4}x{img.height:<5} {b[1]:>4}x{b[0]:<4} {px / a.size**2:>8.2f}x "
+              f"{px / dense:>14.2f}x {t_sq:>10.1f} {t_b:>10.1f}")
+        per.setdefault(b, []).append(t_b)
+        tot_sq += t_sq
+        tot_b += t_b
+    print("[buckets] " + ", ".join(f"{w}x{h}: {len(v)} images" for (h, w), v in per.items())
+          + f"; mean latency square {tot_sq / len(imgs):.1f} ms, bucketed {tot_b / len(imgs):.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
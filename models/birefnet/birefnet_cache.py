@@ -0,0 +1,160 @@
+"""Content-addressed on-disk cache of low-resolution BiRefNet masks.
+
+The key is a hash of the decoded pixels fed to preprocessing, plus a namespace made of the model
+file's sha256, the preprocessing config and the postprocess mode; re-uploads of the same image hit
+the cache no matter what they are called. The value is the model-resolution uint8 mask stored as a
+PNG (lossless, typically a few KB), so a hit skips preprocessing and inference and goes straight to
+the bilinear resize. The directory is bounded by size with least-recently-used eviction; file
+mtimes record use, so recency survives restarts.
+
+    python models/birefnet/birefnet_cache.py .mask_cache            # entries, size, oldest/newest
+    python models/birefnet/birefnet_cache.py .mask_cache --max-mb 64 # evict down to 64 MB
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import numpy as np
+from PIL import Image
+
+from birefnet_io import model_digest
+
+
+def cache_namespace(model_path: str, pp, approx: bool = False, buckets=None) -> str:
+    """Everything besides the pixels that determines the cached mask."""
+    pp_key = [list(pp.size), float(pp.rescale_factor), list(pp.image_mean), list(pp.image_std), int(pp.resample)]
+    key = [model_digest(model_path), pp_key, "approx" if approx else "exact"]
+    if buckets:
+        key.append([list(s) for s in buckets])
+    return json.dumps(key)
+
+
+class MaskCache:
+    """Size-bounded LRU of uint8 masks under `root/<2 hex>/<key>.png`. Safe to share between threads."""
+
+    def __init__(self, root: str, max_bytes: int = 512 * 2**20, namespace: str = ""):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.namespace = namespace.encode("utf-8")
+        self.hits = self.misses = self.evictions = 0
+        self._lock = threading.Lock()
+        self._index: Dict[str, list] = {}  # key -> [bytes, last_used]
+        self._bytes = 0
+        os.makedirs(root, exist_ok=True)
+        for shard in os.scandir(root):
+            if not shard.is_dir():
+                continue
+            for e in os.scandir(shard.path):
+                if e.name.endswith(".png"):
+                    st = e.stat()
+                    self._index[e.name[:-4]] = [st.st_size, st.st_mtime]
+                    self._bytes += st.st_size
+
+    def key(self, img: Image.Image) -> str:
+        """Hash of the decoded pixels (mode and size included) within this cache's namespace."""
+        h = hashlib.blake2b(self.namespace, digest_size=20)
+        h.update(f"|{img.mode}|{img.width}x{img.height}|".encode("ascii"))
+        h.update(img.tobytes())
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key + ".png")
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        path = self._path(key)
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+        try:
+            with Image.open(path) as im:
+                mask = np.asarray(im.convert("L"))
+        except (OSError, ValueError):  # evicted by another process or truncated
+            with self._lock:
+                self._drop(key)
+                self.misses += 1
+            return None
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        with self._lock:
+            entry[1] = now
+            self.hits += 1
+        return mask
+
+    def put(self, key: str, mask: np.ndarray):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        Image.fromarray(np.ascontiguousarray(mask, dtype=np.uint8), mode="L").save(tmp, format="PNG", compress_level=6)
+        os.replace(tmp, path)  # atomic: readers never see a partial file
+        size = os.path.getsize(path)
+        with self._lock:
+            old = self._index.get(key)
+            self._bytes += size - (old[0] if old else 0)
+            self._index[key] = [size, time.time()]
+            if self._bytes > self.max_bytes:
+                self._evict(int(self.max_bytes * 0.9))
+
+    def _drop(self, key: str):
+        entry = self._index.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[0]
+
+    def _evict(self, target: int):
+        for key, _ in sorted(self._index.items(), key=lambda kv: kv[1][1]):
+            if self._bytes <= target:
+                break
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            self._drop(key)
+            self.evictions += 1
+
+    def prune(self, max_bytes: Optional[int] = None):
+        with self._lock:
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            if self._bytes > self.max_bytes:
+                self._evict(self.max_bytes)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self._index), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def summary(self) -> str:
+        s = self.stats()
+        return (f"[mask-cache] {s['hits']} hits / {s['misses']} misses ({100 * s['hit_rate']:.0f}% hit rate), "
+                f"{s['evictions']} evicted, {s['entries']} entries, {s['bytes'] / 2**20:.1f}/{s['max_bytes'] / 2**20:.0f} MB")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Inspect or shrink a BiRefNet mask cache directory.")
+    ap.add_argument("root")
+    ap.add_argument("--max-mb", type=float, default=None, help="Evict least recently used entries down to this size.")
+    a = ap.parse_args()
+
+    cache = MaskCache(a.root, max_bytes=1 << 62)
+    if a.max_mb is not None:
+        cache.prune(int(a.max_mb * 2**20))
+    s = cache.stats()
+    times = sorted(e[1] for e in cache._index.values())
+    fmt = lambda t: time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t))
+    print(f"{a.root}: {s['entries']} entries, {s['bytes'] / 2**20:.1f} MB"
+          + (f", {s['evictions']} evicted" if s["evictions"] else "")
+          + (f", last used {fmt(times[0])} .. {fmt(times[-1])}" if times else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""Mask / cutout output formats and a background writer for the BiRefNet scripts.
+
+At 4K, a default-compression RGBA PNG costs more than a 512x512 inference. Formats (all lossless):
+
+  png[:L]    PNG, zlib compress_level L (0 = store .. 9; plain `png` keeps Pillow's default, as before)
+  webp[:E]   lossless WebP, effort E (0 = fastest .. 6, default 4); exact RGB under transparent pixels
+  npy        uint8 array (H x W, or H x W x 4 for cutouts) in .npy, readable with np.load(mmap_mode="r")
+  alpha[:L]  cutouts only: the alpha plane as a single-channel PNG (the RGB is the unchanged input)
+
+`Writer` encodes on a thread pool (Pillow releases the GIL while encoding), so the next image decodes
+and infers while the previous one is written; the number of queued images is bounded so a slow disk
+cannot pile up full-resolution buffers. Encode time and bytes are reported per format.
+
+    python models/birefnet/birefnet_encode.py --size 3840x2160                 # synthetic 4K mask + cutout
+    python models/birefnet/birefnet_encode.py --image photo.jpg --formats png,png:1,webp:0,npy,alpha:1
+    python models/birefnet/birefnet_infer_local.py ... --input photos/ --mask-format png:1 \\
+        --save-cutout outputs/cutouts --cutout-format webp:0 --writers 2
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from birefnet_postprocess import to_rgba
+import birefnet_trace as trace
+
+KINDS = {"png": ".png", "webp": ".webp", "npy": ".npy", "alpha": ".png"}
+
+
+@dataclass(frozen=True)
+class OutputFormat:
+    kind: str = "png"
+    level: Optional[int] = None  # PNG compress_level / WebP effort; None: encoder default
+
+    @property
+    def ext(self) -> str:
+        return KINDS[self.kind]
+
+    def __str__(self) -> str:
+        return self.kind if self.level is None else f"{self.kind}:{self.level}"
+
+
+PNG = OutputFormat()
+
+
+def parse_format(spec: str) -> OutputFormat:
+    """'png', 'png:1', 'webp:0', 'npy', 'alpha:1' -> OutputFormat."""
+    kind, _, level = spec.strip().lower().partition(":")
+    if kind not in KINDS:
+        raise ValueError(f"unknown output format '{spec}' (choose from {', '.join(KINDS)})")
+    if not level:
+        return OutputFormat(kind)
+    if kind == "npy":
+        raise ValueError("npy takes no level")
+    n = int(level)
+    hi = 6 if kind == "webp" else 9
+    if not 0 <= n <= hi:
+        raise ValueError(f"{kind} level must be 0..{hi}, got {n}")
+    return OutputFormat(kind, n)
+
+
+def with_ext(path: str, fmt: OutputFormat) -> str:
+    return os.path.splitext(path)[0] + fmt.ext
+
+
+def encode(img: Image.Image, path: str, fmt: OutputFormat = PNG) -> int:
+    """Write `img` (L mask or RGBA cutout) to `path` in `fmt`; returns the file size in bytes."""
+    if fmt.kind == "alpha" and img.mode == "RGBA":
+        img = img.getchannel("A")
+    if fmt.kind in ("png", "alpha"):
+        img.save(path, format="PNG", **({} if fmt.level is None else {"compress_level": fmt.level}))
+    elif fmt.kind == "webp":
+        effort = 4 if fmt.level is None else fmt.level
+        # in lossless mode `quality` is compression effort too; exact keeps RGB where alpha is 0
+        img.save(path, format="WEBP", lossless=True, method=effort, quality=round(100 * effort / 6), exact=True)
+    else:
+        np.save(path, np.asarray(img))
+    return os.path.getsize(path)
+
+
+def decode(path: str, mode: Optional[str] = None) -> np.ndarray:
+    """Read back any output format as a uint8 array (used to check that encodes are lossless).
+
+    WebP has no grey mode: masks come back as R=G=B, so pass mode="L" to compare them.
+    """
+    if path.endswith(".npy"):
+        return np.load(path, mmap_mode="r")
+    with Image.open(path) as img:
+        return np.asarray(img if mode is None or img.mode == mode else img.convert(mode))
+
+
+@dataclass
+class EncodeStats:
+    images: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+
+    def line(self, name: str) -> str:
+        n = max(self.images, 1)
+        return (f"{name:<16} {self.images:>6} {1000 * self.seconds / n:>9.1f} "
+                f"{self.bytes / n / 2**10:>10.1f} {self.bytes / 2**20:>9.1f}")
+
+
+class Writer:
+    """Encode + write outputs on `workers` threads (0: inline); at most `max_pending` outputs queued.
+
+    A failed write is reported and counted and the remaining writes go on, inline or on the pool;
+    `close` then raises, so one bad output path neither aborts a batch nor passes silently.
+    """
+
+    def __init__(self, workers: int = 2, max_pending: int = 0):
+        self.workers = max(0, workers)
+        self.stats: Dict[str, EncodeStats] = {}
+        self.errors = 0
+        self._first_error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="encode") if self.workers else None
+        self._slots = threading.BoundedSemaphore(max_pending or 2 * self.workers) if self.workers else None
+
+    def _write(self, name: str, img: Image.Image, path: str, fmt: OutputFormat, alpha: Optional[Image.Image]):
+        try:
+            t0 = time.perf_counter()
+            with trace.span("encode"):
+                if alpha is not None and fmt.kind != "alpha":
+                    img = to_rgba(img, alpha)
+                n = encode(alpha if fmt.kind == "alpha" else img, path, fmt)
+            self.record(name, fmt, n, time.perf_counter() - t0)
+        except Exception as e:
+            self.record_error(path, e)
+        finally:
+            if self._slots is not None:
+                self._slots.release()
+
+    def record(self, name: str, fmt: OutputFormat, nbytes: int, seconds: float):
+        """Count one output written (also for outputs written outside the pool, e.g. in strips)."""
+        with self._lock:
+            st = self.stats.setdefault(f"{name} {fmt}", EncodeStats())
+            st.images += 1
+            st.bytes += nbytes
+            st.seconds += seconds
+
+    def record_error(self, path: str, e: Exception):
+        """Count one failed output (also for outputs written outside the pool); `close` will raise."""
+        with self._lock:
+            self.errors += 1
+            self._first_error = self._first_error or f"{path}: {e}"
+        print(f"[WARN] Writing {path} failed: {e}")
+
+    def submit(self, img: Image.Image, path: str, fmt: OutputFormat = PNG, name: str = "mask",
+               alpha: Optional[Image.Image] = None):
+        """Write `img` to `path`; with `alpha`, `img` is the RGB source of a cutout (attached in the worker).
+
+        The images are handed over: the caller must not modify them afterwards (cutouts attach alpha in place).
+        """
+        if self._pool is None:
+            self._write(name, img, path, fmt, alpha)
+            return
+        self._slots.acquire()  # backpressure: blocks while max_pending outputs are queued
+        self._pool.submit(self._write, name, img, path, fmt, alpha)
+
+    def join(self):
+        """Wait for every queued write (failures stay counted for `close`)."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def close(self):
+        """Wait for every queued write; raises OSError if any write failed."""
+        self.join()
+        if self.errors:
+            raise OSError(f"{self.errors} output writes failed (first: {self._first_error})")
+
+    def summary(self) -> str:
+        lines = [f"[encode] {'output':<16} {'images':>6} {'ms/image':>9} {'KiB/image':>10} {'MiB total':>9}"]
+        lines += ["[encode] " + st.line(name) for name, st in self.stats.items()]
+        if self.errors:
+            lines.append(f"[encode] {self.errors} writes failed")
+        return "\n".join(lines)
+
+
+def add_encode_args(ap: argparse.ArgumentParser, writers: bool = True):
+    g = ap.add_argument_group("output encoding")
+    g.add_argument("--mask-format", type=parse_format, default=PNG,
+                   help="Mask format: png[:0-9], webp[:0-6], npy (default: png, Pillow's default level).")
+    g.add_argument("--cutout-format", type=parse_format, default=PNG,
+                   help="Cutout format: png[:0-9], webp[:0-6], npy, or alpha[:0-9] (alpha plane only).")
+    if writers:
+        g.add_argument("--writers", type=int, default=0,
+                       help="Background encode/write threads, so writing overlaps the next image (0: inline).")
+
+
+def _synthetic(w: int, h: int) -> Tuple[Image.Image, Image.Image]:
+    """Smooth RGB photo stand-in and a soft-edged blob mask (compresses like real mattes)."""
+    from birefnet_io import synth_image
+    yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+    r = np.hypot((xx - w / 2) / (0.3 * w), (yy - h / 2) / (0.35 * h))
+    mask = np.clip((1.0 - r) * 40.0 * 255.0 + 127.5, 0, 255).astype(np.uint8)
+    return synth_image(h, w, np.random.default_rng(0)), Image.fromarray(mask, mode="L")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Encode time and size per output format (masks and cutouts).")
+    ap.add_argument("--image", default=None, help="RGB source for the cutout (default: synthetic).")
+    ap.add_argument("--mask", default=None, help="Mask for --image (default: synthetic blob resized to it).")
+    ap.add_argument("--size", default="3840x2160", help="Synthetic size WxH.")
+    ap.add_argument("--formats", default="png,png:1,png:0,webp,webp:0,npy,alpha,alpha:1")
+    ap.add_argument("--runs", type=int, default=3)
+    a = ap.parse_args()
+
+    if a.image:
+        from birefnet_io import open_image
+        rgb = open_image(a.image).convert("RGB")
+        mask = (Image.open(a.mask).convert("L").resize(rgb.size, Image.BILINEAR) if a.mask
+                else _synthetic(*rgb.size)[1])
+    else:
+        rgb, mask = _synthetic(*(int(v) for v in a.size.lower().split("x")))
+    print(f"[encode] {rgb.width}x{rgb.height}, {a.runs} runs, median per encode")
+    print(f"{'format':<10} {'mask ms':>8} {'mask KiB':>9} {'cutout ms':>10} {'cutout KiB':>11}  lossless")
+    with tempfile.TemporaryDirectory() as d:
+        for spec in a.formats.split(","):
+            fmt = parse_format(spec)
+            row, ok = [], True
+            for name, img in (("mask", mask), ("cutout", to_rgba(rgb.copy(), mask))):
+                if name == "mask" and fmt.kind == "alpha":
+                    row += [None, None]
+                    continue
+                path = os.path.join(d, name + fmt.ext)
+                lat = []
+                for _ in range(a.runs):
+                    t0 = time.perf_counter()
+                    n = encode(img, path, fmt)
+                    lat.append(1000 * (time.perf_counter() - t0))
+                ref = img.getchannel("A") if fmt.kind == "alpha" else img
+                ok &= np.array_equal(decode(path, ref.mode), np.asarray(ref))
+                row += [float(np.median(lat)), n / 2**10]
+            cells = " ".join("{:>8}".format("-") if v is None else f"{v:>8.1f}" for v in row[:2])
+            print(f"{str(fmt):<10} {cells} {row[2]:>10.1f} {row[3]:>11.1f}  {ok}")
+
+
+if __name__ == "__main__":
+    main()
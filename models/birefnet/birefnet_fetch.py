@@ -0,0 +1,365 @@
+"""Concurrent, connection-pooled image fetching for URL inputs.
+
+A one-off `requests.get` per image pays a TCP (and TLS) handshake every time and runs serially ahead
+of inference. `Fetcher` keeps one `requests.Session` whose adapter holds up to `workers` keep-alive
+connections per host, fetches up to `workers` images concurrently with a bounded look-ahead window
+(so a slow model never lets downloads pile up in memory), retries connection errors, timeouts and
+429/5xx responses with exponential backoff, and decodes as the body streams in: full-resolution
+images are fed chunk by chunk into PIL's incremental parser, mask-only inputs are collected into one
+buffer and decoded with the reduced (draft) decode. Results come back in input order; local paths
+pass through the same pool, so decoding overlaps inference either way.
+
+    python models/birefnet/birefnet_fetch.py --input urls.txt --workers 8          # fetch a URL manifest
+    # local HTTP stand-in (30 ms handshake, 20 ms first byte, every 7th request 503):
+    # serial one-off requests.get vs the pooled fetcher
+    python models/birefnet/birefnet_fetch.py --serve assets/products/ --handshake-ms 30 --latency-ms 20 \\
+        --fail-every 7 --repeat 4
+    python models/birefnet/birefnet_fetch.py --serve assets/products/ --manifest urls.txt --hold   # serve only
+    python models/birefnet/birefnet_infer_local.py --model model.onnx --use-default-pp --input urls.txt \\
+        --fetch-workers 8
+"""
+import argparse
+import io
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from PIL import Image, ImageFile
+
+from birefnet_io import collect_inputs, load_image_reduced
+import birefnet_trace as trace
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+CHUNK = 1 << 16
+
+
+def is_url(src) -> bool:
+    return isinstance(src, str) and src.startswith(("http://", "https://"))
+
+
+class FetchError(IOError):
+    def __init__(self, msg: str, retryable: bool):
+        super().__init__(msg)
+        self.retryable = retryable
+
+
+@dataclass
+class FetchResult:
+    index: int
+    source: str
+    image: Optional[Image.Image] = None
+    size: Tuple[int, int] = (0, 0)  # original (w, h), also for reduced decodes
+    nbytes: int = 0
+    seconds: float = 0.0            # fetch + decode in the worker
+    error: Optional[str] = None
+
+
+@dataclass
+class FetchStats:
+    images: int = 0
+    failed: int = 0
+    urls: int = 0
+    bytes: int = 0
+    retries: int = 0
+    busy_s: float = 0.0
+    t0: float = field(default_factory=time.perf_counter)
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, r: FetchResult, url: bool, retries: int):
+        with self.lock:
+            self.images += r.error is None
+            self.failed += r.error is not None
+            self.urls += url
+            self.bytes += r.nbytes
+            self.retries += retries
+            self.busy_s += r.seconds
+
+    def summary(self) -> str:
+        wall = time.perf_counter() - self.t0
+        n = self.images + self.failed
+        return (f"[fetch] {self.images} images ({self.urls} URLs, {self.failed} failed, {self.retries} retries), "
+                f"{self.bytes / 2**20:.1f} MiB in {wall:.2f}s: {self.images / max(wall, 1e-9):.1f} img/s, "
+                f"{self.bytes / 2**20 / max(wall, 1e-9):.1f} MiB/s, {1000 * self.busy_s / max(n, 1):.0f} ms/image in workers")
+
+
+class Fetcher:
+    """Pooled, concurrent fetch + decode of image paths/URLs; `workers=0` fetches inline (still pooled)."""
+
+    def __init__(self, workers: int = 8, retries: int = 3, backoff: float = 0.25,
+                 timeout: Tuple[float, float] = (5.0, 30.0), max_bytes: int = 256 * 2**20):
+        self.workers = max(0, workers)
+        self.retries, self.backoff, self.timeout, self.max_bytes = max(0, retries), backoff, timeout, max_bytes
+        self.stats = FetchStats()
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        """Created on first use, so runs on local files never import requests."""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    s = requests.Session()
+                    n = max(1, self.workers)
+                    # retries are done per image in fetch() (they must also cover a body that breaks mid-stream)
+                    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=n, max_retries=0, pool_block=True)
+                    s.mount("http://", adapter)
+                    s.mount("https://", adapter)
+                    self._session = s
+        return self._session
+
+    def _stream(self, url: str, sink) -> int:
+        """GET `url` and hand each body chunk to `sink`; returns the byte count."""
+        import requests
+        try:
+            with self.session.get(url, stream=True, timeout=self.timeout) as resp:
+                if resp.status_code >= 400:
+                    if int(resp.headers.get("Content-Length") or CHUNK + 1) <= CHUNK:
+                        resp.content  # drain a short error body so the connection goes back to the pool
+                    raise FetchError(f"HTTP {resp.status_code} for {url}", resp.status_code in RETRY_STATUS)
+                length = int(resp.headers.get("Content-Length") or 0)
+                if length > self.max_bytes:
+                    raise FetchError(f"{url}: {length} bytes exceeds the {self.max_bytes} byte limit", False)
+                n = 0
+                for chunk in resp.iter_content(CHUNK):
+                    n += len(chunk)
+                    if n > self.max_bytes:
+                        raise FetchError(f"{url}: body exceeds the {self.max_bytes} byte limit", False)
+                    sink(chunk)
+                return n
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            raise FetchError(f"{url}: {e}", True) from e
+
+    def _fetch_once(self, url: str, size: Optional[Tuple[int, int]]) -> Tuple[Image.Image, Tuple[int, int], int]:
+        if size is None:  # full decode: PIL decodes as chunks arrive
+            parser = ImageFile.Parser()
+            n = self._stream(url, parser.feed)
+            img = parser.close()
+            return img.convert("RGB"), img.size, n
+        buf = io.BytesIO()  # reduced decode needs the header before decoding starts (Image.draft)
+        n = self._stream(url, buf.write)
+        buf.seek(0)
+        img, orig = load_image_reduced(buf, size)
+        return img, orig, n
+
+    def fetch(self, source: str, size: Optional[Tuple[int, int]] = None, index: int = 0) -> FetchResult:
+        """Fetch and decode one path/URL to RGB (near `size` (h, w) when given); errors go in `.error`."""
+        r = FetchResult(index, source)
+        url = is_url(source)
+        attempt = 0
+        t0 = time.perf_counter()
+        while True:
+            try:
+                with trace.span("fetch" if url else "decode"):
+                    if url:
+                        r.image, r.size, r.nbytes = self._fetch_once(source, size)
+                    elif size is None:
+                        r.image = Image.open(source).convert("RGB")
+                        r.size, r.nbytes = r.image.size, os.path.getsize(source)
+                    else:
+                        r.image, r.size = load_image_reduced(source, size)
+                        r.nbytes = os.path.getsize(source)
+                break
+            except FetchError as e:
+                if not e.retryable or attempt >= self.retries:
+                    r.error = str(e)
+                    break
+                time.sleep(self.backoff * 2 ** attempt)
+                attempt += 1
+            except Exception as e:
+                r.error = str(e)
+                break
+        r.seconds = time.perf_counter() - t0
+        self.stats.add(r, url, attempt)
+        return r
+
+    def imap(self, sources: Iterable[str], size: Optional[Tuple[int, int]] = None) -> Iterator[FetchResult]:
+        """Fetch/decode `sources` concurrently; results in input order, at most 2 x workers ahead of the consumer."""
+        if self.workers <= 1:
+            for i, src in enumerate(sources):
+                yield self.fetch(src, size, i)
+            return
+        window = 2 * self.workers
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="fetch") as ex:
+            pending = deque()
+            it = enumerate(sources)
+            for i, src in it:
+                pending.append(ex.submit(self.fetch, src, size, i))
+                if len(pending) >= window:
+                    break
+            while pending:
+                r = pending.popleft().result()
+                nxt = next(it, None)
+                if nxt is not None:
+                    pending.append(ex.submit(self.fetch, nxt[1], size, nxt[0]))
+                yield r
+
+    def get_bytes(self, url: str) -> bytes:
+        """Whole body of `url` through the pooled session, with the same retries."""
+        for attempt in range(self.retries + 1):
+            buf = io.BytesIO()
+            try:
+                self._stream(url, buf.write)
+                return buf.getvalue()
+            except FetchError as e:
+                if not e.retryable or attempt >= self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+
+_SHARED: Optional[Fetcher] = None
+
+
+def shared_fetcher() -> Fetcher:
+    """Process-wide pooled fetcher behind `birefnet_io.open_image`, so one-off URL loads reuse connections."""
+    global _SHARED
+    if _SHARED is None:
+        _SHARED = Fetcher(workers=8)
+    return _SHARED
+
+
+def add_fetch_args(ap: argparse.ArgumentParser):
+    g = ap.add_argument_group("URL fetching")
+    g.add_argument("--fetch-workers", type=int, default=0,
+                   help="Fetch/decode inputs on N threads over a pooled session, ahead of inference (0: inline).")
+    g.add_argument("--fetch-retries", type=int, default=3, help="Retries for connection errors, timeouts and 429/5xx.")
+    g.add_argument("--fetch-timeout", type=float, default=30.0, help="Read timeout per request (s).")
+
+
+def fetcher_from_args(args) -> Fetcher:
+    return Fetcher(args.fetch_workers, args.fetch_retries, timeout=(5.0, args.fetch_timeout))
+
+
+# --- local HTTP stand-in -------------------------------------------------------------------------
+
+def serve_dir(root: str, handshake_ms: float = 0.0, latency_ms: float = 0.0, fail_every: int = 0,
+              port: int = 0):
+    """Serve `root` over HTTP/1.1 keep-alive on 127.0.0.1 in a background thread.
+
+    `handshake_ms` is paid once per new connection (stand-in for TCP + TLS set-up), `latency_ms` per
+    request before the first byte; every `fail_every`-th request gets a 503. Returns (server, base URL);
+    `server.connections` / `server.requests` count what the clients did.
+    """
+    from functools import partial
+    from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(SimpleHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            with self.server.lock:
+                self.server.connections += 1
+            if handshake_ms:
+                time.sleep(handshake_ms / 1000)
+
+        def do_GET(self):
+            with self.server.lock:
+                self.server.requests += 1
+                n = self.server.requests
+            if latency_ms:
+                time.sleep(latency_ms / 1000)
+            if fail_every and n % fail_every == 0:
+                self.send_response(503)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            super().do_GET()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), partial(Handler, directory=os.path.abspath(root)))
+    server.daemon_threads = True
+    server.lock, server.connections, server.requests = threading.Lock(), 0, 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def _serial_baseline(urls: List[str], size: Optional[Tuple[int, int]]) -> Tuple[int, float]:
+    """The old per-script loader: one-off requests.get (no session), 30 s timeout, no retries."""
+    import requests
+    ok, t0 = 0, time.perf_counter()
+    for url in urls:
+        try:
+            resp = requests.get(url, timeout=30)
+            resp.raise_for_status()
+            if size is None:
+                Image.open(io.BytesIO(resp.content)).convert("RGB")
+            else:
+                load_image_reduced(io.BytesIO(resp.content), size)
+            ok += 1
+        except Exception:
+            pass
+    return ok, time.perf_counter() - t0
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Pooled concurrent image fetching: throughput and a local HTTP stand-in.")
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--input", help="Manifest (.txt/.lst) of URLs/paths, a directory or a glob.")
+    src.add_argument("--serve", help="Serve this image directory locally and fetch it over HTTP.")
+    ap.add_argument("--workers", type=int, default=8)
+    ap.add_argument("--retries", type=int, default=3)
+    ap.add_argument("--size", type=int, default=0, help="Reduced decode near this square model size (0: full decode).")
+    ap.add_argument("--repeat", type=int, default=1, help="Fetch the list this many times (--serve).")
+    ap.add_argument("--handshake-ms", type=float, default=0.0, help="Stand-in cost of opening a connection.")
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="Stand-in time to first byte per request.")
+    ap.add_argument("--fail-every", type=int, default=0, help="Stand-in answers every Nth request with 503.")
+    ap.add_argument("--port", type=int, default=0)
+    ap.add_argument("--manifest", default=None, help="Write the served URLs to this manifest.")
+    ap.add_argument("--hold", action="store_true", help="Keep serving until interrupted (for the inference scripts).")
+    ap.add_argument("--no-baseline", action="store_true", help="Skip the serial one-off requests.get run (--serve).")
+    a = ap.parse_args()
+    size = (a.size, a.size) if a.size else None
+
+    server = None
+    if a.serve:
+        server, base = serve_dir(a.serve, a.handshake_ms, a.latency_ms, a.fail_every, a.port)
+        names = [os.path.relpath(p, a.serve).replace(os.sep, "/") for p in collect_inputs(a.serve)]
+        urls = [f"{base}/{n}" for n in names] * max(1, a.repeat)
+        print(f"[serve] {len(names)} images at {base}/ (handshake {a.handshake_ms:.0f} ms, "
+              f"latency {a.latency_ms:.0f} ms, fail every {a.fail_every or '-'})")
+        if a.manifest:
+            with open(a.manifest, "w", encoding="utf-8") as f:
+                f.write("\n".join(urls) + "\n")
+            print(f"[serve] manifest -> {a.manifest}")
+        if a.hold:
+            try:
+                threading.Event().wait()
+            except KeyboardInterrupt:
+                return
+    else:
+        urls = collect_inputs(a.input)
+
+    if server is not None and not a.no_baseline:
+        c0, r0 = server.connections, server.requests
+        ok, wall = _serial_baseline(urls, size)
+        print(f"[serial] {ok}/{len(urls)} images in {wall:.2f}s: {ok / max(wall, 1e-9):.1f} img/s "
+              f"({server.connections - c0} connections, {server.requests - r0} requests)")
+
+    fetcher = Fetcher(a.workers, a.retries)
+    c0, r0 = (server.connections, server.requests) if server else (0, 0)
+    for r in fetcher.imap(urls, size):
+        if r.error:
+            print(f"[WARN] {r.source}: {r.error}")
+    print(fetcher.stats.summary())
+    if server is not None:
+        print(f"[pooled] {server.connections - c0} connections, {server.requests - r0} requests, "
+              f"{a.workers} workers")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,12 @@
 
 import argparse
-import io
 import json
-import os
 import sys
 from dataclasses import dataclass
 from typing import Tuple, Optional
 
 import numpy as np
 from PIL import Image
-import requests
 
 # Prefer GPU if available (user can pip install onnxruntime-gpu)
 try:
@@ -19,11 +16,22 @@ except Exception as e:
           "or `pip install onnxruntime-gpu` (GPU).")
     raise
 
-try:
-    from huggingface_hub import hf_hub_download
-except Exception as e:
-    print("ERROR: huggingface_hub is not installed. Please `pip install huggingface_hub`.")
-    raise
+from birefnet_io import load_image_reduced, open_image
+from birefnet_ort import BoundRunner, OrtOptions, add_ort_args, create_session, options_from_args
+from birefnet_postprocess import postprocess as fast_postprocess, to_rgba
+from birefnet_preprocess import get_preprocessor
+from birefnet_registry import Registry, add_registry_args
+
+
+def hf_hub_download(repo_id: str, filename: str) -> str:
+    # Imported on first use: --variant runs resolve from the offline registry and never load huggingface_hub
+    try:
+        from huggingface_hub import hf_hub_download as download
+    except Exception:
+        print("ERROR: huggingface_hub is not installed. Please `pip install huggingface_hub`, "
+              "or use --variant with a prefetched registry (birefnet_registry.py).")
+        raise
+    return download(repo_id=repo_id, filename=filename)
 
 
 @dataclass
@@ -37,7 +45,10 @@ class PreprocConfig:
 
 def load_preprocessor(repo_id: str, filename: str = "preprocessor_config.json") -> PreprocConfig:
     """Download and parse the preprocessor config to match the JS pipeline."""
-    cfg_path = hf_hub_download(repo_id=repo_id, filename=filename)
+    return parse_preprocessor(hf_hub_download(repo_id=repo_id, filename=filename))
+
+
+def parse_preprocessor(cfg_path: str) -> PreprocConfig:
     with open(cfg_path, "r", encoding="utf-8") as f:
         cfg = json.load(f)
     size = (int(cfg["size"]["height"]), int(cfg["size"]["width"]))
@@ -51,75 +62,35 @@ def load_preprocessor(repo_id: str, filename: str = "preprocessor_config.json")
 
 
 def load_image(img_path_or_url: str) -> Image.Image:
-    if img_path_or_url.startswith("http://") or img_path_or_url.startswith("https://"):
-        resp = requests.get(img_path_or_url, timeout=30)
-        resp.raise_for_status()
-        return Image.open(io.BytesIO(resp.content)).convert("RGB")
-    else:
-        return Image.open(img_path_or_url).convert("RGB")
+    return open_image(img_path_or_url).convert("RGB")
 
 
 def preprocess(img: Image.Image, pp: PreprocConfig) -> Tuple[np.ndarray, Tuple[int, int]]:
-    orig_w, orig_h = img.width, img.height
-    # Resize to model's expected input
-    img_resized = img.resize((pp.size[1], pp.size[0]), resample=pp.resample)
-    arr = np.array(img_resized).astype(np.float32)
-    # to [0,1]
-    arr *= pp.rescale_factor
-    # normalize
-    mean = np.array(pp.image_mean, dtype=np.float32).reshape(1, 1, 3)
-    std = np.array(pp.image_std, dtype=np.float32).reshape(1, 1, 3)
-    arr = (arr - mean) / std
-    # HWC -> CHW
-    arr = np.transpose(arr, (2, 0, 1))
-    # add batch dim
-    arr = np.expand_dims(arr, 0).astype(np.float32)
-    return arr, (orig_w, orig_h)
-
-
-def make_session(model_repo: str, model_filename: str = "onnx/model.onnx", providers: Optional[list] = None) -> ort.InferenceSession:
-    model_path = hf_hub_download(repo_id=model_repo, filename=model_filename)
-    sess_opts = ort.SessionOptions()
-    # Optionally, you can tune threads for CPU
-    intra = int(os.environ.get("ORT_NUM_THREADS", "0"))
-    if intra > 0:
-        sess_opts.intra_op_num_threads = intra
-    if providers is None:
-        # Try CUDA if available, else CPU
-        providers = ["CUDAExecutionProvider", "CPUExecutionProvider"]
-    try:
-        session = ort.InferenceSession(model_path, sess_options=sess_opts, providers=providers)
-    except Exception as e:
-        print(f"Falling back to CPU due to provider error: {e}")
-        session = ort.InferenceSession(model_path, sess_options=sess_opts, providers=["CPUExecutionProvider"])
-    return session
+    # Resize to model's expected input, then rescale + normalize (folded into one scale/bias)
+    # straight into a [1,3,H,W] float32 buffer
+    return get_preprocessor(pp)(img)
 
 
-def sigmoid(x: np.ndarray) -> np.ndarray:
-    return 1.0 / (1.0 + np.exp(-x))
+def make_session(model_repo: str, model_filename: str = "onnx/model.onnx", providers: Optional[list] = None,
+                 opts: Optional[OrtOptions] = None) -> ort.InferenceSession:
+    model_path = hf_hub_download(repo_id=model_repo, filename=model_filename)
+    # Threads, optimisation level and the optimised-model cache come from `opts` (ORT_NUM_THREADS still works);
+    # providers default to CUDA if available, else CPU, with a CPU fallback on provider errors
+    return create_session(model_path, providers, opts)
 
 
 def postprocess(logits: np.ndarray, out_size: Tuple[int, int]) -> Image.Image:
     """
     logits: [1, 1, H, W] float32
     """
-    if logits.ndim == 4:
-        logits = logits[0, 0]
-    elif logits.ndim == 3:
-        logits = logits[0]
-    # Apply sigmoid as per transformers.js example
-    mask = sigmoid(logits)
-    # to 0-255 uint8
-    mask = (mask * 255.0).clip(0, 255).astype(np.uint8)
-    mask_img = Image.fromarray(mask, mode="L")
-    mask_img = mask_img.resize(out_size, resample=Image.BILINEAR)
-    return mask_img
-
-
-def save_cutout(rgb: Image.Image, alpha: Image.Image, out_path: str = "cutout.png") -> None:
-    rgba = rgb.copy()
-    rgba.putalpha(alpha)
-    rgba.save(out_path)
+    # Apply sigmoid as per transformers.js example, to 0-255 uint8, resize to the original size
+    # (shared in-place implementation, byte-identical to the plain numpy version)
+    return fast_postprocess(logits, out_size)
+
+
+def save_cutout(rgb: Image.Image, alpha: Image.Image, out_path: str = "cutout.png", inplace: bool = False) -> None:
+    # inplace=True attaches alpha to `rgb` itself (no full-size copy); `rgb` is RGBA afterwards
+    to_rgba(rgb if inplace else rgb.copy(), alpha).save(out_path)
     print(f"Saved RGBA cutout to: {out_path}")
 
 
@@ -132,30 +103,53 @@ def main():
     parser.add_argument("--save-mask", default="mask.png", help="Output path for the predicted mask PNG.")
     parser.add_argument("--save-cutout", default=None, help="Optional path for RGBA cutout PNG. If provided, saves a composited PNG with alpha.")
     parser.add_argument("--providers", default=None, help="Comma-separated ORT providers, e.g., 'CUDAExecutionProvider,CPUExecutionProvider'")
+    add_registry_args(parser)
+    add_ort_args(parser)
     args = parser.parse_args()
 
-    print(f"Loading preprocessor from: {args.repo}")
-    pp = load_preprocessor(args.repo)
+    variant = Registry(args.registry).resolve(args.variant) if args.variant else None
+    if variant is not None:
+        if variant.backend != "ort" or not variant.preprocessor:
+            parser.error(f"--variant {variant.name} needs an ONNX model with a registered preprocessor_config.json")
+        print(f"Loading preprocessor from registry: {variant.preprocessor}")
+        pp = parse_preprocessor(variant.preprocessor)
+    else:
+        print(f"Loading preprocessor from: {args.repo}")
+        pp = load_preprocessor(args.repo)
     print(f"Preprocess config: size={pp.size}, rescale_factor={pp.rescale_factor}, mean={pp.image_mean}, std={pp.image_std}")
 
     print(f"Loading image: {args.image}")
-    img = load_image(args.image)
-    arr, (orig_w, orig_h) = preprocess(img, pp)
+    if args.save_cutout is not None:
+        img = load_image(args.image)
+        arr, (orig_w, orig_h) = preprocess(img, pp)
+    else:
+        # Only the mask is needed: decode JPEGs near model resolution instead of full size
+        img, (orig_w, orig_h) = load_image_reduced(args.image, pp.size)
+        arr, _ = preprocess(img, pp)
     print(f"Preprocessed to: {arr.shape} (N,C,H,W); original size: {(orig_w, orig_h)}")
 
     providers = None
     if args.providers:
         providers = [p.strip() for p in args.providers.split(",") if p.strip()]
         print(f"Using custom ORT providers: {providers}")
-    print(f"Loading ONNX model from: {args.repo}")
-    session = make_session(args.repo, providers=providers)
+    if variant is not None:
+        print(f"Loading ONNX model from registry: {variant.path}")
+        session = create_session(variant.path, providers, options_from_args(args))
+    else:
+        print(f"Loading ONNX model from: {args.repo}")
+        session = make_session(args.repo, providers=providers, opts=options_from_args(args))
 
     in_name = session.get_inputs()[0].name
     out_name = session.get_outputs()[0].name
     print(f"Model IO: input='{in_name}', output='{out_name}'")
+    if "float16" in session.get_inputs()[0].type:  # fp16 export: feed half-precision input
+        arr = arr.astype(np.float16)
 
-    outputs = session.run([out_name], {in_name: arr})
-    logits = outputs[0]
+    if args.io_binding:
+        logits = BoundRunner(session).run(arr)
+    else:
+        outputs = session.run([out_name], {in_name: arr})
+        logits = outputs[0]
     print(f"Raw output shape: {np.array(logits).shape}, dtype={np.array(logits).dtype}")
 
     mask_img = postprocess(logits, (orig_w, orig_h))
@@ -163,7 +157,7 @@ def main():
     print(f"Saved mask to: {args.save_mask}")
 
     if args.save_cutout is not None:
-        save_cutout(img, mask_img, args.save_cutout)
+        save_cutout(img, mask_img, args.save_cutout, inplace=True)  # img is not used afterwards
 
     # Basic stats
     mask_np = np.array(mask_img)
@@ -1,14 +1,13 @@
 
 import argparse
-import io
 import json
 import os
-from dataclasses import dataclass
-from typing import Tuple, Optional
+import time
+from dataclasses import dataclass, replace
+from typing import List, Tuple, Optional
 
 import numpy as np
 from PIL import Image
-import requests
 
 # ORT import
 try:
@@ -16,11 +15,17 @@ try:
 except Exception as e:
     raise RuntimeError("onnxruntime not installed. `pip install onnxruntime` (CPU) or `pip install onnxruntime-gpu` (GPU).") from e
 
-# Optional HF import for repo-based downloads
-try:
-    from huggingface_hub import hf_hub_download
-except Exception:
-    hf_hub_download = None  # allow purely-local runs
+from birefnet_buckets import max_shape, nearest_bucket, parse_buckets
+from birefnet_cache import MaskCache, cache_namespace
+from birefnet_encode import PNG, OutputFormat, Writer, add_encode_args, with_ext
+from birefnet_fetch import Fetcher, add_fetch_args, fetcher_from_args
+from birefnet_io import collect_inputs, load_image_reduced, open_image, output_names
+from birefnet_ort import BoundRunner, OrtOptions, add_ort_args, create_session, options_from_args
+from birefnet_postprocess import APPROX, EXACT, postprocess as fast_postprocess
+from birefnet_preprocess import get_preprocessor
+from birefnet_strips import StripStats, add_strip_args, allow_large_images, check_strip_format, write_strips
+from birefnet_registry import Registry, add_registry_args
+import birefnet_trace as trace
 
 
 @dataclass
@@ -41,10 +46,18 @@ DEFAULT_PP = PreprocConfig(
 )
 
 
+def hf_download(repo_id: str, filename: str) -> str:
+    """hf_hub_download, imported on first use so local/--variant runs never load huggingface_hub."""
+    try:
+        from huggingface_hub import hf_hub_download
+    except ImportError as e:
+        raise RuntimeError("huggingface_hub not installed but repo_id was provided. Install with `pip install huggingface_hub`, "
+                           "or pass --model/--variant with --pp-json/--use-default-pp for local run.") from e
+    return hf_hub_download(repo_id=repo_id, filename=filename)
+
+
 def load_preprocessor_from_repo(repo_id: str, filename: str = "preprocessor_config.json") -> PreprocConfig:
-    if hf_hub_download is None:
-        raise RuntimeError("huggingface_hub not installed but repo_id was provided. Install with `pip install huggingface_hub`, or pass --pp-json/--use-default-pp for local run.")
-    cfg_path = hf_hub_download(repo_id=repo_id, filename=filename)
+    cfg_path = hf_download(repo_id, filename)
     return load_preprocessor_from_json(cfg_path)
 
 
@@ -61,60 +74,24 @@ def load_preprocessor_from_json(path: str) -> PreprocConfig:
 
 
 def load_image(img_path_or_url: str) -> Image.Image:
-    if img_path_or_url.startswith(("http://", "https://")):
-        resp = requests.get(img_path_or_url, timeout=30)
-        resp.raise_for_status()
-        return Image.open(io.BytesIO(resp.content)).convert("RGB")
-    return Image.open(img_path_or_url).convert("RGB")
-
-
-def preprocess(img: Image.Image, pp: PreprocConfig):
-    orig_w, orig_h = img.width, img.height
-    img_resized = img.resize((pp.size[1], pp.size[0]), resample=pp.resample)
-    arr = np.array(img_resized).astype(np.float32)
-    arr *= pp.rescale_factor
-    mean = np.array(pp.image_mean, dtype=np.float32).reshape(1, 1, 3)
-    std = np.array(pp.image_std, dtype=np.float32).reshape(1, 1, 3)
-    arr = (arr - mean) / std
-    arr = np.transpose(arr, (2, 0, 1))  # HWC->CHW
-    arr = np.expand_dims(arr, 0).astype(np.float32)  # NCHW
-    return arr, (orig_w, orig_h)
-
-
-def make_session(model_path: str, providers: Optional[list] = None) -> ort.InferenceSession:
-    sess_opts = ort.SessionOptions()
-    intra = int(os.environ.get("ORT_NUM_THREADS", "0"))
-    if intra > 0:
-        sess_opts.intra_op_num_threads = intra
-    if providers is None:
-        providers = ["CUDAExecutionProvider", "CPUExecutionProvider"]
-    try:
-        return ort.InferenceSession(model_path, sess_options=sess_opts, providers=providers)
-    except Exception as e:
-        print(f"[WARN] Provider error '{e}'. Falling back to CPUExecutionProvider.")
-        return ort.InferenceSession(model_path, sess_options=sess_opts, providers=["CPUExecutionProvider"])
+    img = open_image(img_path_or_url)
+    return img if img.mode == "RGB" else img.convert("RGB")  # convert() to the same mode is a full copy
 
 
-def sigmoid(x: np.ndarray) -> np.ndarray:
-    return 1.0 / (1.0 + np.exp(-x))
+def preprocess(img: Image.Image, pp: PreprocConfig, out: Optional[np.ndarray] = None):
+    """Returns ([1,3,H,W] float32, (orig_w, orig_h)); pass `out` (e.g. a batch slot) to fill it in place."""
+    return get_preprocessor(pp)(img, out)
 
 
-def postprocess(logits: np.ndarray, out_size: Tuple[int, int]) -> Image.Image:
-    if logits.ndim == 4:
-        logits = logits[0, 0]
-    elif logits.ndim == 3:
-        logits = logits[0]
-    mask = sigmoid(logits)
-    mask = (mask * 255.0).clip(0, 255).astype(np.uint8)
-    mask_img = Image.fromarray(mask, mode="L").resize(out_size, resample=Image.BILINEAR)
-    return mask_img
+def make_session(model_path: str, providers: Optional[list] = None,
+                 opts: Optional[OrtOptions] = None) -> ort.InferenceSession:
+    """See birefnet_ort.create_session (optimisation level, threads, optimised-model cache, CPU fallback)."""
+    return create_session(model_path, providers, opts)
 
 
-def save_cutout(rgb: Image.Image, alpha: Image.Image, out_path: str):
-    rgba = rgb.copy()
-    rgba.putalpha(alpha)
-    rgba.save(out_path)
-    print(f"Saved RGBA cutout: {out_path}")
+def postprocess(logits: np.ndarray, out_size: Tuple[int, int], approx: bool = False) -> Image.Image:
+    """sigmoid -> uint8 -> bilinear resize; byte-identical to the float reference unless `approx`."""
+    return fast_postprocess(logits, out_size, approx=approx)
 
 
 def resolve_model_path(repo: Optional[str], local_model: Optional[str]) -> str:
@@ -123,10 +100,8 @@ def resolve_model_path(repo: Optional[str], local_model: Optional[str]) -> str:
             raise FileNotFoundError(f"Local model not found: {local_model}")
         return local_model
     if repo:
-        if hf_hub_download is None:
-            raise RuntimeError("huggingface_hub not installed and no local --model provided.")
-        return hf_hub_download(repo_id=repo, filename="onnx/model.onnx")
-    raise ValueError("Please provide either --model (local .onnx) or --repo (HF repo id).")
+        return hf_download(repo, "onnx/model.onnx")
+    raise ValueError("Please provide either --model (local .onnx), --variant (offline registry) or --repo (HF repo id).")
 
 
 def resolve_preproc(repo: Optional[str], pp_json: Optional[str], use_default: bool) -> PreprocConfig:
@@ -142,48 +117,311 @@ def resolve_preproc(repo: Optional[str], pp_json: Optional[str], use_default: bo
     raise ValueError("No preprocessor provided. Use --pp-json, or --repo, or --use-default-pp.")
 
 
+def input_dtype(sess: ort.InferenceSession):
+    """float16 for fp16 models (e.g. the registry's fp16 variant), else float32."""
+    return np.float16 if "float16" in sess.get_inputs()[0].type else np.float32
+
+
+def session_batch_size(sess: ort.InferenceSession, requested: int) -> int:
+    dim = sess.get_inputs()[0].shape[0]
+    if isinstance(dim, int) and dim > 0 and dim != requested:
+        print(f"[WARN] Model input has a fixed batch dim of {dim}; using --batch-size {dim}.")
+        return dim
+    return max(1, requested)
+
+
+def run_batch(sess: ort.InferenceSession, paths: List[str], pp: PreprocConfig, batch_size: int,
+              out_dir: str, cutout_dir: Optional[str] = None, approx: bool = False,
+              io_binding: bool = False, cache: Optional[MaskCache] = None,
+              buckets: Optional[List[Tuple[int, int]]] = None, fetcher: Optional[Fetcher] = None,
+              writer: Optional[Writer] = None, mask_fmt: OutputFormat = PNG, cutout_fmt: OutputFormat = PNG,
+              strip_rows: int = 0) -> dict:
+    """Run `paths` through `sess` in [N,3,H,W] batches and save one mask per image at its original size.
+
+    The last batch is zero-padded up to `batch_size` so the session always sees the same input shape.
+    With `io_binding`, the batch tensor is the bound input buffer and logits land in a reused output buffer.
+    Images found in `cache` skip the batch entirely; new low-res masks are added to it.
+    With `buckets` ((h, w) shapes), each image goes to the bucket nearest its aspect ratio and batches are
+    formed per bucket; every bucket shape is run once up front so no batch pays a new shape's first run.
+    Inputs are loaded through `fetcher` (inline by default); with fetch workers, URLs are downloaded and
+    decoded on a pooled session while the session runs the previous batch. Masks and cutouts are written
+    in `mask_fmt` / `cutout_fmt` through `writer` (inline by default; it is closed before returning), or with
+    `strip_rows` upsampled and streamed to disk that many rows at a time (inline, memory-bounded).
+    """
+    in_name = sess.get_inputs()[0].name
+    out_name = sess.get_outputs()[0].name
+    batch_size = session_batch_size(sess, batch_size)
+    os.makedirs(out_dir, exist_ok=True)
+    if cutout_dir:
+        os.makedirs(cutout_dir, exist_ok=True)
+    mask_paths = [with_ext(p, mask_fmt) for p in output_names(paths, out_dir)]
+    writer = writer or Writer(workers=0)
+
+    shapes = [tuple(s) for s in buckets] if buckets else [tuple(pp.size)]
+    runners = {s: BoundRunner(sess) for s in shapes} if io_binding else {}
+    dtype = input_dtype(sess)
+    pres = {s: get_preprocessor(replace(pp, size=s), dtype) for s in shapes}
+    # reused for every batch of a shape; images are written into their slot
+    batches = {s: runners[s].input_buffer((batch_size, 3) + s) if runners else pres[s].new_batch(batch_size)
+               for s in shapes}
+    pending = {s: [] for s in shapes}
+    decode_size = max_shape(shapes)
+    post = APPROX if approx else EXACT
+    done, failed, infer_s = 0, 0, 0.0
+    per_bucket = {s: 0 for s in shapes}
+
+    def infer(s):
+        with trace.span("infer"):
+            return runners[s].run(copy=False) if runners else sess.run([out_name], {in_name: batches[s]})[0]
+
+    if buckets:
+        for s in shapes:
+            infer(s)
+    t_start = time.perf_counter()
+
+    def finish(img, size, mask_path, low):
+        cutout_path = with_ext(os.path.join(cutout_dir, os.path.basename(mask_path)), cutout_fmt) if cutout_dir else None
+        if strip_rows:
+            write_outputs_in_strips(writer, low, size, mask_path, mask_fmt, img, cutout_path, cutout_fmt, strip_rows, approx)
+            return
+        mask_img = post.resize(low, size)
+        writer.submit(mask_img, mask_path, mask_fmt)
+        if cutout_path:
+            writer.submit(img, cutout_path, cutout_fmt, "cutout", alpha=mask_img)
+
+    def flush(s):
+        nonlocal done, infer_s
+        items = pending[s]
+        batches[s][len(items):] = 0  # zero-pad the tail of a short batch
+        t0 = time.perf_counter()
+        logits = infer(s)
+        infer_s += time.perf_counter() - t0
+        for i, (img, size, mask_path, key) in enumerate(items):
+            low = post.to_uint8(logits[i:i + 1])
+            if cache:
+                cache.put(key, low)
+            finish(img, size, mask_path, low)
+        done += len(items)
+        per_bucket[s] += len(items)
+        items.clear()
+        elapsed = time.perf_counter() - t_start
+        print(f"[batch] {done}/{len(paths)} images  {done / elapsed:.2f} img/s")
+
+    fetcher = fetcher or Fetcher(workers=0)
+    # masks only: decode near model resolution
+    for r, mask_path in zip(fetcher.imap(paths, None if cutout_dir else decode_size), mask_paths):
+        if r.error:
+            print(f"[WARN] Skipping {r.source}: {r.error}")
+            failed += 1
+            continue
+        img, size = r.image, r.size
+        key = cache.key(img) if cache else None
+        low = cache.get(key) if cache else None
+        if low is not None:  # cache hit: no preprocessing, no inference
+            finish(img, size, mask_path, low)
+            done += 1
+            continue
+        s = nearest_bucket(size, shapes) if buckets else shapes[0]
+        pres[s].into(img, batches[s][len(pending[s])])
+        pending[s].append((img, size, mask_path, key))
+        if len(pending[s]) == batch_size:
+            flush(s)
+    for s in shapes:
+        if pending[s]:
+            flush(s)
+    writer.join()
+
+    total_s = time.perf_counter() - t_start
+    stats = {
+        "images": done,
+        "failed": failed,
+        "batch_size": batch_size,
+        "total_s": total_s,
+        "infer_s": infer_s,
+        "images_per_s": done / total_s if total_s > 0 else 0.0,
+        "infer_images_per_s": done / infer_s if infer_s > 0 else 0.0,
+    }
+    print(f"Batch done -> {done} images ({failed} failed) in {total_s:.2f}s  "
+          f"end-to-end {stats['images_per_s']:.2f} img/s  inference {stats['infer_images_per_s']:.2f} img/s  "
+          f"(batch size {batch_size})")
+    if buckets:
+        stats["buckets"] = {f"{w}x{h}": n for (h, w), n in per_bucket.items()}
+        print("Buckets -> " + ", ".join(f"{k}: {n}" for k, n in stats["buckets"].items()))
+    if cache:
+        stats.update(cache.stats())
+        print(cache.summary())
+    print(writer.summary())
+    if fetcher.stats.urls:
+        stats["fetch_mb"] = fetcher.stats.bytes / 2**20
+        stats["fetch_retries"] = fetcher.stats.retries
+        print(fetcher.stats.summary())
+    writer.close()  # after the report: raises if any output could not be written
+    return stats
+
+
+def write_outputs_in_strips(writer: Writer, low: np.ndarray, size: Tuple[int, int], mask_path: str,
+                            mask_fmt: OutputFormat, img: Optional[Image.Image], cutout_path: Optional[str],
+                            cutout_fmt: OutputFormat, strip_rows: int, approx: bool):
+    """Strip-wise mask (and cutout) output, counted in `writer`'s per-format stats and errors; returns the StripStats."""
+    try:
+        st = write_strips(low, size, mask_path, mask_fmt, img, cutout_path, cutout_fmt, strip_rows, approx)
+    except Exception as e:  # same policy as the writer: report, carry on, `writer.close()` raises
+        writer.record_error(mask_path, e)
+        return StripStats()
+    # upsampling runs once for both files; it is counted with the mask
+    writer.record("mask", mask_fmt, os.path.getsize(mask_path), st.upsample_s + (st.write_s if not cutout_path else 0.0))
+    if cutout_path:
+        writer.record("cutout", cutout_fmt, os.path.getsize(cutout_path), st.write_s)
+    return st
+
+
+def finish_trace(sess: ort.InferenceSession, args):
+    """Import ORT's operator profile (with --profile-ops) and write --trace."""
+    tracer = trace.active()
+    if tracer is not None and args.profile_ops:
+        tracer.add_ort_profile(sess)
+    trace.finish(args.trace)
+
+
+def session_buckets(sess: ort.InferenceSession, spec: Optional[str], pp: PreprocConfig) -> Optional[List[Tuple[int, int]]]:
+    """Parse --buckets, or None (with a warning) when the model's height/width are fixed."""
+    if not spec:
+        return None
+    dims = sess.get_inputs()[0].shape[2:]
+    if all(isinstance(d, int) and d > 0 for d in dims):
+        print(f"[WARN] Model input has a fixed size {dims[1]}x{dims[0]}; ignoring --buckets.")
+        return None
+    return parse_buckets(spec, pp.size)
+
+
 def main():
     ap = argparse.ArgumentParser(description="BiRefNet ONNX inference (supports local .onnx).")
     ap.add_argument("--repo", help="HF repo id (e.g., onnx-community/BiRefNet-ONNX).")
     ap.add_argument("--model", help="Local path to model.onnx (e.g., ./model_fp16.onnx).")
     ap.add_argument("--pp-json", help="Path to preprocessor_config.json if running locally.")
     ap.add_argument("--use-default-pp", action="store_true", help="Fallback to default preprocess if pp-json not provided.")
-    ap.add_argument("--image", required=True, help="URL or local image path.")
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--image", help="URL or local image path.")
+    src.add_argument("--input", help="Batch mode: image directory, glob pattern, or manifest (.txt/.lst, one path/URL per line).")
     ap.add_argument("--save-mask", default="mask.png")
-    ap.add_argument("--save-cutout", default=None)
+    ap.add_argument("--save-cutout", default=None, help="Cutout PNG path (batch mode: output directory for cutouts).")
+    ap.add_argument("--out-dir", default="masks", help="Batch mode: output directory for masks.")
+    ap.add_argument("--batch-size", type=int, default=4, help="Batch mode: images per sess.run call.")
+    ap.add_argument("--approx-postprocess", action="store_true",
+                    help="Faster, approximate mask postprocess (fp16 lookup + two-step upsample).")
     ap.add_argument("--providers", default=None, help="Comma-separated ORT EPs, e.g. 'CUDAExecutionProvider,CPUExecutionProvider'")
+    ap.add_argument("--mask-cache", default=None,
+                    help="Directory of a content-addressed low-res mask cache; repeat images skip inference.")
+    ap.add_argument("--mask-cache-mb", type=int, default=512, help="Mask cache size bound (LRU eviction).")
+    ap.add_argument("--buckets", default=None,
+                    help="Aspect-ratio input shapes (WxH, e.g. 512x512,704x384,384x704), or 'default' "
+                         "(defaults scaled to the model size); needs dynamic H/W.")
+    add_registry_args(ap)
+    add_fetch_args(ap)
+    add_encode_args(ap)
+    add_strip_args(ap)
+    add_ort_args(ap)
+    trace.add_trace_args(ap)
     args = ap.parse_args()
-
-    pp = resolve_preproc(args.repo, args.pp_json, args.use_default_pp)
-    img = load_image(args.image)
-    arr, (ow, oh) = preprocess(img, pp)
+    if args.trace:
+        trace.enable()
+    if args.strip_rows:
+        try:
+            check_strip_format(args.mask_format)
+            check_strip_format(args.cutout_format)
+        except ValueError as e:
+            ap.error(str(e))
+        allow_large_images()
+
+    variant = Registry(args.registry).resolve(args.variant) if args.variant else None
+    if variant is not None and variant.backend != "ort":
+        ap.error(f"--variant {variant.name} is a {variant.backend} model; use birefnet_infer_mnn.py")
+    if variant is not None and not args.pp_json:
+        if variant.preprocessor:
+            print(f"Loading preprocessor config from registry: {variant.preprocessor}")
+            pp = load_preprocessor_from_json(variant.preprocessor)
+        else:
+            pp = resolve_preproc(None, None, True)
+    else:
+        pp = resolve_preproc(args.repo, args.pp_json, args.use_default_pp)
 
     if args.providers:
         providers = [p.strip() for p in args.providers.split(",") if p.strip()]
     else:
         providers = None
 
-    model_path = resolve_model_path(args.repo, args.model)
+    model_path = variant.path if variant is not None else resolve_model_path(args.repo, args.model)
     print(f"Using model: {model_path}")
-    sess = make_session(model_path, providers=providers)
+    sess = make_session(model_path, providers=providers, opts=options_from_args(args))
+    buckets = session_buckets(sess, args.buckets, pp)
+    cache = None
+    if args.mask_cache:
+        cache = MaskCache(args.mask_cache, args.mask_cache_mb * 2**20,
+                          cache_namespace(model_path, pp, args.approx_postprocess, buckets))
+
+    if args.input:
+        paths = collect_inputs(args.input)
+        print(f"Batch mode: {len(paths)} images from {args.input}")
+        run_batch(sess, paths, pp, args.batch_size, args.out_dir, args.save_cutout, args.approx_postprocess,
+                  args.io_binding, cache, buckets, fetcher_from_args(args), Writer(args.writers),
+                  args.mask_format, args.cutout_format, args.strip_rows)
+        finish_trace(sess, args)
+        return
+
+    with trace.span("decode"):
+        if args.save_cutout:
+            img = load_image(args.image)
+            ow, oh = img.size
+        else:  # only the mask is needed: decode near model resolution
+            img, (ow, oh) = load_image_reduced(args.image, max_shape(buckets) if buckets else pp.size)
+    if buckets:
+        pp = replace(pp, size=nearest_bucket((ow, oh), buckets))
+        print(f"Bucket: {pp.size[1]}x{pp.size[0]}")
 
     in_name = sess.get_inputs()[0].name
     out_name = sess.get_outputs()[0].name
     print(f"Model IO -> input: '{in_name}', output: '{out_name}'")
 
-    outputs = sess.run([out_name], {in_name: arr})
-    logits = outputs[0]
-
-    mask_img = postprocess(logits, (ow, oh))
-    mask_img.save(args.save_mask)
-    print(f"Saved mask: {args.save_mask}")
-
-    if args.save_cutout:
-        save_cutout(img, mask_img, args.save_cutout)
+    post = APPROX if args.approx_postprocess else EXACT
+    key = cache.key(img) if cache else None
+    low = cache.get(key) if cache else None
+    if low is None:
+        arr, _ = get_preprocessor(pp, input_dtype(sess))(img)
+        with trace.span("infer"):
+            if args.io_binding:
+                logits = BoundRunner(sess).run(arr)
+            else:
+                outputs = sess.run([out_name], {in_name: arr})
+                logits = outputs[0]
+        low = post.to_uint8(logits)
+        if cache:
+            cache.put(key, low)
+    if cache:
+        print(cache.summary())
+
+    writer = Writer(workers=0)
+    mask_path = with_ext(args.save_mask, args.mask_format)
+    cutout_path = with_ext(args.save_cutout, args.cutout_format) if args.save_cutout else None
+    if args.strip_rows:
+        st = write_outputs_in_strips(writer, low, (ow, oh), mask_path, args.mask_format, img, cutout_path,
+                                     args.cutout_format, args.strip_rows, args.approx_postprocess)
+        stats = (st.mask_min, st.mask_max, st.mask_mean)
+    else:
+        mask_img = post.resize(low, (ow, oh))
+        writer.submit(mask_img, mask_path, args.mask_format)
+        if cutout_path:
+            writer.submit(img, cutout_path, args.cutout_format, "cutout", alpha=mask_img)
+        m = np.array(mask_img)
+        stats = (m.min(), m.max(), m.mean())
+    writer.close()
+    print(f"Saved mask: {mask_path}")
+    if cutout_path:
+        print(f"Saved RGBA cutout: {cutout_path}")
+    print(writer.summary())
 
     # Stats
-    m = np.array(mask_img)
-    print(f"Mask stats -> min {m.min()}  max {m.max()}  mean {m.mean():.2f}")
+    print(f"Mask stats -> min {stats[0]}  max {stats[1]}  mean {stats[2]:.2f}")
+    finish_trace(sess, args)
 
 
 if __name__ == "__main__":
@@ -1,110 +1,345 @@
-import argparse, io, os, numpy as np
+import argparse, os, threading, time
+import numpy as np
 from PIL import Image
-import requests
 
 import MNN
 
+from birefnet_buckets import max_shape, nearest_bucket, parse_buckets
+from birefnet_io import load_image_reduced, open_image
+from birefnet_postprocess import postprocess as fast_postprocess, to_rgba
+from birefnet_preprocess import Preprocessor
+import birefnet_trace as trace
+
 MEAN = (0.485, 0.456, 0.406)
 STD  = (0.229, 0.224, 0.225)
 H, W = 512, 512                  # 你的模型固定输入
 
 def load_image(p):
-    if p.startswith("http"):
-        r = requests.get(p, timeout=30); r.raise_for_status()
-        img = Image.open(io.BytesIO(r.content)).convert("RGB")
-    else:
-        img = Image.open(p).convert("RGB")
-    return img
+    return open_image(p).convert("RGB")   # URL 走共享连接池（birefnet_fetch）
+
+PRE = Preprocessor((H, W), 1.0 / 255.0, MEAN, STD, Image.BILINEAR)  # 归一化折叠为单个 scale/bias
+
+def preprocess(img, out=None):
+    return PRE(img, out)   # NCHW float32, (ow, oh)
+
+_PRES = {(H, W): PRE}
+
+def bucket_preprocessor(shape):
+    """(h, w) 形状桶对应的 Preprocessor（与 PRE 同样的归一化），按形状缓存。"""
+    shape = (int(shape[0]), int(shape[1]))
+    if shape not in _PRES:
+        _PRES[shape] = Preprocessor(shape, 1.0 / 255.0, MEAN, STD, Image.BILINEAR)
+    return _PRES[shape]
+
+
+class BiRefNetMNN:
+    """常驻 MNN 推理引擎（对应 jni/src/BiRefNetEngine.cpp）。
+
+    模型与 session 只创建一次；仅当输入 shape 变化时才 resizeTensor/resizeSession，
+    host 侧输入/输出张量按 shape 缓存复用。run() 加锁，可在工作线程循环中反复调用。
+
+    MNN Python 带 numpy 支持时（Tensor.getNumpyData），输入直接写入 host 缓冲区、
+    输出以 numpy 视图返回，不经过逐元素的 Python tuple；否则退回 getData() 旧路径。
+    传入 interp 时在已有 Interpreter 上再建一个 session，权重只加载一份。
+    """
+
+    def __init__(self, mnn_path, threads=4, in_name="input_image", out_name="output_image",
+                 precision="low", numpy_io=None, profile_ops=False, interp=None):
+        t0 = time.perf_counter()
+        self.profile_ops = profile_ops  # 开启 trace 时逐算子计时（runSessionWithCallBackInfo）
+        self.mnn_path = mnn_path
+        self.threads = int(threads)
+        self.in_name, self.out_name = in_name, out_name
+        self.numpy_io = hasattr(MNN.Tensor, "getNumpyData") if numpy_io is None else bool(numpy_io)
+        self.interp = interp if interp is not None else MNN.Interpreter(mnn_path)
+        self.sess = self._create_session(precision)
+        # 取输入张量（若名字不匹配，退化为第一个）
+        try:
+            self.tin = self.interp.getSessionInput(self.sess, in_name)
+        except Exception:
+            self.tin = self.interp.getSessionInput(self.sess)
+        self.in_shape = None
+        self.tout = self.host_in = self.host_out = None
+        self.in_view = self.out_view = None
+        self.lock = threading.Lock()
+        self.load_s = time.perf_counter() - t0
+        self.timings = {"cold": [], "warm": [], "copy_in": [], "copy_out": []}
+
+    def _create_session(self, precision):
+        # 兼容不同版本 API：有 Session_Config 就用，否则用 dict 配置（MNN 2.x/3.x）
+        if hasattr(MNN, "Session_Config"):
+            conf = MNN.Session_Config()
+            conf.numThread = self.threads
+            if hasattr(MNN, "BackendConfig"):
+                bc = MNN.BackendConfig()
+                bc.precision = getattr(MNN.BackendConfig, "Precision_" + precision.capitalize(), 0)
+                conf.backendConfig = bc
+            return self.interp.createSession(conf)
+        try:
+            return self.interp.createSession({"numThread": self.threads, "precision": precision})
+        except Exception:
+            if hasattr(MNN, "setCPUThreads"):
+                MNN.setCPUThreads(self.threads)
+            return self.interp.createSession()
+
+    def _ensure_shape(self, shape):
+        """shape 不变时直接返回 False；变化时 resize 并重建 host 张量，返回 True。"""
+        if shape == self.in_shape:
+            return False
+        self.interp.resizeTensor(self.tin, shape)
+        self.interp.resizeSession(self.sess)
+        self.host_in = MNN.Tensor(shape, MNN.Halide_Type_Float, np.zeros(shape, np.float32),
+                                  MNN.Tensor_DimensionType_Caffe)
+        # 取输出（同理，名字不匹配就取第一个）；resizeSession 后需重新获取
+        try:
+            self.tout = self.interp.getSessionOutput(self.sess, self.out_name)
+        except Exception:
+            self.tout = self.interp.getSessionOutput(self.sess)
+        out_shape = tuple(int(d) for d in self.tout.getShape())
+        self.host_out = MNN.Tensor(out_shape, MNN.Halide_Type_Float, np.zeros(out_shape, np.float32),
+                                   MNN.Tensor_DimensionType_Caffe)
+        if self.numpy_io:
+            try:
+                # 视图指向 host 张量自身的内存，张量存活期间一直有效
+                self.in_view = self.host_in.getNumpyData()
+                self.out_view = self.host_out.getNumpyData()
+            except Exception:  # MNN 编译时未带 numpy
+                self.numpy_io = False
+                self.in_view = self.out_view = None
+        self.in_shape = shape
+        return True
+
+    def input_buffer(self, shape):
+        """返回 host 输入缓冲区的 NCHW float32 视图，预处理可直接写入，随后调用 run()（不传 x）。
+
+        缓冲区由引擎独占，多线程共用同一引擎时调用方需保证“写入 + run()”不被打断。
+        """
+        shape = tuple(int(d) for d in shape)
+        with self.lock:
+            self._ensure_shape(shape)
+            if not self.numpy_io:
+                raise RuntimeError("MNN build has no numpy support; pass the array to run() instead.")
+            return self.in_view
+
+    def _write_input(self, x):
+        if self.numpy_io:
+            if x is not self.in_view:
+                np.copyto(self.in_view, x, casting="same_kind")  # 单次 memcpy（必要时顺带转 float32）
+        else:
+            x = np.ascontiguousarray(x, dtype=np.float32)
+            self.host_in = MNN.Tensor(self.in_shape, MNN.Halide_Type_Float, x, MNN.Tensor_DimensionType_Caffe)
+
+    def _read_output(self, copy):
+        if self.numpy_io:
+            return self.out_view.copy() if copy else self.out_view
+        return np.array(self.host_out.getData(), dtype=np.float32).reshape(self.host_out.getShape())
+
+    def run(self, x=None, copy=True):
+        """推理一次并返回 logits。
+
+        x 为 None 时使用 input_buffer() 中已写入的数据。copy=False 时直接返回 host 输出视图，
+        下一次 run() 会覆盖其内容。
+        """
+        with self.lock:
+            t0 = time.perf_counter()
+            if x is None:
+                if self.in_shape is None:
+                    raise RuntimeError("No input: pass x or fill input_buffer() first.")
+                cold = not (self.timings["cold"] or self.timings["warm"])
+            else:
+                shape = tuple(int(d) for d in x.shape)  # 一定要 tuple
+                cold = self._ensure_shape(shape) or not (self.timings["cold"] or self.timings["warm"])
+                self._write_input(x)
+            t1 = time.perf_counter()
+            self.tin.copyFrom(self.host_in)
+            tracer = trace.active() if self.profile_ops else None
+            if tracer is not None:
+                self.interp.runSessionWithCallBackInfo(self.sess, *tracer.mnn_callbacks())
+            else:
+                self.interp.runSession(self.sess)
+            self.tout.copyToHostTensor(self.host_out)
+            t2 = time.perf_counter()
+            y = self._read_output(copy)
+            t3 = time.perf_counter()
+            self.timings["copy_in"].append(t1 - t0)
+            self.timings["copy_out"].append(t3 - t2)
+            self.timings["cold" if cold else "warm"].append(t3 - t0)
+        return y
+
+    def latency_report(self):
+        cold, warm = self.timings["cold"], self.timings["warm"]
+        lines = [f"[mnn] load {self.load_s * 1000:.1f} ms  threads {self.threads}  "
+                 f"io {'numpy' if self.numpy_io else 'getData'}"]
+        if cold:
+            lines.append(f"[mnn] cold runs {len(cold)}: mean {1000 * sum(cold) / len(cold):.1f} ms")
+        if warm:
+            w = sorted(warm)
+            lines.append(f"[mnn] warm runs {len(w)}: mean {1000 * sum(w) / len(w):.1f} ms  "
+                         f"p50 {1000 * w[len(w) // 2]:.1f} ms  min {1000 * w[0]:.1f} ms")
+        cin, cout = self.timings["copy_in"], self.timings["copy_out"]
+        if cin:
+            lines.append(f"[mnn] host copy per call: in {1000 * sum(cin) / len(cin):.2f} ms  "
+                         f"out {1000 * sum(cout) / len(cout):.2f} ms")
+        return "\n".join(lines)
+
 
-def preprocess(img):
-    ow, oh = img.width, img.height
-    img = img.resize((W, H), Image.BILINEAR)
-    x = np.asarray(img).astype(np.float32) / 255.0
-    x = (x - MEAN) / STD
-    x = x.transpose(2,0,1)[None, ...]   # NCHW
-    return x, (ow, oh)
+class BucketedMNN:
+    """每个形状桶一个 session，各自固定在该形状，切换桶时不再 resizeSession。
+
+    所有 session 共用一个 Interpreter，权重只加载一份，每桶只多出激活与 host 张量的内存。
+    warm=True 时构造时每个桶各推理一次预热（常驻服务）；否则首次用到某桶时才建 session（单次命令行）。
+    preprocess(img) 按长宽比选桶，run(x) 按 x 的 (H, W) 选择 session；各 session 不并发执行（共用一把锁）。
+    """
+
+    def __init__(self, mnn_path, shapes, threads=4, in_name="input_image", out_name="output_image",
+                 warm=True, profile_ops=False):
+        self.mnn_path, self.threads = mnn_path, threads
+        self.in_name, self.out_name, self.profile_ops = in_name, out_name, profile_ops
+        self.shapes = list(dict.fromkeys((int(h), int(w)) for h, w in shapes))
+        self.size = max_shape(self.shapes)  # 按各桶最大边缩小解码
+        self.interp = MNN.Interpreter(mnn_path)
+        self.lock = threading.Lock()
+        self.engines = {}
+        self._current = None
+        if warm:
+            for h, w in self.shapes:
+                self._engine((h, w)).run(np.zeros((1, 3, h, w), np.float32))  # 预热：分配该形状的 host 张量与 session 内存
+
+    @property
+    def numpy_io(self):
+        return hasattr(MNN.Tensor, "getNumpyData") and all(e.numpy_io for e in self.engines.values())
+
+    def _engine(self, shape):
+        if shape not in self.shapes:
+            raise ValueError(f"no bucket engine for input shape {shape}")
+        if shape not in self.engines:
+            self.engines[shape] = BiRefNetMNN(self.mnn_path, self.threads, self.in_name, self.out_name,
+                                              profile_ops=self.profile_ops, interp=self.interp)
+        return self.engines[shape]
+
+    def preprocess(self, img, out=None):
+        return bucket_preprocessor(nearest_bucket(img.size, self.shapes))(img, out)
+
+    def input_buffer(self, shape):
+        """所选桶 session 的 host 输入缓冲区；随后调用 run()（不传 x）即在该桶上推理。"""
+        with self.lock:
+            self._current = self._engine(tuple(int(d) for d in shape[2:]))
+            return self._current.input_buffer(shape)
+
+    def run(self, x=None, copy=True):
+        with self.lock:
+            if x is not None:
+                self._current = self._engine(tuple(int(d) for d in x.shape[2:]))
+            elif self._current is None:
+                raise RuntimeError("No input: pass x or fill input_buffer() first.")
+            return self._current.run(x, copy)
+
+    def latency_report(self):
+        return "\n".join(f"[bucket {w}x{h}]\n{e.latency_report()}" for (h, w), e in self.engines.items())
+
+
+def io_bench(mnn_path, x, runs=10, threads=4):
+    """对比 getData() 旧路径与 numpy 视图路径的拷贝耗时和单次调用峰值内存（tracemalloc）。"""
+    import tracemalloc
+    for numpy_io in (False, True):
+        if numpy_io and not hasattr(MNN.Tensor, "getNumpyData"):
+            print("[io] numpy path unavailable in this MNN build")
+            continue
+        engine = BiRefNetMNN(mnn_path, threads=threads, numpy_io=numpy_io)
+        engine.run(x)  # 预热，分配 host 张量
+        peaks = []
+        for _ in range(runs):
+            tracemalloc.start()
+            engine.run(x)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        cin, cout = engine.timings["copy_in"][1:], engine.timings["copy_out"][1:]
+        print(f"[io] {'numpy  ' if engine.numpy_io else 'getData'}  copy in {1000 * sum(cin) / len(cin):.2f} ms  "
+              f"copy out {1000 * sum(cout) / len(cout):.2f} ms  peak py alloc {max(peaks) / 2**20:.2f} MiB/call")
+
+
+_ENGINES = {}
+
+
+def get_engine(mnn_path, threads=4, in_name="input_image", out_name="output_image"):
+    """按 (模型, 线程数, IO 名) 复用引擎，避免每次调用重建 Interpreter。"""
+    key = (os.path.abspath(mnn_path), int(threads), in_name, out_name)
+    if key not in _ENGINES:
+        _ENGINES[key] = BiRefNetMNN(mnn_path, threads, in_name, out_name)
+    return _ENGINES[key]
 
-def sigmoid(x): return 1/(1+np.exp(-x))
 
 def run_mnn(mnn_path, x, in_name="input_image", out_name="output_image", threads=4):
-    import MNN
-    x = np.ascontiguousarray(x.astype(np.float32))
-    interp = MNN.Interpreter(mnn_path)
-
-    # 兼容不同版本 API：有 Session_Config 就用，没有就用全局线程数
-    if hasattr(MNN, "Session_Config"):
-        conf = MNN.Session_Config()
-        conf.numThread = int(threads)
-        if hasattr(MNN, "BackendConfig"):
-            bc = MNN.BackendConfig()
-            bc.precision = getattr(MNN.BackendConfig, "Precision_Low", 0)  # 可改 High/Normal
-            conf.backendConfig = bc
-        sess = interp.createSession(conf)
-    else:
-        if hasattr(MNN, "setCPUThreads"):
-            MNN.setCPUThreads(int(threads))
-        sess = interp.createSession()
-
-    # 取输入张量（若名字不匹配，退化为第一个）
-    try:
-        tin = interp.getSessionInput(sess, in_name)
-    except Exception:
-        tin = interp.getSessionInput(sess)
-
-    in_shape = tuple(int(d) for d in x.shape)  # 一定要 tuple
-    interp.resizeTensor(tin, in_shape)
-    interp.resizeSession(sess)
-
-    # 拷贝输入
-    tmp = MNN.Tensor(in_shape, MNN.Halide_Type_Float, x, MNN.Tensor_DimensionType_Caffe)
-    tin.copyFrom(tmp)
-
-    # 执行
-    interp.runSession(sess)
-
-    # 取输出（同理，名字不匹配就取第一个）
-    try:
-        tout = interp.getSessionOutput(sess, out_name)
-    except Exception:
-        tout = interp.getSessionOutput(sess)
-
-    out_shape = tuple(int(d) for d in tout.getShape())
-    host = MNN.Tensor(out_shape, MNN.Halide_Type_Float,
-                      np.empty(out_shape, dtype=np.float32),
-                      MNN.Tensor_DimensionType_Caffe)
-    tout.copyToHostTensor(host)
-    y = np.array(host.getData(), dtype=np.float32).reshape(out_shape)
-    return y
-
-
-def postprocess(logits, out_size):
-    if logits.ndim == 4:
-        logits = logits[0,0]
-    elif logits.ndim == 3:
-        logits = logits[0]
-    m = (sigmoid(logits) * 255).clip(0,255).astype(np.uint8)
-    return Image.fromarray(m, "L").resize(out_size, Image.BILINEAR)
-
-def save_cutout(rgb, alpha, path):
-    rgba = rgb.copy(); rgba.putalpha(alpha); rgba.save(path)
+    return get_engine(mnn_path, threads, in_name, out_name).run(x)
+
+
+def postprocess(logits, out_size, approx=False):
+    return fast_postprocess(logits, out_size, approx=approx)   # 默认与原 numpy 实现逐字节一致
+
+def save_cutout(rgb, alpha, path, inplace=False):
+    to_rgba(rgb if inplace else rgb.copy(), alpha).save(path)   # inplace=True：原地附加 alpha，不复制整幅原图，rgb 随之变为 RGBA
 
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
-    ap.add_argument("--mnn", required=True)
+    ap.add_argument("--mnn", default=None, help="MNN 模型路径（或用 --variant 从离线模型清单解析）")
     ap.add_argument("--image", required=True)
     ap.add_argument("--save-mask", default="mask_mnn.png")
-    ap.add_argument("--save-cutout", default="cutout_mnn.png")
+    ap.add_argument("--save-cutout", default=None, help="RGBA 抠图输出路径（不指定则只输出掩码，并按接近模型分辨率缩小解码）")
     ap.add_argument("--threads", type=int, default=4)
+    ap.add_argument("--runs", type=int, default=1, help="重复推理次数，用于区分冷/热启动延迟")
+    ap.add_argument("--approx-postprocess", action="store_true", help="近似后处理（fp16 查表 + 两步上采样），更快")
+    ap.add_argument("--io-bench", type=int, default=0, help="对比 getData/numpy 两种 IO 路径 N 次后退出")
+    ap.add_argument("--buckets", default=None, help="按长宽比选择输入形状，如 512x512,704x384,384x704（WxH，按原值使用）；default 为按模型尺寸缩放的默认桶")
+    trace.add_trace_args(ap)
+    from birefnet_registry import Registry, add_registry_args
+    add_registry_args(ap)
     args = ap.parse_args()
+    if args.variant:  # 离线清单直接给出本地路径，不访问 Hub
+        v = Registry(args.registry).resolve(args.variant)
+        if v.backend != "mnn":
+            ap.error(f"--variant {v.name} 不是 MNN 模型")
+        args.mnn = v.path
+    if not args.mnn:
+        ap.error("需要 --mnn 或 --variant")
+    if args.trace:
+        trace.enable()
 
-    img = load_image(args.image)
-    x, (ow,oh) = preprocess(img)
-    y = run_mnn(args.mnn, x, threads=args.threads)
-    mask = postprocess(y, (ow,oh))
-    mask.save(args.save_mask)
+    shapes = None
+    if args.buckets:
+        shapes = parse_buckets(args.buckets, (H, W))
+    with trace.span("decode"):
+        if args.save_cutout:
+            img = load_image(args.image)
+            ow, oh = img.width, img.height
+        else:  # 只要掩码时按接近模型分辨率解码（分桶时按各桶最大边）
+            img, (ow, oh) = load_image_reduced(args.image, max_shape(shapes) if shapes else (H, W))
+    pre = bucket_preprocessor(nearest_bucket((ow, oh), shapes)) if shapes else PRE  # 选最接近原图长宽比的桶
+    if shapes:
+        print(f"bucket: {pre.size[1]}x{pre.size[0]}")
+    if args.io_bench > 0:
+        io_bench(args.mnn, pre(img)[0], runs=args.io_bench, threads=args.threads)
+        raise SystemExit(0)
+    if shapes:  # 单次运行只建用到的桶的 session，不预热其余桶
+        engine = BucketedMNN(args.mnn, shapes, threads=args.threads, warm=False, profile_ops=args.profile_ops)
+    else:
+        engine = BiRefNetMNN(args.mnn, threads=args.threads, profile_ops=args.profile_ops)
+    if engine.numpy_io:
+        pre.into(img, engine.input_buffer(pre.shape))  # 预处理直接写入 session 的 host 缓冲区
+        x = None
+    else:
+        x, _ = pre(img)
+    for _ in range(max(1, args.runs)):
+        with trace.span("infer"):
+            y = engine.run(x)
+    print(engine.latency_report())
+    mask = postprocess(y, (ow,oh), args.approx_postprocess)
+    with trace.span("encode"):
+        mask.save(args.save_mask)
     print("Saved mask:", args.save_mask)
     if args.save_cutout:
-        save_cutout(img, mask, args.save_cutout)
+        with trace.span("encode"):
+            save_cutout(img, mask, args.save_cutout, inplace=True)  # 之后不再使用 img
         print("Saved cutout:", args.save_cutout)
     a = np.array(mask)
     print(f"Mask stats -> min {a.min()} max {a.max()} mean {a.mean():.2f}")
+    trace.finish(args.trace)
@@ -0,0 +1,165 @@
+"""Input discovery, image loading and output naming shared by the BiRefNet scripts (no ORT/MNN dependency).
+
+    python models/birefnet/birefnet_io.py big.jpg --size 512   # full vs. reduced decode latency / RSS
+"""
+import argparse
+import glob
+import hashlib
+import io
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+MANIFEST_EXTS = (".txt", ".lst")
+
+
+def collect_inputs(spec: str) -> List[str]:
+    """Expand a directory, glob pattern or manifest file (one path/URL per line) into image paths."""
+    if os.path.isdir(spec):
+        paths = sorted(os.path.join(spec, n) for n in os.listdir(spec) if n.lower().endswith(IMAGE_EXTS))
+    elif os.path.isfile(spec) and spec.lower().endswith(MANIFEST_EXTS):
+        base = os.path.dirname(os.path.abspath(spec))
+        paths = []
+        with open(spec, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                if not line.startswith(("http://", "https://")) and not os.path.isabs(line):
+                    line = os.path.join(base, line)
+                paths.append(line)  # manifest order is kept
+    else:
+        paths = sorted(p for p in glob.glob(spec) if os.path.isfile(p))
+    if not paths:
+        raise FileNotFoundError(f"No images found for input: {spec}")
+    return paths
+
+
+def output_names(paths: List[str], out_dir: str) -> List[str]:
+    """One `<stem>.png` per input; duplicate stems get a numeric suffix instead of overwriting."""
+    seen = {}
+    names = []
+    for p in paths:
+        stem = os.path.splitext(os.path.basename(p.split("?", 1)[0]))[0] or "image"
+        n = seen.get(stem, 0)
+        seen[stem] = n + 1
+        names.append(os.path.join(out_dir, f"{stem}.png" if n == 0 else f"{stem}_{n}.png"))
+    return names
+
+
+def open_image(path_or_url) -> Image.Image:
+    """Open (but do not decode) a local path, URL or binary file object (e.g. an uploaded body in BytesIO).
+
+    URLs go through the process-wide pooled session (birefnet_fetch), so repeated loads reuse connections.
+    """
+    if isinstance(path_or_url, str) and path_or_url.startswith(("http://", "https://")):
+        from birefnet_fetch import shared_fetcher
+        return Image.open(io.BytesIO(shared_fetcher().get_bytes(path_or_url)))
+    return Image.open(path_or_url)
+
+
+def load_image_reduced(path_or_url, size: Tuple[int, int],
+                       reducing_gap: float = 2.0) -> Tuple[Image.Image, Tuple[int, int]]:
+    """Decode an image close to the model resolution for the inference branch.
+
+    `size` is the model input (height, width). JPEGs are decoded with DCT scale-on-decode
+    (`Image.draft`), then `Image.reduce` drops any remaining integer factor; both keep at least
+    `reducing_gap` x the model size so the final bilinear resize in preprocessing is unaffected.
+    Returns (RGB image, original (width, height)) -- postprocess must use the original size.
+    """
+    img = open_image(path_or_url)
+    orig = img.size
+    h, w = size
+    want = (int(w * reducing_gap), int(h * reducing_gap))
+    if img.format == "JPEG":
+        img.draft("RGB", want)
+    img = img.convert("RGB")
+    factor = min(img.width // want[0], img.height // want[1])
+    if factor > 1:
+        img = img.reduce(factor)
+    return img, orig
+
+
+def synth_image(h: int, w: int, rng: Optional[np.random.Generator] = None) -> Image.Image:
+    """Offline stand-in image: smooth gradient plus noise (used for calibration and benchmarks).
+
+    Pass a seeded `rng` for reproducible (and thread-safe) output; the global numpy RNG is used otherwise.
+    """
+    if rng is not None:
+        arr = rng.standard_normal((h, w, 3), dtype=np.float32)
+    else:
+        arr = np.random.randn(h, w, 3).astype(np.float32)
+    arr *= 0.15  # float32 and in place: calibration may build many of these concurrently
+    arr += (0.6 * np.linspace(0, 1, w, dtype=np.float32))[None, :, None]
+    arr += (0.4 * np.linspace(0, 1, h, dtype=np.float32) + 0.2)[:, None, None]
+    arr *= 255.0
+    np.clip(arr, 0, 255, out=arr)
+    return Image.fromarray(arr.astype(np.uint8), "RGB")
+
+
+_DIGESTS: Dict[Tuple[str, int, float], str] = {}
+
+
+def model_digest(path: str) -> str:
+    """sha256 of a model file (memoised per path/size/mtime within the process)."""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime)
+    if key not in _DIGESTS:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        _DIGESTS[key] = h.hexdigest()
+    return _DIGESTS[key]
+
+
+def seed_digest(path: str, digest: str):
+    """Record a known sha256 (e.g. from the model registry) so `model_digest` does not hash the file."""
+    st = os.stat(path)
+    _DIGESTS[(os.path.abspath(path), st.st_size, st.st_mtime)] = digest
+
+
+def max_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 1024
+
+
+def _decode_once(path: str, size: Tuple[int, int], reduced: bool) -> Tuple[float, Optional[float]]:
+    t0 = time.perf_counter()
+    if reduced:
+        img, _ = load_image_reduced(path, size)
+    else:
+        img = open_image(path).convert("RGB")
+    img.resize((size[1], size[0]), Image.BILINEAR)
+    return time.perf_counter() - t0, max_rss_mb()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Compare full-resolution vs. reduced decode for the inference branch.")
+    ap.add_argument("image", help="Local image path or URL (large JPEGs show the biggest gain).")
+    ap.add_argument("--size", type=int, default=512, help="Square model input size.")
+    ap.add_argument("--runs", type=int, default=5)
+    a = ap.parse_args()
+
+    import multiprocessing as mp
+    ctx = mp.get_context("spawn")  # fresh process per mode so peak RSS is not shared
+    for reduced in (False, True):
+        with ctx.Pool(1) as pool:
+            res = [pool.apply(_decode_once, (a.image, (a.size, a.size), reduced)) for _ in range(a.runs)]
+        lat = sorted(r[0] for r in res)
+        rss = res[-1][1]
+        print(f"[{'reduced' if reduced else 'full   '}] decode+resize p50 {1000 * lat[len(lat) // 2]:.1f} ms  "
+              f"min {1000 * lat[0]:.1f} ms  peak RSS {'n/a' if rss is None else f'{rss:.0f} MiB'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""ONNX Runtime session factory shared by the BiRefNet ORT scripts.
+
+  * `OrtOptions`: graph optimisation level, intra/inter-op threads and execution mode;
+  * `cache_dir`: the optimised graph is serialized once (keyed by model hash + ORT version +
+    providers + optimisation level) and later starts load it with optimisation disabled;
+  * `BoundRunner`: IOBinding run path whose input/output live in reused numpy buffers, so
+    `run()` neither copies the input into a new OrtValue nor allocates a fresh output array.
+
+    python models/birefnet/birefnet_ort.py --model model.onnx --size 512   # cold start / steady state
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import platform
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+import onnxruntime as ort
+
+from birefnet_io import model_digest
+
+OPT_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+EXECUTION_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+DEFAULT_PROVIDERS = ["CUDAExecutionProvider", "CPUExecutionProvider"]
+LARGE_MODEL_BYTES = 1800 * 2**20  # optimised graphs above this need their initializers stored externally
+
+
+@dataclass
+class OrtOptions:
+    opt_level: str = "all"
+    intra_op_threads: int = 0  # 0: ORT_NUM_THREADS env var, else ORT's default
+    inter_op_threads: int = 0  # only used by the parallel execution mode
+    execution_mode: str = "sequential"
+    cache_dir: Optional[str] = None  # directory for serialized optimised models
+    profile: bool = False  # ORT session profiling (per-node timings; see birefnet_trace.add_ort_profile)
+
+
+def session_options(opts: OrtOptions) -> ort.SessionOptions:
+    so = ort.SessionOptions()
+    so.graph_optimization_level = OPT_LEVELS[opts.opt_level]
+    so.execution_mode = EXECUTION_MODES[opts.execution_mode]
+    intra = opts.intra_op_threads or int(os.environ.get("ORT_NUM_THREADS", "0"))
+    if intra > 0:
+        so.intra_op_num_threads = intra
+    if opts.inter_op_threads > 0:
+        so.inter_op_num_threads = opts.inter_op_threads
+    if opts.profile:
+        so.enable_profiling = True
+        so.profile_file_prefix = os.path.join(tempfile.gettempdir(), f"birefnet_ort_{os.getpid()}")
+    return so
+
+
+def available(providers: List[str]) -> List[str]:
+    have = set(ort.get_available_providers())
+    return [p for p in providers if p in have] or ["CPUExecutionProvider"]
+
+
+def cache_path(model_path: str, providers: List[str], opts: OrtOptions) -> str:
+    """Where the optimised copy of `model_path` lives; anything that changes the optimised graph is in the key."""
+    key = json.dumps([model_digest(model_path), ort.__version__, opts.opt_level, providers, platform.machine()])
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(opts.cache_dir, f"{stem}-{hashlib.sha256(key.encode()).hexdigest()[:16]}.onnx")
+
+
+def _is_large(model_path: str) -> bool:
+    size = os.path.getsize(model_path)
+    base = os.path.dirname(os.path.abspath(model_path))
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    for name in os.listdir(base):  # external data files next to the model
+        if name.startswith(stem) and not name.endswith(".onnx"):
+            size += os.path.getsize(os.path.join(base, name))
+    return size > LARGE_MODEL_BYTES
+
+
+def create_session(model_path: str, providers: Optional[List[str]] = None,
+                   opts: Optional[OrtOptions] = None) -> ort.InferenceSession:
+    """InferenceSession with `opts` applied, loading/saving the optimised model cache when enabled."""
+    opts = opts or OrtOptions()
+    providers = available(providers or DEFAULT_PROVIDERS)
+    so = session_options(opts)
+    path, cached, tmp = model_path, None, None
+    if opts.cache_dir and opts.opt_level != "disable":
+        cached = cache_path(model_path, providers, opts)
+        if os.path.exists(cached):
+            path = cached
+            so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL  # already optimised
+        else:
+            os.makedirs(opts.cache_dir, exist_ok=True)
+            tmp = f"{cached}.{os.getpid()}.tmp"
+            so.optimized_model_filepath = tmp
+            if _is_large(model_path):
+                so.add_session_config_entry("session.optimized_model_external_initializers_file_name",
+                                            os.path.basename(cached) + ".data")
+    t0 = time.perf_counter()
+    try:
+        sess = ort.InferenceSession(path, sess_options=so, providers=providers)
+    except Exception as e:
+        print(f"[WARN] Provider error '{e}'. Falling back to CPUExecutionProvider.")
+        so = session_options(opts)  # no cache write: the key was computed for the requested providers
+        sess = ort.InferenceSession(model_path, sess_options=so, providers=["CPUExecutionProvider"])
+        tmp = None
+    ms = 1000 * (time.perf_counter() - t0)
+    if tmp and os.path.exists(tmp):
+        os.replace(tmp, cached)
+        print(f"[ort] session {ms:.0f} ms, optimised model cached -> {cached}")
+    elif path != model_path:
+        print(f"[ort] session {ms:.0f} ms from optimised cache {cached}")
+    return sess
+
+
+class BoundRunner:
+    """IOBinding wrapper for single-input/single-output models (CPU buffers).
+
+    Write the input into `input_buffer(shape)` (or pass `x` to `run`); the output array is reused
+    across calls with the same input shape, so `run(copy=False)` is overwritten by the next run.
+    """
+
+    def __init__(self, sess: ort.InferenceSession):
+        self.sess = sess
+        inp, out = sess.get_inputs()[0], sess.get_outputs()[0]
+        self.in_name, self.out_name = inp.name, out.name
+        self.in_dtype = np.float16 if "float16" in inp.type else np.float32
+        self.out_dtype = np.float16 if "float16" in out.type else np.float32
+        self._out_dims = out.shape
+        self.io = sess.io_binding()
+        self._x: Optional[np.ndarray] = None
+        self._y: Optional[np.ndarray] = None
+        self._x_val = self._y_val = None
+        self._bound: Optional[tuple] = None
+        self._out_shapes: Dict[tuple, tuple] = {}
+
+    def input_buffer(self, shape) -> np.ndarray:
+        shape = tuple(shape)
+        if self._x is None or self._x.shape != shape:
+            self._x = np.zeros(shape, dtype=self.in_dtype)
+            self._bound = None
+        return self._x
+
+    def _bind(self):
+        x = self._x
+        out_shape = self._out_shapes.get(x.shape)
+        if out_shape is None and all(isinstance(d, int) and d > 0 for d in self._out_dims):
+            out_shape = self._out_shapes[x.shape] = tuple(self._out_dims)
+        self.io.clear_binding_inputs()
+        self.io.clear_binding_outputs()
+        # OrtValues wrap the numpy memory (no copy), so the buffers stay bound across calls
+        self._x_val = ort.OrtValue.ortvalue_from_numpy(x)
+        self.io.bind_ortvalue_input(self.in_name, self._x_val)
+        if out_shape is None:  # dynamic output dims: ORT allocates this run's output; `run` keeps it as `_y`
+            self.io.bind_output(self.out_name, "cpu")
+            self._y_val = None
+        else:
+            if self._y is None or self._y.shape != out_shape:
+                self._y = np.empty(out_shape, dtype=self.out_dtype)
+            self._y_val = ort.OrtValue.ortvalue_from_numpy(self._y)
+            self.io.bind_ortvalue_output(self.out_name, self._y_val)
+        self._bound = x.shape
+
+    def run(self, x: Optional[np.ndarray] = None, copy: bool = True) -> np.ndarray:
+        if x is not None:
+            buf = self.input_buffer(x.shape)
+            if x is not buf:
+                np.copyto(buf, x, casting="same_kind")
+        if self._x is None:
+            raise ValueError("No input: pass x or fill input_buffer(shape) first.")
+        if self._bound != self._x.shape:
+            self._bind()
+        self.sess.run_with_iobinding(self.io)
+        if self._y_val is None:  # first run at this shape: pin ORT's output as the reused buffer
+            self._y = np.ascontiguousarray(self.io.get_outputs()[0].numpy(), dtype=self.out_dtype)
+            self._out_shapes[self._x.shape] = self._y.shape
+            self._bind()
+        return self._y.copy() if copy else self._y
+
+
+def add_ort_args(ap: argparse.ArgumentParser):
+    g = ap.add_argument_group("ONNX Runtime session")
+    g.add_argument("--opt-level", choices=list(OPT_LEVELS), default="all", help="Graph optimisation level.")
+    g.add_argument("--ort-cache", default=None, help="Directory for cached optimised models (skips re-optimising on start).")
+    g.add_argument("--intra-op", type=int, default=0, help="Intra-op threads (default: ORT_NUM_THREADS or ORT default).")
+    g.add_argument("--inter-op", type=int, default=0, help="Inter-op threads (parallel execution mode).")
+    g.add_argument("--execution-mode", choices=list(EXECUTION_MODES), default="sequential")
+    g.add_argument("--io-binding", action="store_true", help="Run through IOBinding with reused input/output buffers.")
+
+
+def options_from_args(args) -> OrtOptions:
+    return OrtOptions(opt_level=args.opt_level, intra_op_threads=args.intra_op, inter_op_threads=args.inter_op,
+                      execution_mode=args.execution_mode, cache_dir=args.ort_cache,
+                      profile=bool(getattr(args, "trace", None) and getattr(args, "profile_ops", False)))
+
+
+def _cold_start(model_path: str, providers: List[str], opts: OrtOptions) -> float:
+    t0 = time.perf_counter()
+    create_session(model_path, providers, opts)
+    return 1000 * (time.perf_counter() - t0)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Measure ORT cold start (with/without the optimised-model cache) "
+                                             "and steady-state latency (sess.run vs IOBinding).")
+    ap.add_argument("--model", required=True)
+    ap.add_argument("--size", type=int, default=512, help="Square input size.")
+    ap.add_argument("--batch", type=int, default=1)
+    ap.add_argument("--runs", type=int, default=20)
+    ap.add_argument("--providers", default="CPUExecutionProvider")
+    ap.add_argument("--opt-level", choices=list(OPT_LEVELS), default="all")
+    ap.add_argument("--intra-op", type=int, default=0)
+    ap.add_argument("--cache-dir", default=None, help="Default: a fresh temporary directory.")
+    a = ap.parse_args()
+
+    providers = [p.strip() for p in a.providers.split(",") if p.strip()]
+    cache_dir = a.cache_dir or tempfile.mkdtemp(prefix="ort_cache_")
+    ctx = mp.get_context("spawn")  # each start in a fresh process, like a service restart
+    print(f"[cold start] {os.path.basename(a.model)}  opt-level {a.opt_level}")
+    for label, opts in (("no cache       ", OrtOptions(a.opt_level, a.intra_op)),
+                        ("cache miss     ", OrtOptions(a.opt_level, a.intra_op, cache_dir=cache_dir)),
+                        ("cache hit      ", OrtOptions(a.opt_level, a.intra_op, cache_dir=cache_dir))):
+        with ctx.Pool(1) as pool:
+            ms = pool.apply(_cold_start, (a.model, providers, opts))
+        print(f"  {label} {ms:8.1f} ms")
+
+    sess = create_session(a.model, providers, OrtOptions(a.opt_level, a.intra_op, cache_dir=cache_dir))
+    runner = BoundRunner(sess)
+    x = np.random.default_rng(0).standard_normal((a.batch, 3, a.size, a.size)).astype(runner.in_dtype)
+    in_name, out_name = runner.in_name, runner.out_name
+
+    def bench(fn):
+        fn()
+        lat = []
+        for _ in range(a.runs):
+            t0 = time.perf_counter()
+            fn()
+            lat.append(1000 * (time.perf_counter() - t0))
+        return np.percentile(lat, [50, 90])
+
+    ref = sess.run([out_name], {in_name: x})[0]
+    runner.input_buffer(x.shape)[...] = x
+    same = np.array_equal(ref, runner.run())
+    p_run = bench(lambda: sess.run([out_name], {in_name: x}))
+    p_bind = bench(lambda: runner.run(copy=False))
+    print(f"[steady state] batch {a.batch} x {a.size}x{a.size}, {a.runs} runs")
+    print(f"  sess.run      p50 {p_run[0]:8.2f} ms  p90 {p_run[1]:8.2f} ms")
+    print(f"  io-binding    p50 {p_bind[0]:8.2f} ms  p90 {p_bind[1]:8.2f} ms  (identical output: {same})")
+
+
+if __name__ == "__main__":
+    main()
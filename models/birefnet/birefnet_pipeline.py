@@ -0,0 +1,340 @@
+"""Streaming BiRefNet pipeline: decode+preprocess -> infer -> postprocess+encode.
+
+Decode and encode run in worker pools while a single thread keeps the ORT/MNN session busy.
+Bounded queues between the stages give backpressure, and results come out in input order.
+
+    python models/birefnet/birefnet_pipeline.py --backend ort --model model.onnx \
+        --input assets/products/ --out-dir outputs/masks --decode-workers 4 --encode-workers 4
+"""
+import argparse
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from birefnet_buckets import add_bucket_args, max_shape, nearest_bucket, parse_buckets
+from birefnet_encode import PNG, OutputFormat, add_encode_args, encode, with_ext
+from birefnet_io import collect_inputs, load_image_reduced, output_names
+from birefnet_postprocess import to_rgba
+from birefnet_preprocess import get_preprocessor
+
+_DONE = object()
+
+
+@dataclass
+class DecodedItem:
+    index: int
+    path: str
+    arr: Optional[np.ndarray] = None
+    size: Tuple[int, int] = (0, 0)
+    image: object = None  # PIL image, only kept when a cutout is requested
+    error: Optional[str] = None
+    seconds: float = 0.0
+
+
+@dataclass
+class PipelineResult:
+    index: int
+    path: str
+    mask_path: Optional[str]
+    error: Optional[str] = None
+
+
+@dataclass
+class StageStats:
+    name: str
+    workers: int
+    busy_s: float = 0.0
+    count: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, seconds: float):
+        with self.lock:
+            self.busy_s += seconds
+            self.count += 1
+
+    def utilisation(self, wall_s: float) -> float:
+        return self.busy_s / (wall_s * self.workers) if wall_s > 0 else 0.0
+
+
+def _backend_module(backend: str):
+    if backend == "mnn":
+        import birefnet_infer_mnn as mod
+    else:
+        import birefnet_infer_local as mod
+    return mod
+
+
+def decode_item(backend: str, pp, keep_image: bool, index: int, path: str, dtype=np.float32,
+                shapes: Optional[List[Tuple[int, int]]] = None) -> DecodedItem:
+    """Stage 1 (worker pool): load + preprocess one image into `dtype` (ORT), or into its nearest
+    MNN bucket in `shapes`. Errors are returned, not raised."""
+    t0 = time.perf_counter()
+    mod = _backend_module(backend)
+    try:
+        if keep_image:
+            img = mod.load_image(path)
+            size = (img.width, img.height)
+        else:  # masks only: decode near model resolution
+            target = pp.size if pp is not None else max_shape(shapes) if shapes else mod.PRE.size
+            img, size = load_image_reduced(path, target)
+        if pp is not None:
+            arr, _ = get_preprocessor(pp, dtype)(img)
+        elif shapes:
+            arr, _ = mod.bucket_preprocessor(nearest_bucket(size, shapes))(img)
+        else:
+            arr, _ = mod.preprocess(img)
+    except Exception as e:
+        return DecodedItem(index, path, error=f"{type(e).__name__}: {e}", seconds=time.perf_counter() - t0)
+    return DecodedItem(index, path, arr, size, img if keep_image else None, seconds=time.perf_counter() - t0)
+
+
+def encode_item(backend: str, item: DecodedItem, logits: np.ndarray, mask_path: str,
+                cutout_path: Optional[str], mask_fmt: OutputFormat = PNG,
+                cutout_fmt: OutputFormat = PNG) -> Tuple[PipelineResult, float]:
+    """Stage 3 (worker pool): postprocess logits and write the mask (and cutout) in the given formats."""
+    t0 = time.perf_counter()
+    mod = _backend_module(backend)
+    try:
+        mask_img = mod.postprocess(logits, item.size)
+        encode(mask_img, mask_path, mask_fmt)
+        if cutout_path and item.image is not None:
+            encode(mask_img if cutout_fmt.kind == "alpha" else to_rgba(item.image, mask_img), cutout_path, cutout_fmt)
+        result = PipelineResult(item.index, item.path, mask_path)
+    except Exception as e:
+        result = PipelineResult(item.index, item.path, None, f"{type(e).__name__}: {e}")
+    return result, time.perf_counter() - t0
+
+
+class Pipeline:
+    """Three-stage streaming pipeline around a single `infer(arr) -> logits` callable.
+
+    `infer` is only ever called from one thread, so it may wrap a non-thread-safe session.
+    `depth` bounds the number of in-flight items between stages (backpressure).
+    """
+
+    def __init__(self, infer: Callable[[np.ndarray], np.ndarray], decode: Callable[[int, str], DecodedItem],
+                 encode: Callable[..., Tuple[PipelineResult, float]], decode_workers: int = 2,
+                 encode_workers: int = 2, depth: int = 8, pool: str = "thread"):
+        self.infer = infer
+        self.decode = decode
+        self.encode = encode
+        self.decode_workers = max(1, decode_workers)
+        self.encode_workers = max(1, encode_workers)
+        self.depth = max(1, depth)
+        self.pool_cls = ProcessPoolExecutor if pool == "process" else ThreadPoolExecutor
+        self.stats = {}
+        self.wall_s = 0.0
+
+    def _reset_stats(self):
+        self.stats = {
+            "decode": StageStats("decode+preprocess", self.decode_workers),
+            "infer": StageStats("infer", 1),
+            "encode": StageStats("postprocess+encode", self.encode_workers),
+        }
+        self.infer_starved_s = 0.0
+        self.infer_blocked_s = 0.0
+
+    def run(self, paths: Iterable[str], mask_paths: List[str],
+            cutout_paths: Optional[List[str]] = None) -> Iterator[PipelineResult]:
+        self._reset_stats()
+        stop = threading.Event()
+        pre_q: "queue.Queue" = queue.Queue(maxsize=self.depth)
+        post_q: "queue.Queue" = queue.Queue(maxsize=self.depth)
+
+        def put(q, obj) -> bool:
+            while not stop.is_set():
+                try:
+                    q.put(obj, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def get(q):
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            return _DONE
+
+        t_start = time.perf_counter()
+        with self.pool_cls(self.decode_workers) as dpool, self.pool_cls(self.encode_workers) as epool:
+            def feeder(pool: Executor):
+                for index, path in enumerate(paths):
+                    if not put(pre_q, pool.submit(self.decode, index, path)):
+                        return
+                put(pre_q, _DONE)
+
+            def inferer(pool: Executor):
+                try:
+                    while True:
+                        t0 = time.perf_counter()
+                        fut = get(pre_q)
+                        if fut is _DONE:
+                            put(post_q, _DONE)
+                            return
+                        item = fut.result()
+                        self.infer_starved_s += time.perf_counter() - t0
+                        self.stats["decode"].add(item.seconds)
+                        if item.error is not None:
+                            done = (PipelineResult(item.index, item.path, None, item.error), 0.0)
+                            if not put(post_q, _completed(done)):
+                                return
+                            continue
+                        t0 = time.perf_counter()
+                        logits = self.infer(item.arr)
+                        self.stats["infer"].add(time.perf_counter() - t0)
+                        item.arr = None  # not needed by the encode stage
+                        cutout = cutout_paths[item.index] if cutout_paths else None
+                        t0 = time.perf_counter()
+                        ok = put(post_q, pool.submit(self.encode, item, logits, mask_paths[item.index], cutout))
+                        self.infer_blocked_s += time.perf_counter() - t0
+                        if not ok:
+                            return
+                except BaseException as e:  # surface session errors in the consumer
+                    put(post_q, e)
+
+            threads = [threading.Thread(target=feeder, args=(dpool,), daemon=True),
+                       threading.Thread(target=inferer, args=(epool,), daemon=True)]
+            for t in threads:
+                t.start()
+            try:
+                while True:
+                    fut = post_q.get()
+                    if fut is _DONE:
+                        break
+                    if isinstance(fut, BaseException):
+                        raise fut
+                    result, seconds = fut.result()
+                    if seconds:
+                        self.stats["encode"].add(seconds)
+                    yield result
+            finally:
+                stop.set()
+                for t in threads:
+                    t.join()
+                self.wall_s = time.perf_counter() - t_start
+
+    def report(self) -> str:
+        lines = [f"{'stage':<20} {'workers':>7} {'items':>6} {'busy s':>8} {'util':>6}"]
+        for s in self.stats.values():
+            lines.append(f"{s.name:<20} {s.workers:>7} {s.count:>6} {s.busy_s:>8.2f} "
+                         f"{100 * s.utilisation(self.wall_s):>5.1f}%")
+        lines.append(f"infer waited {self.infer_starved_s:.2f}s for input, "
+                     f"{self.infer_blocked_s:.2f}s on output backpressure; wall {self.wall_s:.2f}s")
+        return "\n".join(lines)
+
+
+class _completed:
+    """Future-like wrapper for results produced without going through a pool."""
+
+    def __init__(self, value):
+        self.value = value
+
+    def result(self):
+        return self.value
+
+
+def run_serial(infer, decode, encode, paths: List[str], mask_paths: List[str],
+               cutout_paths: Optional[List[str]] = None) -> Tuple[int, float]:
+    """Reference loop: every stage one after another on the calling thread."""
+    t0 = time.perf_counter()
+    ok = 0
+    for index, path in enumerate(paths):
+        item = decode(index, path)
+        if item.error is not None:
+            continue
+        logits = infer(item.arr)
+        result, _ = encode(item, logits, mask_paths[index], cutout_paths[index] if cutout_paths else None)
+        ok += result.error is None
+    return ok, time.perf_counter() - t0
+
+
+def build_infer(args, shapes: Optional[List[Tuple[int, int]]] = None):
+    """Return (pp, input dtype, infer_fn) for the selected backend; `pp` is None for MNN (PRE size or `shapes`)."""
+    if args.backend == "mnn":
+        from birefnet_infer_mnn import BiRefNetMNN, BucketedMNN
+        if shapes:
+            return None, np.float32, BucketedMNN(args.mnn, shapes, threads=args.threads).run
+        return None, np.float32, BiRefNetMNN(args.mnn, threads=args.threads).run
+
+    from birefnet_infer_local import input_dtype, make_session, resolve_preproc
+    pp = resolve_preproc(None, args.pp_json, True)
+    providers = [p.strip() for p in args.providers.split(",") if p.strip()] if args.providers else None
+    sess = make_session(args.model, providers=providers)
+    in_name = sess.get_inputs()[0].name
+    out_name = sess.get_outputs()[0].name
+    return pp, input_dtype(sess), lambda arr: sess.run([out_name], {in_name: arr})[0]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Pipelined BiRefNet inference over many images (ORT or MNN).")
+    ap.add_argument("--backend", choices=["ort", "mnn"], default="ort")
+    ap.add_argument("--model", help="ORT: local .onnx path.")
+    ap.add_argument("--pp-json", help="ORT: preprocessor_config.json (default preprocess if omitted).")
+    ap.add_argument("--providers", default=None, help="ORT: comma-separated execution providers.")
+    ap.add_argument("--mnn", help="MNN: .mnn model path.")
+    ap.add_argument("--threads", type=int, default=4, help="MNN: CPU threads.")
+    add_bucket_args(ap)
+    ap.add_argument("--input", required=True, help="Image directory, glob pattern, or manifest file.")
+    ap.add_argument("--out-dir", default="masks")
+    ap.add_argument("--cutout-dir", default=None, help="Also write RGBA cutouts here.")
+    ap.add_argument("--decode-workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    ap.add_argument("--encode-workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    ap.add_argument("--depth", type=int, default=8, help="Max in-flight items between stages.")
+    ap.add_argument("--pool", choices=["thread", "process"], default="thread",
+                    help="Worker pool kind for the decode/encode stages.")
+    ap.add_argument("--compare-serial", action="store_true", help="Also time the one-thread serial loop.")
+    add_encode_args(ap, writers=False)  # the encode stage is already a worker pool
+    args = ap.parse_args()
+    if args.backend == "ort" and not args.model:
+        raise SystemExit("--model is required with --backend ort")
+    if args.backend == "mnn" and not args.mnn:
+        raise SystemExit("--mnn is required with --backend mnn")
+
+    paths = collect_inputs(args.input)
+    os.makedirs(args.out_dir, exist_ok=True)
+    mask_paths = [with_ext(p, args.mask_format) for p in output_names(paths, args.out_dir)]
+    cutout_paths = None
+    if args.cutout_dir:
+        os.makedirs(args.cutout_dir, exist_ok=True)
+        cutout_paths = [with_ext(p, args.cutout_format) for p in output_names(paths, args.cutout_dir)]
+
+    shapes = None
+    if args.buckets and args.backend != "mnn":
+        print("[WARN] --buckets applies to the MNN backend only; ignoring it.")
+    elif args.buckets:
+        from birefnet_infer_mnn import PRE
+        shapes = parse_buckets(args.buckets, PRE.size)
+    pp, dtype, infer = build_infer(args, shapes)
+    decode = partial(decode_item, args.backend, pp, cutout_paths is not None, dtype=dtype, shapes=shapes)
+    encode = partial(encode_item, args.backend, mask_fmt=args.mask_format, cutout_fmt=args.cutout_format)
+
+    pipe = Pipeline(infer, decode, encode, args.decode_workers, args.encode_workers, args.depth, args.pool)
+    ok = failed = 0
+    for r in pipe.run(paths, mask_paths, cutout_paths):
+        if r.error:
+            failed += 1
+            print(f"[WARN] {r.path}: {r.error}")
+        else:
+            ok += 1
+    print(f"Pipeline done -> {ok} images ({failed} failed) in {pipe.wall_s:.2f}s  "
+          f"{ok / pipe.wall_s if pipe.wall_s else 0.0:.2f} img/s")
+    print(pipe.report())
+
+    if args.compare_serial:
+        n, serial_s = run_serial(infer, decode, encode, paths, mask_paths, cutout_paths)
+        print(f"Serial loop -> {n} images in {serial_s:.2f}s  {n / serial_s if serial_s else 0.0:.2f} img/s  "
+              f"(pipeline speedup x{serial_s / pipe.wall_s if pipe.wall_s else 0.0:.2f})")
+
+
+if __name__ == "__main__":
+    main()
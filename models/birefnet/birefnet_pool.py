@@ -0,0 +1,332 @@
+"""Multi-instance BiRefNet worker pool for many-core hosts.
+
+One big session stops scaling after a handful of threads. This runs K worker processes instead, each
+pinned to its own disjoint CPU set (`os.sched_setaffinity`, Linux) with a matching intra-op thread
+count, each holding its own ORT session (`make_session`) or MNN engine. A worker does the whole
+per-image job (decode -> infer -> postprocess -> PNG); the dispatcher hands out images round-robin or
+to the least-loaded worker, keeping at most --depth images outstanding per worker.
+
+    python models/birefnet/birefnet_pool.py run --backend ort --model model.onnx \
+        --input assets/products/ --out-dir outputs/masks --workers 8 --threads 8
+    python models/birefnet/birefnet_pool.py tune --backend ort --model model.onnx --images 64
+"""
+import argparse
+import multiprocessing as mp
+import os
+import queue
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from birefnet_io import collect_inputs, output_names, synth_image
+from birefnet_pipeline import decode_item, encode_item
+
+
+@dataclass
+class WorkerConfig:
+    backend: str = "ort"
+    model: Optional[str] = None
+    pp_json: Optional[str] = None
+    providers: Optional[List[str]] = None
+    mnn: Optional[str] = None
+
+
+@dataclass
+class PoolStats:
+    images: int = 0
+    failed: int = 0
+    wall_s: float = 0.0
+    startup_s: float = 0.0
+    per_worker: Dict[int, int] = field(default_factory=dict)
+    busy_s: Dict[int, float] = field(default_factory=dict)
+
+    @property
+    def images_per_s(self) -> float:
+        return self.images / self.wall_s if self.wall_s > 0 else 0.0
+
+
+def available_cpus() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def partition_cpus(workers: int, threads: int, cpus: Optional[Sequence[int]] = None) -> List[List[int]]:
+    """Split `cpus` into `workers` disjoint sets of `threads` CPUs (sets wrap around if there are too few)."""
+    cpus = list(cpus if cpus is not None else available_cpus())
+    need = workers * threads
+    if need > len(cpus):
+        print(f"[WARN] {workers} workers x {threads} threads = {need} > {len(cpus)} CPUs; CPU sets will overlap.")
+    return [[cpus[(w * threads + t) % len(cpus)] for t in range(threads)] for w in range(workers)]
+
+
+def _build_infer(cfg: WorkerConfig, threads: int):
+    """(pp, input dtype, infer) inside a worker; `pp` is None for MNN (fixed PRE size)."""
+    if cfg.backend == "mnn":
+        from birefnet_infer_mnn import BiRefNetMNN
+        return None, np.float32, BiRefNetMNN(cfg.mnn, threads=threads).run
+
+    from birefnet_infer_local import input_dtype, make_session, resolve_preproc
+    from birefnet_ort import OrtOptions
+    pp = resolve_preproc(None, cfg.pp_json, True)
+    sess = make_session(cfg.model, providers=cfg.providers, opts=OrtOptions(intra_op_threads=threads))
+    in_name = sess.get_inputs()[0].name
+    out_name = sess.get_outputs()[0].name
+    return pp, input_dtype(sess), lambda arr: sess.run([out_name], {in_name: arr})[0]
+
+
+def _worker(wid: int, cfg: WorkerConfig, cpus: List[int], threads: int, tasks, results):
+    """Worker process: pin, build the session, then serve (index, path, mask_path, cutout_path) tasks."""
+    t0 = time.perf_counter()
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)  # before the session exists, so its thread pool inherits the set
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    try:
+        pp, dtype, infer = _build_infer(cfg, threads)
+    except Exception as e:
+        results.put(("failed", wid, f"{type(e).__name__}: {e}"))
+        return
+    results.put(("ready", wid, time.perf_counter() - t0))
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        index, path, mask_path, cutout_path = task
+        t = time.perf_counter()
+        item = decode_item(cfg.backend, pp, cutout_path is not None, index, path, dtype)
+        error = item.error
+        if error is None:
+            try:
+                result, _ = encode_item(cfg.backend, item, infer(item.arr), mask_path, cutout_path)
+                error = result.error
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+        results.put(("done", wid, index, error, time.perf_counter() - t))
+
+
+class WorkerPool:
+    """K pinned worker processes fed by a round-robin or least-loaded dispatcher."""
+
+    def __init__(self, cfg: WorkerConfig, workers: int, threads: int, dispatch: str = "least-loaded",
+                 depth: int = 2, cpus: Optional[Sequence[int]] = None):
+        if dispatch not in ("round-robin", "least-loaded"):
+            raise ValueError(f"unknown dispatch policy: {dispatch}")
+        self.cfg, self.workers, self.threads = cfg, max(1, workers), max(1, threads)
+        self.dispatch, self.depth = dispatch, max(1, depth)
+        self.cpu_sets = partition_cpus(self.workers, self.threads, cpus)
+        self._procs: List[mp.Process] = []
+        self._tasks: list = []
+        self._results = None
+        self.startup_s = 0.0
+
+    def __enter__(self) -> "WorkerPool":
+        ctx = mp.get_context("spawn")
+        self._results = ctx.Queue()
+        t0 = time.perf_counter()
+        for wid, cpus in enumerate(self.cpu_sets):
+            q = ctx.Queue()
+            p = ctx.Process(target=_worker, args=(wid, self.cfg, cpus, self.threads, q, self._results), daemon=True)
+            p.start()
+            self._tasks.append(q)
+            self._procs.append(p)
+        ready = 0
+        while ready < self.workers:  # wait for every session so startup is not counted as throughput
+            try:
+                msg = self._results.get(timeout=1.0)
+            except queue.Empty:  # a worker that dies before reporting (crash, OOM kill) never sends "failed"
+                dead = [(w, p.exitcode) for w, p in enumerate(self._procs) if not p.is_alive()]
+                if dead or time.perf_counter() - t0 > 300:
+                    self.close()
+                    if not dead:
+                        raise RuntimeError(f"workers not ready after 300s ({ready}/{self.workers})") from None
+                    raise RuntimeError(f"worker {dead[0][0]} exited with code {dead[0][1]} during startup") from None
+                continue
+            if msg[0] == "failed":
+                self.close()
+                raise RuntimeError(f"worker {msg[1]} failed to start: {msg[2]}")
+            ready += 1
+        self.startup_s = time.perf_counter() - t0
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for q in self._tasks:
+            q.put(None)
+        for p in self._procs:
+            p.join(timeout=10)
+            if p.is_alive():
+                p.terminate()
+        self._procs, self._tasks = [], []
+
+    def _pick(self, outstanding: List[int], rr: int) -> Optional[int]:
+        if self.dispatch == "round-robin":
+            w = rr % self.workers
+            return w if outstanding[w] < self.depth else None
+        w = min(range(self.workers), key=lambda i: outstanding[i])
+        return w if outstanding[w] < self.depth else None
+
+    def run(self, paths: List[str], mask_paths: List[str], cutout_paths: Optional[List[str]] = None,
+            verbose: bool = True) -> PoolStats:
+        stats = PoolStats(startup_s=self.startup_s, per_worker={w: 0 for w in range(self.workers)},
+                          busy_s={w: 0.0 for w in range(self.workers)})
+        outstanding = [0] * self.workers
+        nxt = done = 0
+        t0 = last = time.perf_counter()
+        while done < len(paths):
+            while nxt < len(paths):  # hand out work while some worker has room
+                w = self._pick(outstanding, nxt)
+                if w is None:
+                    break
+                cutout = cutout_paths[nxt] if cutout_paths else None
+                self._tasks[w].put((nxt, paths[nxt], mask_paths[nxt], cutout))
+                outstanding[w] += 1
+                nxt += 1
+            # a crashed worker (OOM kill, segfault) never returns its queued images: fail fast
+            dead = [w for w in range(self.workers) if outstanding[w] > 0 and not self._procs[w].is_alive()]
+            if dead:
+                code = self._procs[dead[0]].exitcode
+                self.close()
+                raise RuntimeError(f"worker {dead[0]} exited with code {code} with "
+                                   f"{outstanding[dead[0]]} images outstanding")
+            try:
+                _, wid, index, error, seconds = self._results.get(timeout=1.0)
+            except queue.Empty:
+                if time.perf_counter() - last > 300:
+                    raise RuntimeError("no result from any worker for 300s") from None
+                continue
+            last = time.perf_counter()
+            outstanding[wid] -= 1
+            done += 1
+            stats.busy_s[wid] += seconds
+            if error:
+                stats.failed += 1
+                if verbose:
+                    print(f"[WARN] {paths[index]}: {error}")
+            else:
+                stats.images += 1
+                stats.per_worker[wid] += 1
+        stats.wall_s = time.perf_counter() - t0
+        return stats
+
+
+def report(stats: PoolStats, workers: int, threads: int) -> str:
+    util = " ".join(f"w{w}:{n}/{100 * stats.busy_s[w] / stats.wall_s if stats.wall_s else 0:.0f}%"
+                    for w, n in stats.per_worker.items())
+    return (f"[pool] {workers} workers x {threads} threads -> {stats.images} images ({stats.failed} failed) "
+            f"in {stats.wall_s:.2f}s  {stats.images_per_s:.2f} img/s  (startup {stats.startup_s:.1f}s)\n"
+            f"  per worker (images/busy): {util}")
+
+
+def candidate_layouts(n_cpus: int, max_threads: Optional[int] = None) -> List[Tuple[int, int]]:
+    """(workers, threads) pairs that tile the CPUs exactly, from one big session to one thread per worker."""
+    out = []
+    for threads in range(1, n_cpus + 1):
+        if n_cpus % threads == 0 and (max_threads is None or threads <= max_threads):
+            out.append((n_cpus // threads, threads))
+    return sorted(out, key=lambda wt: -wt[1])
+
+
+def tune(cfg: WorkerConfig, paths: List[str], layouts: List[Tuple[int, int]], dispatch: str, depth: int,
+         out_dir: str) -> List[Dict]:
+    """Time every (workers, threads) layout on `paths` and print aggregate throughput."""
+    os.makedirs(out_dir, exist_ok=True)
+    mask_paths = output_names(paths, out_dir)
+    rows = []
+    for workers, threads in layouts:
+        try:
+            with WorkerPool(cfg, workers, threads, dispatch, depth) as pool:
+                pool.run(paths[:max(workers, 1)], mask_paths, verbose=False)  # warm every session
+                s = pool.run(paths, mask_paths, verbose=False)
+            row = {"workers": workers, "threads": threads, "images_per_s": s.images_per_s,
+                   "wall_s": s.wall_s, "startup_s": s.startup_s, "failed": s.failed}
+        except Exception as e:
+            row = {"workers": workers, "threads": threads, "images_per_s": 0.0, "error": str(e)}
+        rows.append(row)
+        print(f"[tune] {workers:>3} x {threads:<3} -> "
+              + (f"ERROR {row['error']}" if "error" in row else
+                 f"{row['images_per_s']:7.2f} img/s  ({row['wall_s']:.2f}s, startup {row['startup_s']:.1f}s"
+                 + (f", {row['failed']} failed)" if row["failed"] else ")")),
+              flush=True)
+    ok = [r for r in rows if "error" not in r]
+    if ok:
+        best = max(ok, key=lambda r: r["images_per_s"])
+        base = next((r for r in ok if r["workers"] == 1), None)
+        gain = f"  (x{best['images_per_s'] / base['images_per_s']:.2f} vs one session)" if base and base["images_per_s"] else ""
+        print(f"[tune] best: --workers {best['workers']} --threads {best['threads']}  "
+              f"{best['images_per_s']:.2f} img/s{gain}")
+    return rows
+
+
+def _add_model_args(p: argparse.ArgumentParser):
+    p.add_argument("--backend", choices=["ort", "mnn"], default="ort")
+    p.add_argument("--model", help="ORT: local .onnx path.")
+    p.add_argument("--pp-json", help="ORT: preprocessor_config.json (default preprocess if omitted).")
+    p.add_argument("--providers", default="CPUExecutionProvider", help="ORT: comma-separated execution providers.")
+    p.add_argument("--mnn", help="MNN: .mnn model path.")
+    p.add_argument("--dispatch", choices=["least-loaded", "round-robin"], default="least-loaded")
+    p.add_argument("--depth", type=int, default=2, help="Max outstanding images per worker.")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="BiRefNet multi-process worker pool with per-worker CPU sets.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("run", help="Process images with K pinned workers.")
+    _add_model_args(r)
+    r.add_argument("--input", required=True, help="Image directory, glob pattern, or manifest file.")
+    r.add_argument("--out-dir", default="masks")
+    r.add_argument("--cutout-dir", default=None)
+    r.add_argument("--workers", type=int, default=2)
+    r.add_argument("--threads", type=int, default=max(1, len(available_cpus()) // 2), help="Threads (CPUs) per worker.")
+    t = sub.add_parser("tune", help="Search workers x threads layouts for the best aggregate throughput.")
+    _add_model_args(t)
+    t.add_argument("--input", default=None, help="Images to time (default: synthetic JPEGs).")
+    t.add_argument("--images", type=int, default=32, help="Number of images per layout.")
+    t.add_argument("--cpus", type=int, default=None, help="CPUs to use (default: all in the affinity mask).")
+    t.add_argument("--max-threads", type=int, default=None)
+    t.add_argument("--layouts", nargs="*", default=None, help="Explicit layouts, e.g. 1x8 2x4 4x2.")
+    a = ap.parse_args()
+
+    if a.backend == "ort" and not a.model:
+        ap.error("--model is required with --backend ort")
+    if a.backend == "mnn" and not a.mnn:
+        ap.error("--mnn is required with --backend mnn")
+    cfg = WorkerConfig(a.backend, a.model, a.pp_json,
+                       [p.strip() for p in a.providers.split(",") if p.strip()] if a.providers else None, a.mnn)
+
+    if a.cmd == "run":
+        paths = collect_inputs(a.input)
+        os.makedirs(a.out_dir, exist_ok=True)
+        cutout_paths = None
+        if a.cutout_dir:
+            os.makedirs(a.cutout_dir, exist_ok=True)
+            cutout_paths = output_names(paths, a.cutout_dir)
+        with WorkerPool(cfg, a.workers, a.threads, a.dispatch, a.depth) as pool:
+            print(f"[pool] CPU sets: {pool.cpu_sets}")
+            stats = pool.run(paths, output_names(paths, a.out_dir), cutout_paths)
+        print(report(stats, a.workers, a.threads))
+        return
+
+    with tempfile.TemporaryDirectory(prefix="birefnet_tune_") as tmp:
+        if a.input:
+            paths = collect_inputs(a.input)
+            paths = (paths * (a.images // len(paths) + 1))[:a.images]
+        else:
+            src = os.path.join(tmp, "synth.jpg")
+            synth_image(1200, 1600).save(src, quality=90)
+            paths = [src] * a.images
+        n_cpus = a.cpus or len(available_cpus())
+        if a.layouts:
+            layouts = [tuple(int(v) for v in s.lower().split("x")) for s in a.layouts]
+        else:
+            layouts = candidate_layouts(n_cpus, a.max_threads)
+        print(f"[tune] {len(paths)} images, {n_cpus} CPUs, layouts {['%dx%d' % l for l in layouts]}")
+        tune(cfg, paths, layouts, a.dispatch, a.depth, os.path.join(tmp, "masks"))
+
+
+if __name__ == "__main__":
+    main()
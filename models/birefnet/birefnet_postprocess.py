@@ -0,0 +1,194 @@
+"""Shared BiRefNet postprocessing: logits -> uint8 mask -> original-size mask / RGBA cutout.
+
+Default (exact) mode is byte-identical to the scripts' original
+`(sigmoid(x) * 255).clip(0, 255).astype(uint8)` + PIL bilinear resize:
+  * float32 logits go through an in-place `out=` chain on a reused scratch plane (no temporaries);
+  * float16 logits use a 65536-entry lookup table indexed by the fp16 bit pattern, built by running
+    the reference formula once over every fp16 value.
+Approximate mode (opt-in) quantises float32 logits to fp16 for the same lookup and upsamples large
+outputs in two steps (bilinear to half size, then nearest); masks differ by under one grey level
+on average, more along sharp edges.
+
+    python models/birefnet/birefnet_postprocess.py --out 3840x2160   # per-image timings at 4K
+"""
+import argparse
+import threading
+import time
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from birefnet_trace import span
+
+_F16_LUT: Optional[np.ndarray] = None
+
+
+def _reference_uint8(logits: np.ndarray) -> np.ndarray:
+    """The scripts' original sigmoid -> uint8 conversion."""
+    mask = 1.0 / (1.0 + np.exp(-logits))
+    return (mask * 255.0).clip(0, 255).astype(np.uint8)
+
+
+def f16_lut() -> np.ndarray:
+    """uint8 mask value for every float16 bit pattern (NaN patterns map to 0)."""
+    global _F16_LUT
+    if _F16_LUT is None:
+        values = np.arange(65536, dtype=np.uint32).astype(np.uint16).view(np.float16)
+        with np.errstate(all="ignore"):
+            lut = _reference_uint8(values)
+        lut[np.isnan(values)] = 0
+        _F16_LUT = lut
+    return _F16_LUT
+
+
+def squeeze_logits(logits: np.ndarray) -> np.ndarray:
+    if logits.ndim == 4:
+        return logits[0, 0]
+    if logits.ndim == 3:
+        return logits[0]
+    return logits
+
+
+class MaskPostprocessor:
+    """Reusable postprocess engine; scratch planes are per thread, so one instance can be shared."""
+
+    def __init__(self, approx: bool = False):
+        self.approx = approx
+        self._local = threading.local()
+
+    def _scratch(self, shape, dtype) -> np.ndarray:
+        key = (shape, np.dtype(dtype).str)
+        bufs = getattr(self._local, "bufs", None)
+        if bufs is None:
+            bufs = self._local.bufs = {}
+        buf = bufs.get(key)
+        if buf is None:
+            buf = bufs[key] = np.empty(shape, dtype=dtype)
+        return buf
+
+    def _sigmoid_f32(self, logits: np.ndarray) -> np.ndarray:
+        """sigmoid(logits) in a reused float32 plane, same op order as `1.0 / (1.0 + np.exp(-x))`."""
+        buf = self._scratch(logits.shape, np.float32)
+        np.negative(logits, out=buf)
+        np.exp(buf, out=buf)
+        buf += 1.0
+        np.reciprocal(buf, out=buf)
+        return buf
+
+    def to_uint8(self, logits: np.ndarray) -> np.ndarray:
+        """Low-resolution uint8 mask (a new array) from [1,1,H,W] / [1,H,W] / [H,W] logits."""
+        with span("sigmoid"):
+            return self._to_uint8(logits)
+
+    def _to_uint8(self, logits: np.ndarray) -> np.ndarray:
+        logits = squeeze_logits(np.asarray(logits))
+        out = np.empty(logits.shape, dtype=np.uint8)
+        if logits.dtype == np.float16:
+            return np.take(f16_lut(), logits.view(np.uint16), out=out)
+        if self.approx:
+            h = self._scratch(logits.shape, np.float16)
+            np.copyto(h, logits, casting="unsafe")
+            return np.take(f16_lut(), h.view(np.uint16), out=out)
+        if logits.dtype != np.float32:
+            return _reference_uint8(logits)
+        buf = self._sigmoid_f32(logits)
+        buf *= 255.0
+        np.clip(buf, 0, 255, out=buf)
+        np.copyto(out, buf, casting="unsafe")
+        return out
+
+    def probabilities(self, logits: np.ndarray, dtype=np.float16) -> np.ndarray:
+        """Low-resolution sigmoid map as a new `dtype` array (float16 halves the memory of float32)."""
+        logits = squeeze_logits(np.asarray(logits, dtype=np.float32))
+        return self._sigmoid_f32(logits).astype(dtype)
+
+    def resize(self, mask: np.ndarray, out_size: Tuple[int, int]) -> Image.Image:
+        with span("upsample"):
+            return self._resize(mask, out_size)
+
+    def _resize(self, mask: np.ndarray, out_size: Tuple[int, int]) -> Image.Image:
+        img = Image.fromarray(mask, mode="L")
+        w, h = out_size
+        if self.approx and w >= 2 * img.width and h >= 2 * img.height:
+            return img.resize(((w + 1) // 2, (h + 1) // 2), resample=Image.BILINEAR).resize(
+                out_size, resample=Image.NEAREST)
+        return img.resize(out_size, resample=Image.BILINEAR)
+
+    def __call__(self, logits: np.ndarray, out_size: Tuple[int, int]) -> Image.Image:
+        return self.resize(self.to_uint8(logits), out_size)
+
+
+EXACT = MaskPostprocessor()
+APPROX = MaskPostprocessor(approx=True)
+
+
+def postprocess(logits: np.ndarray, out_size: Tuple[int, int], approx: bool = False) -> Image.Image:
+    return (APPROX if approx else EXACT)(logits, out_size)
+
+
+def to_rgba(rgb: Image.Image, alpha: Image.Image) -> Image.Image:
+    """Attach `alpha` to `rgb` in place and return it (RGB -> RGBA reuses the same pixel buffer).
+
+    The caller's image becomes the cutout; copy it first if the plain RGB is still needed.
+    """
+    rgb.putalpha(alpha)
+    return rgb
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Time BiRefNet postprocess variants against the original code.")
+    ap.add_argument("--out", default="3840x2160", help="Output (original image) size WxH.")
+    ap.add_argument("--mask", type=int, default=512, help="Model output size.")
+    ap.add_argument("--runs", type=int, default=10)
+    a = ap.parse_args()
+
+    w, h = (int(v) for v in a.out.lower().split("x"))
+    rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[0:a.mask, 0:a.mask].astype(np.float32) / a.mask
+    logits = (12.0 * (0.3 - np.hypot(xx - 0.5, yy - 0.5)) / 0.3 + rng.normal(0, 0.5, xx.shape)).astype(np.float32)
+    logits = logits[None, None]
+    rgb = Image.fromarray(rng.integers(0, 256, (h, w, 3), dtype=np.uint8), "RGB")
+
+    def bench(fn):
+        fn()
+        t0 = time.perf_counter()
+        for _ in range(a.runs):
+            fn()
+        return 1000 * (time.perf_counter() - t0) / a.runs
+
+    def legacy(x):
+        return Image.fromarray(_reference_uint8(squeeze_logits(x)), mode="L").resize((w, h), resample=Image.BILINEAR)
+
+    for name, x in (("fp32 logits", logits), ("fp16 logits", logits.astype(np.float16))):
+        with np.errstate(over="ignore"):
+            ref = np.asarray(legacy(x))
+        exact = np.asarray(EXACT(x, (w, h)))
+        approx = np.asarray(APPROX(x, (w, h)))
+        print(f"[{name}] {a.mask}x{a.mask} -> {w}x{h}")
+        np.seterr(over="ignore")
+        print(f"  sigmoid->uint8  legacy {bench(lambda: _reference_uint8(squeeze_logits(x))):7.2f} ms  "
+              f"exact {bench(lambda: EXACT.to_uint8(x)):7.2f} ms  approx {bench(lambda: APPROX.to_uint8(x)):7.2f} ms")
+        print(f"  full mask       legacy {bench(lambda: legacy(x)):7.2f} ms  "
+              f"exact {bench(lambda: EXACT(x, (w, h))):7.2f} ms  approx {bench(lambda: APPROX(x, (w, h))):7.2f} ms")
+        print(f"  exact byte-identical: {np.array_equal(ref, exact)}  "
+              f"approx max diff {np.abs(ref.astype(int) - approx).max()} (mean {np.abs(ref.astype(int) - approx).mean():.3f})")
+
+    alpha = EXACT(logits, (w, h))
+    t_copy = t_inplace = 0.0
+    for _ in range(a.runs):
+        src = rgb.copy()  # fresh source outside the timed region
+        t0 = time.perf_counter()
+        rgba = src.copy()
+        rgba.putalpha(alpha)
+        t_copy += time.perf_counter() - t0
+        del rgba
+        t0 = time.perf_counter()
+        to_rgba(src, alpha)
+        t_inplace += time.perf_counter() - t0
+    print(f"[composite {w}x{h}] copy+putalpha {1000 * t_copy / a.runs:7.2f} ms  "
+          f"in place {1000 * t_inplace / a.runs:7.2f} ms  (saves one {w * h * 4 / 2**20:.0f} MiB buffer)")
+
+
+if __name__ == "__main__":
+    main()
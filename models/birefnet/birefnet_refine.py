@@ -0,0 +1,222 @@
+"""Boundary-band tiled refinement for high-resolution BiRefNet mattes.
+
+The model only sees the image at its input size (512x512), so on 4K photos every edge is a bilinear
+upsample. Running the whole image as a `grid x grid` mosaic of model-size tiles gives `grid` times
+the detail at `grid**2` times the cost. This does it only where it matters:
+
+  1. a global pass at the model size gives the coarse mask;
+  2. tiles whose coarse alpha has uncertain pixels (probability in (--band-lo, --band-hi)) are
+     cropped from the full-resolution image with some overlap and re-inferred at the model size;
+  3. each refined tile is feathered into the upsampled global mask (linear ramps across the
+     overlap sum to one, so adjacent tiles blend seamlessly and lone tiles fade into the global mask).
+
+Solid foreground and background keep the global result; the cost is 1 + (refined tiles) model runs.
+
+    python models/birefnet/birefnet_refine.py --model model.onnx --image photo_4k.jpg --save-mask mask.png
+    python models/birefnet/birefnet_refine.py --model model.onnx --input assets/4k/ --out-dir outputs/refined \\
+        --grid 4 --compare-full   # also run every tile and report speed-up and mask difference
+"""
+import argparse
+import os
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+from birefnet_io import collect_inputs, open_image, output_names
+from birefnet_postprocess import APPROX, EXACT
+
+Box = Tuple[int, int, int, int]  # x0, y0, x1, y1 in original-image pixels
+
+
+@dataclass
+class RefineStats:
+    tiles: int = 0          # tiles re-inferred
+    grid_tiles: int = 0     # tiles in the full mosaic
+    band_fraction: float = 0.0  # share of low-res pixels in the uncertain band
+    global_ms: float = 0.0
+    refine_ms: float = 0.0
+
+    @property
+    def total_ms(self) -> float:
+        return self.global_ms + self.refine_ms
+
+
+def tile_boxes(w: int, h: int, grid: int, overlap: float) -> List[Tuple[Box, Box]]:
+    """(core, crop) boxes of a `grid x grid` split; crops extend `overlap` x tile size past the core."""
+    overlap = min(max(overlap, 0.0), 0.45)  # ramps of neighbouring tiles must not cross inside a core
+    xs = [round(i * w / grid) for i in range(grid + 1)]
+    ys = [round(i * h / grid) for i in range(grid + 1)]
+    mx, my = round(overlap * w / grid), round(overlap * h / grid)
+    boxes = []
+    for r in range(grid):
+        for c in range(grid):
+            core = (xs[c], ys[r], xs[c + 1], ys[r + 1])
+            crop = (max(0, core[0] - mx), max(0, core[1] - my), min(w, core[2] + mx), min(h, core[3] + my))
+            boxes.append((core, crop))
+    return boxes
+
+
+def _ramp(n: int, start: int, core0: int, core1: int, end: int) -> np.ndarray:
+    """1-D weights over [start, end): 0 -> 1 across the leading margin's 2x width, 1 -> 0 across the trailing."""
+    x = np.arange(start, end, dtype=np.float32) + 0.5
+    w = np.ones(n, dtype=np.float32)
+    lead, trail = core0 - start, end - core1
+    if lead > 0:
+        np.minimum(w, (x - start) / (2 * lead), out=w)
+    if trail > 0:
+        np.minimum(w, (end - x) / (2 * trail), out=w)
+    return w
+
+
+def feather(core: Box, crop: Box) -> np.ndarray:
+    """[crop_h, crop_w] blend weights; interior overlaps of adjacent tiles sum to exactly one."""
+    wx = _ramp(crop[2] - crop[0], crop[0], core[0], core[2], crop[2])
+    wy = _ramp(crop[3] - crop[1], crop[1], core[1], core[3], crop[3])
+    return wy[:, None] * wx[None, :]
+
+
+def band_tiles(mask: np.ndarray, boxes: List[Tuple[Box, Box]], size: Tuple[int, int],
+               lo: float, hi: float) -> Tuple[List[int], float]:
+    """Indices of tiles whose core holds uncertain low-res mask values, plus the band's pixel share."""
+    band = (mask > lo * 255) & (mask < hi * 255)
+    w, h = size
+    lh, lw = band.shape
+    picked = []
+    for i, (core, _) in enumerate(boxes):
+        x0, x1 = core[0] * lw // w, -(-core[2] * lw // w)
+        y0, y1 = core[1] * lh // h, -(-core[3] * lh // h)
+        if band[y0:y1, x0:x1].any():
+            picked.append(i)
+    return picked, float(band.mean())
+
+
+class BandRefiner:
+    """Two-pass (global + uncertain tiles) matting on top of any `infer_batch(list of [1,3,h,w]) -> logits`."""
+
+    def __init__(self, preprocess: Callable, infer_batch: Callable[[List[np.ndarray]], List[np.ndarray]],
+                 grid: int = 4, overlap: float = 0.125, band: Tuple[float, float] = (0.05, 0.95),
+                 max_batch: int = 4, approx: bool = False):
+        self.preprocess = preprocess
+        self.infer_batch = infer_batch
+        self.grid = max(1, grid)
+        self.overlap = overlap
+        self.lo, self.hi = band
+        self.max_batch = max(1, max_batch)
+        self.post = APPROX if approx else EXACT
+
+    def __call__(self, img: Image.Image, tiles: str = "band") -> Tuple[Image.Image, RefineStats]:
+        """Refined full-size mask of an RGB image; `tiles="all"` re-infers the whole mosaic (reference)."""
+        stats = RefineStats(grid_tiles=self.grid ** 2)
+        size = img.size
+        t0 = time.perf_counter()
+        x, _ = self.preprocess(img)
+        low = self.post.to_uint8(self.infer_batch([x])[0])
+        base = np.asarray(self.post.resize(low, size))
+        stats.global_ms = 1000 * (time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        boxes = tile_boxes(size[0], size[1], self.grid, self.overlap)
+        picked, stats.band_fraction = band_tiles(low, boxes, size, self.lo, self.hi)
+        if tiles == "all":
+            picked = list(range(len(boxes)))
+        stats.tiles = len(picked)
+        if not picked:
+            stats.refine_ms = 1000 * (time.perf_counter() - t0)
+            return Image.fromarray(base, mode="L"), stats
+
+        out = base.astype(np.float32)
+        for b in range(0, len(picked), self.max_batch):
+            chunk = [boxes[i] for i in picked[b:b + self.max_batch]]
+            logits = self.infer_batch([self.preprocess(img.crop(crop))[0] for _, crop in chunk])
+            for (core, crop), y in zip(chunk, logits):
+                tile = np.asarray(self.post.resize(self.post.to_uint8(y), (crop[2] - crop[0], crop[3] - crop[1])))
+                region = (slice(crop[1], crop[3]), slice(crop[0], crop[2]))
+                # out += w * (tile - global): where refined neighbours overlap their weights sum to one
+                out[region] += feather(core, crop) * (tile.astype(np.float32) - base[region])
+        np.rint(out, out=out)
+        np.clip(out, 0, 255, out=out)
+        stats.refine_ms = 1000 * (time.perf_counter() - t0)
+        return Image.fromarray(out.astype(np.uint8), mode="L"), stats
+
+
+def main():
+    from birefnet_buckets import add_bucket_args
+    from birefnet_server import load_backend, make_batch_infer
+
+    ap = argparse.ArgumentParser(description="BiRefNet boundary-band tiled refinement for high-resolution mattes.")
+    ap.add_argument("--backend", choices=["ort", "mnn"], default="ort")
+    ap.add_argument("--model", default=None, help="Local ONNX model (ORT backend).")
+    ap.add_argument("--mnn", default=None, help="MNN model (MNN backend).")
+    ap.add_argument("--pp-json", default=None, help="Local preprocessor_config.json (default: built-in config).")
+    ap.add_argument("--providers", default=None, help="Comma-separated ORT providers.")
+    ap.add_argument("--threads", type=int, default=4, help="MNN threads.")
+    add_bucket_args(ap)
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--image", help="URL or local image path.")
+    src.add_argument("--input", help="Image directory, glob pattern, or manifest file.")
+    ap.add_argument("--save-mask", default="refined_mask.png", help="Output mask (single-image mode).")
+    ap.add_argument("--out-dir", default="outputs/refined", help="Output directory (--input mode).")
+    ap.add_argument("--grid", type=int, default=4, help="Tiles per side; refined detail is grid x the model size.")
+    ap.add_argument("--overlap", type=float, default=0.125, help="Tile overlap as a fraction of the tile size.")
+    ap.add_argument("--band-lo", type=float, default=0.05, help="Lower alpha bound of the uncertain band.")
+    ap.add_argument("--band-hi", type=float, default=0.95, help="Upper alpha bound of the uncertain band.")
+    ap.add_argument("--max-batch", type=int, default=4, help="Tiles per inference call.")
+    ap.add_argument("--approx-postprocess", action="store_true")
+    ap.add_argument("--compare-full", action="store_true",
+                    help="Also re-infer every tile and report the speed-up and mask difference.")
+    args = ap.parse_args()
+    if (args.backend == "ort") != bool(args.model) or (args.backend == "mnn") != bool(args.mnn):
+        ap.error("--backend ort needs --model, --backend mnn needs --mnn")
+    if not 0.0 <= args.band_lo < args.band_hi <= 1.0:
+        ap.error("need 0 <= --band-lo < --band-hi <= 1")
+
+    preprocess, _, infer, fixed = load_backend(args)
+    refiner = BandRefiner(preprocess, make_batch_infer(infer, fixed), args.grid, args.overlap,
+                          (args.band_lo, args.band_hi), args.max_batch, args.approx_postprocess)
+
+    if args.image:
+        paths, masks = [args.image], [args.save_mask]
+    else:
+        paths = collect_inputs(args.input)
+        os.makedirs(args.out_dir, exist_ok=True)
+        masks = output_names(paths, args.out_dir)
+
+    refiner(Image.new("RGB", (64, 64)))  # warm up before timing
+    totals = []
+    for path, mask_path in zip(paths, masks):
+        try:
+            img = open_image(path).convert("RGB")
+        except Exception as e:
+            print(f"[WARN] Skipping {path}: {e}")
+            continue
+        mask, st = refiner(img)
+        mask.save(mask_path)
+        line = (f"{os.path.basename(mask_path)}: {img.width}x{img.height}  {st.tiles}/{st.grid_tiles} tiles "
+                f"(band {100 * st.band_fraction:.1f}%)  global {st.global_ms:.0f} ms + refine {st.refine_ms:.0f} ms "
+                f"= {st.total_ms:.0f} ms")
+        row = [st.total_ms, st.tiles, st.grid_tiles]
+        if args.compare_full:
+            ref, full = refiner(img, tiles="all")
+            diff = np.abs(np.asarray(mask, dtype=np.int16) - np.asarray(ref, dtype=np.int16))
+            line += (f"  | all tiles {full.total_ms:.0f} ms (speed-up {full.total_ms / max(st.total_ms, 1e-6):.1f}x), "
+                     f"MAE {diff.mean():.3f}, max {diff.max()}")
+            row.append(full.total_ms)
+        print(line)
+        totals.append(row)
+
+    if len(totals) > 1:
+        t = np.array(totals, dtype=np.float64)
+        summary = (f"[refine] {len(totals)} images, mean {t[:, 0].mean():.0f} ms/image, "
+                   f"{t[:, 1].sum():.0f}/{t[:, 2].sum():.0f} tiles refined")
+        if args.compare_full:
+            summary += f", all tiles {t[:, 3].mean():.0f} ms/image (speed-up {t[:, 3].sum() / t[:, 0].sum():.1f}x)"
+        print(summary)
+    if args.image and totals:
+        print(f"Saved mask: {args.save_mask}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""Offline registry of BiRefNet model variants (resources/birefnet/registry.json).
+
+Every `hf_hub_download` call checks the Hub for a newer revision, which adds start-up latency and
+fails on air-gapped nodes. `prefetch` fetches each variant once into the registry directory and
+records its files, size, mtime, sha256 and preprocessor config. At start-up `--variant NAME`
+resolves to local paths with one small JSON read: huggingface_hub is never imported, and the
+recorded sha256 seeds `birefnet_io.model_digest`, so cache keys do not re-hash the model either.
+
+    python models/birefnet/birefnet_registry.py prefetch --variants fp32,fp16     # once, with network
+    python models/birefnet/birefnet_registry.py add int8 resources/birefnet/raw/model_int8_qdq.onnx
+    python models/birefnet/birefnet_registry.py list
+    python models/birefnet/birefnet_registry.py verify                            # full sha256 check
+    python models/birefnet/birefnet_registry.py coldstart --variant fp32 --image demo.jpg
+
+    python models/birefnet/birefnet_infer_local.py --variant fp16 --image demo.jpg
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+DEFAULT_REPO = "onnx-community/BiRefNet-ONNX"
+PREPROCESSOR_FILE = "preprocessor_config.json"
+SIDECARS = (".data", "_data")  # external-initializer files next to a model (ORT / Hub naming)
+DEFAULT_MANIFEST = os.environ.get("BIREFNET_REGISTRY") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "resources", "birefnet", "registry.json")
+
+# Known variants: where prefetch gets them (repo file) or which local file it registers (built locally).
+CATALOG: Dict[str, Dict] = {
+    "fp32": {"backend": "ort", "file": "raw/model.onnx", "remote": "onnx/model.onnx"},
+    "fp16": {"backend": "ort", "file": "raw/model_fp16.onnx", "remote": "onnx/model_fp16.onnx"},
+    "int8": {"backend": "ort", "file": "raw/model_int8_qdq.onnx"},  # onnx2int8.py output
+    "mnn-w8": {"backend": "mnn", "file": "mnn/birefnet_w8_nostat.mnn"},
+    "mnn-w4": {"backend": "mnn", "file": "mnn/birefnet_w4_nostat.mnn"},
+}
+
+
+@dataclass
+class Variant:
+    name: str
+    backend: str       # "ort" or "mnn"
+    path: str          # absolute model path
+    preprocessor: Optional[str]  # absolute preprocessor_config.json path, if recorded
+    sha256: Optional[str]
+
+
+def sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _file_entry(root: str, rel: str) -> Dict:
+    path = os.path.join(root, rel)
+    st = os.stat(path)
+    return {"file": rel.replace(os.sep, "/"), "bytes": st.st_size, "mtime": st.st_mtime, "sha256": sha256_file(path)}
+
+
+class Registry:
+    """The manifest plus its directory; paths inside are relative to the manifest."""
+
+    def __init__(self, manifest: str = DEFAULT_MANIFEST):
+        self.manifest = os.path.abspath(manifest)
+        self.root = os.path.dirname(self.manifest)
+        self.data: Dict = {"version": 1, "default": "fp32", "variants": {}}
+        if os.path.exists(self.manifest):
+            with open(self.manifest, "r", encoding="utf-8") as f:
+                self.data = json.load(f)
+
+    @property
+    def variants(self) -> Dict[str, Dict]:
+        return self.data.setdefault("variants", {})
+
+    def save(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self.manifest + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.manifest)
+
+    def resolve(self, name: Optional[str] = None) -> Variant:
+        """Local paths for a variant; checks that the files exist with the recorded size (no hashing)."""
+        name = name or self.data.get("default", "fp32")
+        entry = self.variants.get(name)
+        if entry is None:
+            known = ", ".join(sorted(self.variants)) or "none"
+            raise KeyError(f"Variant '{name}' is not in {self.manifest} (registered: {known}). "
+                           f"Run `birefnet_registry.py prefetch` or `add` first.")
+        path = os.path.join(self.root, entry["file"])
+        st = os.stat(path)  # FileNotFoundError if the directory was copied incompletely
+        if st.st_size != entry["bytes"]:
+            raise ValueError(f"{path}: size {st.st_size} != registered {entry['bytes']}; run `verify` or re-prefetch.")
+        pp = entry.get("preprocessor")
+        if entry.get("sha256") and st.st_mtime == entry.get("mtime"):
+            from birefnet_io import seed_digest
+            seed_digest(path, entry["sha256"])
+        return Variant(name, entry["backend"], path, os.path.join(self.root, pp["file"]) if pp else None,
+                       entry.get("sha256"))
+
+    def register(self, name: str, rel: str, backend: str, source: Optional[Dict] = None,
+                 preprocessor: Optional[str] = None):
+        entry = _file_entry(self.root, rel)
+        entry["backend"] = backend
+        if source:
+            entry["source"] = source
+        if preprocessor:
+            entry["preprocessor"] = _file_entry(self.root, preprocessor)
+        extra = [rel + suffix for suffix in SIDECARS if os.path.exists(os.path.join(self.root, rel + suffix))]
+        if extra:
+            entry["extra"] = [_file_entry(self.root, e) for e in extra]
+        self.variants[name] = entry
+
+
+def _hub_fetch(repo: str, filename: str, dest: str):
+    """Download one repo file straight into the registry directory (only place huggingface_hub is used)."""
+    try:
+        from huggingface_hub import hf_hub_download
+    except ImportError as e:
+        raise RuntimeError("prefetch needs huggingface_hub: `pip install huggingface_hub`") from e
+    src = hf_hub_download(repo_id=repo, filename=filename)
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    shutil.copyfile(src, dest + ".tmp")
+    os.replace(dest + ".tmp", dest)
+
+
+def prefetch(reg: Registry, names: List[str], repo: str = DEFAULT_REPO, force: bool = False):
+    pp_rel = "raw/" + PREPROCESSOR_FILE
+    pp_path = os.path.join(reg.root, pp_rel)
+    if force or not os.path.exists(pp_path):
+        print(f"[prefetch] {repo}/{PREPROCESSOR_FILE}")
+        try:
+            _hub_fetch(repo, PREPROCESSOR_FILE, pp_path)
+        except Exception as e:  # local-only variants can still be registered
+            print(f"[WARN] Could not fetch {PREPROCESSOR_FILE}: {e}")
+    for name in names:
+        spec = CATALOG.get(name)
+        if spec is None:
+            print(f"[WARN] Unknown variant '{name}' (known: {', '.join(CATALOG)}); use `add` for custom files.")
+            continue
+        dest = os.path.join(reg.root, spec["file"])
+        if "remote" in spec and (force or not os.path.exists(dest)):
+            print(f"[prefetch] {repo}/{spec['remote']} -> {dest}")
+            _hub_fetch(repo, spec["remote"], dest)
+        if not os.path.exists(dest):
+            print(f"[WARN] {name}: {dest} does not exist (built locally, not downloadable); skipped.")
+            continue
+        source = {"repo": repo, "filename": spec["remote"]} if "remote" in spec else None
+        pp = pp_rel if spec["backend"] == "ort" and os.path.exists(pp_path) else None
+        reg.register(name, spec["file"], spec["backend"], source, pp)
+        print(f"[prefetch] {name}: {spec['file']} ({reg.variants[name]['bytes'] / 2**20:.1f} MB) registered")
+    reg.save()
+
+
+def verify(reg: Registry) -> bool:
+    ok = True
+    for name, entry in sorted(reg.variants.items()):
+        files = [entry] + ([entry["preprocessor"]] if entry.get("preprocessor") else []) + entry.get("extra", [])
+        for f in files:
+            path = os.path.join(reg.root, f["file"])
+            if not os.path.exists(path):
+                status = "missing"
+            elif sha256_file(path) != f["sha256"]:
+                status = "CHECKSUM MISMATCH"
+            else:
+                status = "ok"
+            ok &= status == "ok"
+            print(f"  {name:<8} {f['file']:<40} {status}")
+    return ok
+
+
+def coldstart(variant: str, image: str, manifest: str, repo: Optional[str]) -> None:
+    """Time fresh processes from launch to first mask: --variant (registry) vs --repo (Hub lookups)."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "birefnet_infer_local.py")
+    runs = [("registry", ["--variant", variant, "--registry", manifest])]
+    if repo:
+        runs.append(("hub", ["--repo", repo]))
+    for label, extra in runs:
+        out = os.path.join(os.path.dirname(os.path.abspath(manifest)), f".coldstart_{label}.png")
+        t0 = time.perf_counter()
+        r = subprocess.run([sys.executable, script, "--image", image, "--save-mask", out] + extra,
+                           capture_output=True, text=True)
+        dt = time.perf_counter() - t0
+        if r.returncode != 0:
+            print(f"[coldstart] {label:<9} failed: {r.stderr.strip().splitlines()[-1] if r.stderr.strip() else r.returncode}")
+            continue
+        print(f"[coldstart] {label:<9} launch -> first mask {1000 * dt:8.0f} ms")
+        if os.path.exists(out):
+            os.remove(out)
+
+
+def add_registry_args(ap: argparse.ArgumentParser):
+    ap.add_argument("--variant", default=None,
+                    help=f"Model variant from the offline registry ({', '.join(CATALOG)}, or any added name).")
+    ap.add_argument("--registry", default=DEFAULT_MANIFEST, help="Registry manifest (env: BIREFNET_REGISTRY).")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Offline BiRefNet model registry.")
+    ap.add_argument("--registry", default=DEFAULT_MANIFEST, help="Manifest path (env: BIREFNET_REGISTRY).")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("prefetch", help="Download/register variants once (needs network for remote ones).")
+    p.add_argument("--variants", default="fp32", help=f"Comma-separated, from: {', '.join(CATALOG)}.")
+    p.add_argument("--repo", default=DEFAULT_REPO)
+    p.add_argument("--force", action="store_true", help="Re-download even if the file exists.")
+    p = sub.add_parser("add", help="Register a local model file (copied into the registry directory).")
+    p.add_argument("name")
+    p.add_argument("path")
+    p.add_argument("--backend", choices=["ort", "mnn"], default=None, help="Default: from the file extension.")
+    p.add_argument("--pp-json", default=None, help="preprocessor_config.json (ORT; default: the registry's).")
+    p = sub.add_parser("default", help="Set the variant used when --variant is not given.")
+    p.add_argument("name")
+    sub.add_parser("list")
+    sub.add_parser("verify", help="Recompute every sha256.")
+    p = sub.add_parser("coldstart", help="Launch-to-first-mask time with --variant (and --repo for comparison).")
+    p.add_argument("--variant", default=None)
+    p.add_argument("--image", required=True)
+    p.add_argument("--repo", default=None, help="Also time the Hub path (needs network + huggingface_hub).")
+    a = ap.parse_args()
+
+    reg = Registry(a.registry)
+    if a.cmd == "prefetch":
+        prefetch(reg, [v.strip() for v in a.variants.split(",") if v.strip()], a.repo, a.force)
+    elif a.cmd == "add":
+        backend = a.backend or ("mnn" if a.path.endswith(".mnn") else "ort")
+        rel = os.path.join("mnn" if backend == "mnn" else "raw", os.path.basename(a.path))
+        dest = os.path.join(reg.root, rel)
+        if os.path.abspath(a.path) != os.path.abspath(dest):
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.copyfile(a.path, dest)
+            for suffix in SIDECARS:
+                if os.path.exists(a.path + suffix):
+                    shutil.copyfile(a.path + suffix, dest + suffix)
+        pp_rel = None
+        if backend == "ort":
+            pp_rel = "raw/" + PREPROCESSOR_FILE
+            if a.pp_json:
+                os.makedirs(os.path.join(reg.root, "raw"), exist_ok=True)
+                shutil.copyfile(a.pp_json, os.path.join(reg.root, pp_rel))
+            elif not os.path.exists(os.path.join(reg.root, pp_rel)):
+                print("[WARN] No preprocessor_config.json in the registry; scripts fall back to the default config.")
+                pp_rel = None
+        reg.register(a.name, rel, backend, {"local": os.path.abspath(a.path)}, pp_rel)
+        reg.save()
+        print(f"[add] {a.name}: {rel} ({reg.variants[a.name]['bytes'] / 2**20:.1f} MB)")
+    elif a.cmd == "default":
+        reg.resolve(a.name)
+        reg.data["default"] = a.name
+        reg.save()
+    elif a.cmd == "list":
+        print(f"{reg.manifest} (default: {reg.data.get('default')})")
+        for name, e in sorted(reg.variants.items()):
+            print(f"  {name:<8} {e['backend']:<4} {e['file']:<36} {e['bytes'] / 2**20:8.1f} MB  sha256 {e['sha256'][:12]}")
+    elif a.cmd == "verify":
+        sys.exit(0 if verify(reg) else 1)
+    elif a.cmd == "coldstart":
+        coldstart(a.variant or reg.data.get("default", "fp32"), a.image, reg.manifest, a.repo)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,509 @@
+"""Asyncio HTTP inference server for BiRefNet with dynamic micro-batching (standard library only).
+
+One session (ORT or MNN) is loaded once and serves every request. Concurrent uploads are coalesced
+into micro-batches of up to --max-batch-size images, waiting at most --max-wait-ms for a batch to
+fill. Admission is bounded: when --max-queue requests are already in flight (decoding or waiting
+for inference), or a request has waited longer than --queue-timeout-ms since it arrived, the server
+answers 503 instead of letting latency grow unbounded.
+
+    python models/birefnet/birefnet_server.py serve --backend ort --model model.onnx --port 8080
+    curl --data-binary @photo.jpg -o mask.png http://127.0.0.1:8080/mask
+    curl --data-binary @photo.jpg -o cutout.png 'http://127.0.0.1:8080/mask?cutout=1'
+    curl http://127.0.0.1:8080/metrics
+    python models/birefnet/birefnet_server.py loadgen --url http://127.0.0.1:8080/mask \
+        --image photo.jpg --concurrency 16 --requests 200
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+from PIL import Image
+
+from birefnet_buckets import add_bucket_args, parse_buckets
+from birefnet_io import load_image_reduced
+from birefnet_postprocess import postprocess, to_rgba
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 411: "Length Required",
+           413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class Overloaded(Exception):
+    """Request shed: queue full or queued for too long."""
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str = ""):
+        super().__init__(message or REASONS.get(status, ""))
+        self.status = status
+
+
+@dataclass
+class Job:
+    x: np.ndarray  # [1,3,H,W]
+    future: asyncio.Future
+    enqueued: float
+
+
+def _pct(values, qs=(50, 90, 99)) -> Dict[str, float]:
+    if not values:
+        return {f"p{q}": 0.0 for q in qs}
+    return {f"p{q}": float(v) for q, v in zip(qs, np.percentile(list(values), qs))}
+
+
+class Metrics:
+    """Counters plus sliding windows of recent latencies (milliseconds)."""
+
+    def __init__(self, window: int = 2048):
+        self.started = time.time()
+        self.counts = Counter()
+        self.batch_sizes = Counter()
+        self.latency_ms = deque(maxlen=window)
+        self.queue_ms = deque(maxlen=window)
+        self.infer_ms = deque(maxlen=window)
+        self.done_at = deque(maxlen=window)  # completion times for the recent-throughput estimate
+
+    def request_done(self, ms: float):
+        self.counts["ok"] += 1
+        self.latency_ms.append(ms)
+        self.done_at.append(time.time())
+
+    def batch_done(self, size: int, infer_ms: float, waits_ms: List[float]):
+        self.counts["batches"] += 1
+        self.batch_sizes[size] += 1
+        self.infer_ms.append(infer_ms)
+        self.queue_ms.extend(waits_ms)
+
+    def snapshot(self, queue_depth: int = 0) -> Dict:
+        uptime = time.time() - self.started
+        recent = [t for t in self.done_at if t >= time.time() - 10.0]
+        n_batched = sum(k * v for k, v in self.batch_sizes.items())
+        return {
+            "uptime_s": uptime,
+            "queue_depth": queue_depth,
+            "counts": dict(self.counts),
+            "batch_sizes": {str(k): v for k, v in sorted(self.batch_sizes.items())},
+            "mean_batch_size": n_batched / self.counts["batches"] if self.counts["batches"] else 0.0,
+            "latency_ms": _pct(self.latency_ms),
+            "queue_wait_ms": _pct(self.queue_ms),
+            "infer_ms_per_batch": _pct(self.infer_ms),
+            "throughput_rps": self.counts["ok"] / uptime if uptime > 0 else 0.0,
+            "recent_rps_10s": len(recent) / 10.0,
+        }
+
+
+def make_batch_infer(infer: Callable[[np.ndarray], np.ndarray],
+                     fixed_batch: Optional[int]) -> Callable[[List[np.ndarray]], List[np.ndarray]]:
+    """Run a list of [1,3,H,W] inputs: one stacked call for dynamic-batch models, else fixed-size chunks."""
+    def run(xs: List[np.ndarray]) -> List[np.ndarray]:
+        n = fixed_batch or len(xs)
+        outs = []
+        for b in range(0, len(xs), n):
+            chunk = xs[b:b + n]
+            x = chunk[0] if len(chunk) == 1 == n else np.concatenate(chunk + [np.zeros_like(chunk[0])] * (n - len(chunk)))
+            y = infer(x)
+            outs.extend(y[i:i + 1] for i in range(len(chunk)))
+        return outs
+    return run
+
+
+class MicroBatcher:
+    """Bounded request queue drained by one coroutine that forms batches and runs them on one thread."""
+
+    def __init__(self, infer_batch, max_batch: int, max_wait_ms: float, max_queue: int,
+                 queue_timeout_ms: float, metrics: Metrics):
+        self.infer_batch = infer_batch
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue_timeout = queue_timeout_ms / 1000.0
+        self.queue: asyncio.Queue = asyncio.Queue(max(1, max_queue))
+        self.metrics = metrics
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="infer")  # sessions are driven from one thread
+
+    def submit(self, x: np.ndarray, arrived: Optional[float] = None) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait(Job(x, fut, arrived or time.perf_counter()))
+        except asyncio.QueueFull:
+            raise Overloaded("queue full") from None
+        return fut
+
+    async def _collect(self) -> List[Job]:
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            getter = asyncio.ensure_future(self.queue.get())
+            done, _ = await asyncio.wait({getter}, timeout=timeout)
+            if getter not in done:
+                getter.cancel()  # a cancelled Queue.get never consumes an item
+                break
+            batch.append(getter.result())
+        return batch
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            now = time.perf_counter()
+            live = []
+            for job in batch:
+                if job.future.done():  # caller disconnected
+                    continue
+                if self.queue_timeout > 0 and now - job.enqueued > self.queue_timeout:
+                    self.metrics.counts["shed_timeout"] += 1
+                    job.future.set_exception(Overloaded("queued too long"))
+                    continue
+                live.append(job)
+            if not live:
+                continue
+            t0 = time.perf_counter()
+            try:
+                outs = await loop.run_in_executor(self.executor, self.infer_batch, [j.x for j in live])
+            except Exception as e:
+                for job in live:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                continue
+            self.metrics.batch_done(len(live), 1000 * (time.perf_counter() - t0),
+                                    [1000 * (t0 - j.enqueued) for j in live])
+            for job, out in zip(live, outs):
+                if not job.future.done():
+                    job.future.set_result(out)
+
+
+async def read_request(reader: asyncio.StreamReader, max_body: int):
+    """Minimal HTTP/1.1 request parser: returns (method, target, headers, body) or None at EOF."""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if not e.partial.strip():
+            return None
+        raise HttpError(400, "truncated request head")
+    except asyncio.LimitOverrunError:
+        raise HttpError(400, "request head too large")
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, _ = lines[0].split(" ", 2)
+    except ValueError:
+        raise HttpError(400, "bad request line")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            k, v = line.split(":", 1)
+            headers[k.strip().lower()] = v.strip()
+    body = b""
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        raise HttpError(411, "chunked uploads are not supported; send Content-Length")
+    raw = headers.get("content-length", "") or "0"
+    if not (raw.isascii() and raw.isdigit()):  # int() would also take "-1", "+5" and "1_0"
+        raise HttpError(400, "bad Content-Length")
+    length = int(raw)
+    if length > max_body:
+        raise HttpError(413, f"body larger than {max_body} bytes")
+    if length:
+        body = await reader.readexactly(length)
+    return method.upper(), target, headers, body
+
+
+def write_response(writer: asyncio.StreamWriter, status: int, ctype: str, payload: bytes,
+                   keep_alive: bool, extra: Optional[Dict[str, str]] = None):
+    head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Content-Type: {ctype}",
+            f"Content-Length: {len(payload)}", f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    head += [f"{k}: {v}" for k, v in (extra or {}).items()]
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + payload)
+
+
+def _json(status: int, obj) -> Tuple[int, str, bytes, Dict[str, str]]:
+    return status, "application/json", json.dumps(obj, indent=2).encode("utf-8"), {}
+
+
+class InferenceServer:
+    def __init__(self, preprocess: Callable, size: Tuple[int, int], batcher: MicroBatcher, metrics: Metrics,
+                 workers: int, max_body: int, approx: bool = False):
+        self.preprocess = preprocess  # img -> ([1,3,H,W], orig size)
+        self.size = size  # model input (height, width)
+        self.batcher = batcher
+        self.metrics = metrics
+        self.pool = ThreadPoolExecutor(max(1, workers), thread_name_prefix="codec")
+        self.max_body = max_body
+        self.approx = approx
+        self.inflight = 0  # admitted requests not yet answered (decode, queue, inference, encode)
+
+    def _decode(self, body: bytes, keep_image: bool):
+        if keep_image:  # cutouts need the full-resolution image
+            img = Image.open(io.BytesIO(body)).convert("RGB")
+            size = img.size
+        else:
+            img, size = load_image_reduced(io.BytesIO(body), self.size)
+        x, _ = self.preprocess(img)
+        return x, size, img if keep_image else None
+
+    def _encode(self, logits: np.ndarray, size: Tuple[int, int], img: Optional[Image.Image]) -> bytes:
+        out = postprocess(logits, size, self.approx)
+        if img is not None:
+            out = to_rgba(img, out)
+        buf = io.BytesIO()
+        out.save(buf, format="PNG")
+        return buf.getvalue()
+
+    async def _mask(self, query: Dict[str, List[str]], body: bytes):
+        t0 = time.perf_counter()
+        self.metrics.counts["requests"] += 1
+        if self.inflight >= self.batcher.queue.maxsize:  # shed before spending time on decode
+            self.metrics.counts["shed_full"] += 1
+            return 503, "application/json", b'{"error": "overloaded"}', {"Retry-After": "1"}
+        self.inflight += 1
+        try:
+            return await self._admitted(query, body, t0)
+        finally:
+            self.inflight -= 1
+
+    async def _admitted(self, query: Dict[str, List[str]], body: bytes, t0: float):
+        loop = asyncio.get_running_loop()
+        if not body:
+            self.metrics.counts["bad_request"] += 1
+            return _json(400, {"error": "empty body; POST the image bytes"})
+        cutout = query.get("cutout", ["0"])[0].lower() in ("1", "true", "yes")
+        try:
+            x, size, img = await loop.run_in_executor(self.pool, self._decode, body, cutout)
+        except Exception as e:
+            self.metrics.counts["bad_request"] += 1
+            return _json(400, {"error": f"cannot decode image: {e}"})
+        try:
+            logits = await self.batcher.submit(x, t0)
+        except Overloaded as e:
+            if str(e) == "queue full":
+                self.metrics.counts["shed_full"] += 1
+            return 503, "application/json", json.dumps({"error": str(e)}).encode(), {"Retry-After": "1"}
+        except Exception as e:
+            self.metrics.counts["errors"] += 1
+            return _json(500, {"error": f"{type(e).__name__}: {e}"})
+        png = await loop.run_in_executor(self.pool, self._encode, logits, size, img)
+        self.metrics.request_done(1000 * (time.perf_counter() - t0))
+        return 200, "image/png", png, {}
+
+    async def route(self, method: str, target: str, body: bytes):
+        url = urlsplit(target)
+        if url.path == "/mask":
+            if method != "POST":
+                return _json(405, {"error": "POST image bytes to /mask"})
+            return await self._mask(parse_qs(url.query), body)
+        if url.path == "/metrics":
+            snap = self.metrics.snapshot(self.batcher.queue.qsize())
+            snap["inflight"] = self.inflight
+            return _json(200, snap)
+        if url.path == "/healthz":
+            return 200, "text/plain", b"ok", {}
+        return _json(404, {"error": f"no route {url.path}"})
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    req = await read_request(reader, self.max_body)
+                except HttpError as e:
+                    write_response(writer, e.status, "application/json",
+                                   json.dumps({"error": str(e)}).encode(), False)
+                    await writer.drain()
+                    break
+                if req is None:
+                    break
+                method, target, headers, body = req
+                status, ctype, payload, extra = await self.route(method, target, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                write_response(writer, status, ctype, payload, keep_alive, extra)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def load_backend(args):
+    """Return (preprocess(img) -> (x, size), model input (h, w), infer(x) -> logits, fixed batch or None)."""
+    buckets = getattr(args, "buckets", None)
+    if args.backend == "mnn":
+        import birefnet_infer_mnn as mod
+        if buckets:  # one warm session per aspect-ratio bucket; preprocess picks the bucket per image
+            engine = mod.BucketedMNN(args.mnn, parse_buckets(buckets, mod.PRE.size), threads=args.threads)
+            return engine.preprocess, engine.size, engine.run, 1
+        engine = mod.BiRefNetMNN(args.mnn, threads=args.threads)
+        return mod.preprocess, mod.PRE.size, engine.run, 1  # one image per session run
+    if buckets:
+        print("[WARN] --buckets applies to the MNN backend only; ignoring it.")
+
+    from birefnet_infer_local import make_session, resolve_preproc
+    from birefnet_preprocess import get_preprocessor
+    pp = resolve_preproc(None, args.pp_json, True)
+    providers = [p.strip() for p in args.providers.split(",") if p.strip()] if args.providers else None
+    sess = make_session(args.model, providers=providers)
+    inp, out_name = sess.get_inputs()[0], sess.get_outputs()[0].name
+    pre = get_preprocessor(pp, np.float16 if "float16" in inp.type else np.float32)
+    dim = inp.shape[0]
+    fixed = dim if isinstance(dim, int) and dim > 0 else None
+    return pre, pp.size, lambda x: sess.run([out_name], {inp.name: x})[0], fixed
+
+
+async def serve(args):
+    preprocess, size, infer, fixed = load_backend(args)
+    max_batch = args.max_batch_size
+    if args.backend == "ort" and fixed is not None and fixed != max_batch:
+        print(f"[WARN] Model has a fixed batch dim of {fixed}; batches are run in chunks of {fixed}.")
+    batch_infer = make_batch_infer(infer, fixed)
+    batch_infer([preprocess(Image.new("RGB", (size[1], size[0])))[0]])  # warm up before accepting traffic
+
+    metrics = Metrics()
+    batcher = MicroBatcher(batch_infer, max_batch, args.max_wait_ms, args.max_queue, args.queue_timeout_ms, metrics)
+    app = InferenceServer(preprocess, size, batcher, metrics, args.workers, args.max_body_mb * 2**20,
+                          args.approx_postprocess)
+    server = await asyncio.start_server(app.handle, args.host, args.port, limit=1 << 16)
+    batch_task = asyncio.create_task(batcher.run())
+    print(f"[serve] http://{args.host}:{args.port}  POST /mask  GET /metrics  "
+          f"(max batch {max_batch}, max wait {args.max_wait_ms} ms, queue {args.max_queue})")
+    async with server:
+        try:
+            await server.serve_forever()
+        finally:
+            batch_task.cancel()
+            print(json.dumps(metrics.snapshot(batcher.queue.qsize()), indent=2))
+
+
+async def _http(host: str, port: int, method: str, target: str, body: bytes = b"",
+                conn: Optional[list] = None) -> Tuple[int, bytes]:
+    """One request over a kept-alive connection (`conn` holds [reader, writer] and is reopened as needed)."""
+    if conn is None or not conn:
+        r, w = await asyncio.open_connection(host, port)
+        conn = conn if conn is not None else []
+        conn[:] = [r, w]
+    reader, writer = conn
+    writer.write((f"{method} {target} HTTP/1.1\r\nHost: {host}\r\nContent-Length: {len(body)}\r\n"
+                  f"Content-Type: application/octet-stream\r\n\r\n").encode("latin-1") + body)
+    await writer.drain()
+    head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+    status = int(head[0].split(" ")[1])
+    headers = {k.strip().lower(): v.strip() for k, v in (l.split(":", 1) for l in head[1:] if ":" in l)}
+    payload = await reader.readexactly(int(headers.get("content-length", "0")))
+    if headers.get("connection", "").lower() == "close":
+        writer.close()
+        conn.clear()
+    return status, payload
+
+
+async def loadgen(args):
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    target = url.path + (f"?{url.query}" if url.query else "")
+    if args.image:
+        with open(args.image, "rb") as f:
+            body = f.read()
+    else:
+        from birefnet_io import synth_image
+        buf = io.BytesIO()
+        synth_image(args.synthetic_size, args.synthetic_size).save(buf, format="JPEG", quality=90)
+        body = buf.getvalue()
+
+    statuses = Counter()
+    lat = []
+    remaining = [args.requests]
+
+    async def worker():
+        conn: list = []
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            t0 = time.perf_counter()
+            try:
+                status, _ = await _http(host, port, "POST", target, body, conn)
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                statuses[type(e).__name__] += 1
+                conn.clear()
+                continue
+            statuses[status] += 1
+            if status == 200:
+                lat.append(1000 * (time.perf_counter() - t0))
+            if args.rate > 0:  # open-loop pacing per worker
+                await asyncio.sleep(max(0.0, args.concurrency / args.rate - (time.perf_counter() - t0)))
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    wall = time.perf_counter() - t0
+    p = _pct(lat)
+    print(f"[loadgen] {args.requests} requests, concurrency {args.concurrency}, {len(body) / 1024:.0f} KiB body")
+    print(f"  status {dict(statuses)}")
+    print(f"  throughput {statuses[200] / wall:.2f} ok/s over {wall:.2f}s  "
+          f"latency p50 {p['p50']:.1f} ms  p90 {p['p90']:.1f} ms  p99 {p['p99']:.1f} ms")
+    try:
+        _, payload = await _http(host, port, "GET", "/metrics")
+        m = json.loads(payload)
+        print(f"  server: mean batch {m['mean_batch_size']:.2f}  batches {m['batch_sizes']}  "
+              f"queue wait p50 {m['queue_wait_ms']['p50']:.1f} ms  infer/batch p50 {m['infer_ms_per_batch']['p50']:.1f} ms")
+    except Exception:
+        pass
+
+
+def main():
+    ap = argparse.ArgumentParser(description="BiRefNet HTTP inference server with dynamic micro-batching.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    s = sub.add_parser("serve", help="Run the server.")
+    s.add_argument("--backend", choices=["ort", "mnn"], default="ort")
+    s.add_argument("--model", help="ORT: local .onnx path.")
+    s.add_argument("--pp-json", help="ORT: preprocessor_config.json (default preprocess if omitted).")
+    s.add_argument("--providers", default=None, help="ORT: comma-separated execution providers.")
+    s.add_argument("--mnn", help="MNN: .mnn model path.")
+    s.add_argument("--threads", type=int, default=4, help="MNN: CPU threads.")
+    add_bucket_args(s)
+    s.add_argument("--host", default="127.0.0.1")
+    s.add_argument("--port", type=int, default=8080)
+    s.add_argument("--max-batch-size", type=int, default=4)
+    s.add_argument("--max-wait-ms", type=float, default=10.0, help="Longest wait for a batch to fill.")
+    s.add_argument("--max-queue", type=int, default=64,
+                   help="Requests in flight (decoding or waiting for inference) before new ones get 503.")
+    s.add_argument("--queue-timeout-ms", type=float, default=5000.0,
+                   help="Requests still waiting for inference this long after arrival get 503 (0 disables).")
+    s.add_argument("--workers", type=int, default=max(1, os.cpu_count() or 1), help="Decode/encode threads.")
+    s.add_argument("--max-body-mb", type=int, default=32)
+    s.add_argument("--approx-postprocess", action="store_true")
+
+    g = sub.add_parser("loadgen", help="Synthetic client load against a running server.")
+    g.add_argument("--url", default="http://127.0.0.1:8080/mask")
+    g.add_argument("--image", default=None, help="Image to upload (default: synthetic JPEG).")
+    g.add_argument("--synthetic-size", type=int, default=1024)
+    g.add_argument("--concurrency", type=int, default=8)
+    g.add_argument("--requests", type=int, default=100)
+    g.add_argument("--rate", type=float, default=0.0, help="Target total requests/s (0: closed loop).")
+    a = ap.parse_args()
+
+    if a.cmd == "serve":
+        if a.backend == "ort" and not a.model:
+            ap.error("--model is required for --backend ort")
+        if a.backend == "mnn" and not a.mnn:
+            ap.error("--mnn is required for --backend mnn")
+        try:
+            asyncio.run(serve(a))
+        except KeyboardInterrupt:
+            pass
+    else:
+        asyncio.run(loadgen(a))
+
+
+if __name__ == "__main__":
+    main()
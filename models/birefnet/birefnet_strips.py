@@ -0,0 +1,332 @@
+"""Strip-wise, memory-bounded mask / cutout output for very large source images.
+
+The whole-image path upsamples the low-res mask to the original size in one PIL call, attaches it to
+the RGB as a full RGBA image and encodes that: for a 100MP scan that is 100 MB of mask plus 400 MB of
+RGBA plus the encoder's buffers on top of the decoded source. Here the mask is upsampled a horizontal
+strip at a time and every strip is composited and streamed straight into the output file, so the
+output side needs a few strips of memory whatever the image size (mask-only runs decode the source
+near the model size, so they are bounded end to end; cutouts still hold the decoded RGB source).
+
+The strips are pixel-identical to `MaskPostprocessor.resize`: the horizontal pass is Pillow's own
+(on the small mask-height x output-width intermediate), the vertical pass reproduces Pillow's
+bilinear coefficients and 22-bit fixed-point accumulation per strip, and --approx-postprocess's
+nearest-neighbour step uses the same accumulated source-coordinate table as Pillow. Supported formats
+are png[:level] (streamed IDAT chunks), npy (raw rows after the header) and, for cutouts, alpha.
+
+    python models/birefnet/birefnet_strips.py --size 12000x9000                # mask: whole vs strips
+    python models/birefnet/birefnet_strips.py --image scan.jpg --cutout --strip-rows 256
+    python models/birefnet/birefnet_infer_local.py ... --image scan.tif --save-cutout cutout.png --strip-rows 256
+"""
+import argparse
+import math
+import os
+import struct
+import tempfile
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from birefnet_encode import PNG, OutputFormat, parse_format
+import birefnet_trace as trace
+
+PRECISION_BITS = 32 - 8 - 2  # Pillow's fixed-point precision when resampling 8-bit images
+
+
+def bilinear_coeffs(in_size: int, out_size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Pillow's BILINEAR resample coefficients along one axis: (first source index, int32 weights) per output."""
+    scale = filterscale = in_size / out_size
+    if filterscale < 1.0:
+        filterscale = 1.0
+    support = filterscale  # bilinear support is 1
+    ksize = int(math.ceil(support)) * 2 + 1
+    ss = 1.0 / filterscale
+    starts = np.zeros(out_size, dtype=np.int64)
+    weights = np.zeros((out_size, ksize), dtype=np.int32)
+    for i in range(out_size):
+        center = (i + 0.5) * scale
+        lo = max(int(center - support + 0.5), 0)
+        n = min(int(center + support + 0.5), in_size) - lo
+        k = [max(0.0, 1.0 - abs((x + lo - center + 0.5) * ss)) for x in range(n)]
+        total = sum(k)
+        for x in range(n):
+            v = k[x] / total if total != 0.0 else k[x]
+            weights[i, x] = int(0.5 + v * (1 << PRECISION_BITS)) if v >= 0 else int(-0.5 + v * (1 << PRECISION_BITS))
+        starts[i] = lo
+    return starts, weights
+
+
+def nearest_table(in_size: int, out_size: int) -> np.ndarray:
+    """Source index per output index of Pillow's NEAREST resize (the coordinate is accumulated, not multiplied)."""
+    step = in_size / out_size
+    pos = step * 0.5
+    table = np.empty(out_size, dtype=np.int64)
+    for i in range(out_size):
+        table[i] = int(pos)
+        pos += step
+    return np.minimum(table, in_size - 1)
+
+
+class StripUpsampler:
+    """Rows of `MaskPostprocessor.resize(mask, out_size)` (exact or approx), computed a strip at a time."""
+
+    def __init__(self, mask: np.ndarray, out_size: Tuple[int, int], approx: bool = False):
+        w, h = out_size
+        mh, mw = mask.shape
+        self.size = out_size
+        self.approx = approx and w >= 2 * mw and h >= 2 * mh  # same condition as MaskPostprocessor
+        mid_w, mid_h = ((w + 1) // 2, (h + 1) // 2) if self.approx else (w, h)
+        # Pillow's horizontal pass runs first; doing it alone gives its [mask_h, out_w] intermediate
+        self._tmp = np.asarray(Image.fromarray(mask, mode="L").resize((mid_w, mh), resample=Image.BILINEAR))
+        self._coeffs = None if mid_h == mh else bilinear_coeffs(mh, mid_h)
+        if self.approx:
+            self._ys, self._xs = nearest_table(mid_h, h), nearest_table(mid_w, w)
+
+    def _bilinear_rows(self, r0: int, r1: int) -> np.ndarray:
+        if self._coeffs is None:
+            return self._tmp[r0:r1]
+        starts, weights = self._coeffs[0][r0:r1], self._coeffs[1][r0:r1]
+        acc = np.full((r1 - r0, self._tmp.shape[1]), 1 << (PRECISION_BITS - 1), dtype=np.int32)
+        last = self._tmp.shape[0] - 1
+        for k in range(weights.shape[1]):  # zero weights past a row's window make the clamped rows harmless
+            if weights[:, k].any():  # upsampling leaves the last tap unused
+                acc += weights[:, k:k + 1] * self._tmp[np.minimum(starts + k, last)]
+        acc >>= PRECISION_BITS
+        np.clip(acc, 0, 255, out=acc)
+        return acc.astype(np.uint8)
+
+    def rows(self, r0: int, r1: int) -> np.ndarray:
+        """Output rows [r0, r1) as a uint8 [r1 - r0, width] array."""
+        if not self.approx:
+            return self._bilinear_rows(r0, r1)
+        ys = self._ys[r0:r1]
+        mid = self._bilinear_rows(int(ys[0]), int(ys[-1]) + 1)
+        return mid[ys - ys[0]][:, self._xs]
+
+
+class PngStripWriter:
+    """Streams rows into a PNG (8-bit L or RGBA), choosing None/Sub/Up filtering per row."""
+
+    def __init__(self, path: str, size: Tuple[int, int], channels: int, level: Optional[int] = None):
+        self.w, self.h = size
+        self.c = channels
+        self.f = open(path, "wb")
+        self.f.write(b"\x89PNG\r\n\x1a\n")
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", self.w, self.h, 8, 0 if channels == 1 else 6, 0, 0, 0))
+        self._z = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION if level is None else level)
+        self._prev = np.zeros(self.w * channels, dtype=np.uint8)
+
+    def _chunk(self, tag: bytes, data: bytes):
+        self.f.write(struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data)))
+
+    def write(self, rows: np.ndarray):
+        raw = rows.reshape(rows.shape[0], self.w * self.c)
+        sub = raw.copy()
+        sub[:, self.c:] -= raw[:, :-self.c]
+        up = raw - np.vstack([self._prev[None], raw[:-1]])
+        cands = (raw, sub, up)  # filter types 0, 1, 2
+        # usual heuristic: smallest sum of |byte as signed|
+        best = np.stack([np.abs(c.view(np.int8), dtype=np.int16).sum(axis=1) for c in cands]).argmin(axis=0)
+        out = np.empty((raw.shape[0], raw.shape[1] + 1), dtype=np.uint8)
+        out[:, 0] = best
+        for t, c in enumerate(cands):
+            sel = best == t
+            out[sel, 1:] = c[sel]
+        self._prev = raw[-1].copy()
+        data = self._z.compress(out.tobytes())
+        if data:
+            self._chunk(b"IDAT", data)
+
+    def close(self):
+        self._chunk(b"IDAT", self._z.flush())
+        self._chunk(b"IEND", b"")
+        self.f.close()
+
+
+class NpyStripWriter:
+    """Streams rows of a uint8 array into a .npy file (header first, then C-order rows)."""
+
+    def __init__(self, path: str, size: Tuple[int, int], channels: int):
+        w, h = size
+        shape = (h, w) if channels == 1 else (h, w, channels)
+        self.f = open(path, "wb")
+        np.lib.format.write_array_header_1_0(self.f, {"descr": "|u1", "fortran_order": False, "shape": shape})
+
+    def write(self, rows: np.ndarray):
+        self.f.write(np.ascontiguousarray(rows).tobytes())
+
+    def close(self):
+        self.f.close()
+
+
+def strip_writer(path: str, fmt: OutputFormat, size: Tuple[int, int], channels: int):
+    if fmt.kind in ("png", "alpha"):
+        return PngStripWriter(path, size, 1 if fmt.kind == "alpha" else channels, fmt.level)
+    if fmt.kind == "npy":
+        return NpyStripWriter(path, size, channels)
+    raise ValueError(f"{fmt} cannot be written in strips (use png[:level], npy or alpha)")
+
+
+def check_strip_format(fmt: OutputFormat) -> OutputFormat:
+    if fmt.kind not in ("png", "alpha", "npy"):
+        raise ValueError(f"--strip-rows writes png[:level], npy or alpha, not {fmt}")
+    return fmt
+
+
+@dataclass
+class StripStats:
+    strips: int = 0
+    upsample_s: float = 0.0
+    write_s: float = 0.0
+    mask_min: int = 255
+    mask_max: int = 0
+    mask_sum: int = 0
+    pixels: int = 0
+
+    @property
+    def mask_mean(self) -> float:
+        return self.mask_sum / max(self.pixels, 1)
+
+
+def write_strips(mask: np.ndarray, size: Tuple[int, int], mask_path: Optional[str], mask_fmt: OutputFormat = PNG,
+                 rgb: Optional[Image.Image] = None, cutout_path: Optional[str] = None,
+                 cutout_fmt: OutputFormat = PNG, strip_rows: int = 256, approx: bool = False) -> StripStats:
+    """Upsample the low-res uint8 `mask` to `size` (w, h) and stream the mask / RGBA cutout, `strip_rows` at a time.
+
+    Pixel-identical to `post.resize(mask, size)` and `to_rgba(rgb, that)`; `rgb` is only read (cropped per strip).
+    """
+    w, h = size
+    strip_rows = max(1, strip_rows)
+    up = StripUpsampler(mask, size, approx)
+    st = StripStats()
+    writers = []
+    if mask_path:
+        writers.append((strip_writer(mask_path, mask_fmt, size, 1), False))
+    if cutout_path and rgb is not None:
+        writers.append((strip_writer(cutout_path, cutout_fmt, size, 4), cutout_fmt.kind != "alpha"))
+    try:
+        for r0 in range(0, h, strip_rows):
+            r1 = min(h, r0 + strip_rows)
+            t0 = time.perf_counter()
+            with trace.span("upsample"):
+                alpha = up.rows(r0, r1)
+            t1 = time.perf_counter()
+            with trace.span("encode"):
+                for wr, rgba in writers:
+                    if rgba:
+                        strip = np.empty((r1 - r0, w, 4), dtype=np.uint8)
+                        strip[..., :3] = np.asarray(rgb.crop((0, r0, w, r1)).convert("RGB"))
+                        strip[..., 3] = alpha
+                        wr.write(strip)
+                    else:
+                        wr.write(alpha)
+            st.upsample_s += t1 - t0
+            st.write_s += time.perf_counter() - t1
+            st.strips += 1
+            st.mask_min = min(st.mask_min, int(alpha.min()))
+            st.mask_max = max(st.mask_max, int(alpha.max()))
+            st.mask_sum += int(alpha.sum(dtype=np.int64))
+            st.pixels += alpha.size
+    finally:
+        for wr, _ in writers:
+            wr.close()
+    return st
+
+
+def add_strip_args(ap: argparse.ArgumentParser):
+    ap.add_argument("--strip-rows", type=int, default=0,
+                    help="Memory-capped output: upsample and write masks/cutouts N rows at a time "
+                         "(pixel-identical; png/npy/alpha formats; for 100MP+ sources). 0: whole image.")
+
+
+def allow_large_images():
+    """Strip mode is meant for 100MP+ scans, which Pillow's decompression-bomb guard would reject."""
+    Image.MAX_IMAGE_PIXELS = None
+
+
+# --- benchmark -----------------------------------------------------------------------------------
+
+def _synthetic_mask(n: int = 512) -> np.ndarray:
+    from birefnet_postprocess import EXACT
+    rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[0:n, 0:n].astype(np.float32) / n
+    logits = 12.0 * (0.3 - np.hypot(xx - 0.5, yy - 0.5)) / 0.3 + rng.normal(0, 0.5, xx.shape)
+    return EXACT.to_uint8(logits.astype(np.float32)[None, None])
+
+
+def _run(mode: str, size: Tuple[int, int], image: Optional[str], out_dir: str, strip_rows: int,
+         mask_fmt: OutputFormat, cutout_fmt: OutputFormat, approx: bool) -> Tuple[float, Optional[float]]:
+    """One output pass in a fresh process: (seconds, peak RSS MiB)."""
+    from birefnet_encode import encode
+    from birefnet_io import max_rss_mb
+    from birefnet_postprocess import APPROX, EXACT, to_rgba
+    allow_large_images()
+    mask = _synthetic_mask()
+    rgb = None
+    if image:
+        rgb = Image.open(image)
+        rgb = rgb if rgb.mode == "RGB" else rgb.convert("RGB")  # convert() to the same mode is a full copy
+        rgb.load()
+    mask_path = os.path.join(out_dir, f"{mode}_mask{mask_fmt.ext}")
+    cutout_path = os.path.join(out_dir, f"{mode}_cutout{cutout_fmt.ext}") if rgb is not None else None
+    t0 = time.perf_counter()
+    if mode == "strips":
+        write_strips(mask, size, mask_path, mask_fmt, rgb, cutout_path, cutout_fmt, strip_rows, approx)
+    else:
+        alpha = (APPROX if approx else EXACT).resize(mask, size)
+        encode(alpha, mask_path, mask_fmt)
+        if rgb is not None:
+            encode(alpha if cutout_fmt.kind == "alpha" else to_rgba(rgb, alpha), cutout_path, cutout_fmt)
+    return time.perf_counter() - t0, max_rss_mb()
+
+
+def _same_pixels(a: str, b: str) -> bool:
+    from birefnet_encode import decode
+    return np.array_equal(decode(a), decode(b))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Whole-image vs strip-wise mask/cutout output: time, peak RSS, identity.")
+    ap.add_argument("--size", default="12000x9000", help="Output size WxH when no --image is given.")
+    ap.add_argument("--image", default=None, help="Large source image; its size is the output size.")
+    ap.add_argument("--cutout", action="store_true", help="Also write the RGBA cutout (needs --image).")
+    ap.add_argument("--strip-rows", type=int, default=256)
+    ap.add_argument("--mask-format", type=parse_format, default=PNG)
+    ap.add_argument("--cutout-format", type=parse_format, default=PNG)
+    ap.add_argument("--approx-postprocess", action="store_true")
+    a = ap.parse_args()
+    if a.cutout and not a.image:
+        ap.error("--cutout needs --image")
+    check_strip_format(a.mask_format)
+    check_strip_format(a.cutout_format)
+
+    allow_large_images()
+    if a.image:
+        with Image.open(a.image) as im:
+            size = im.size
+    else:
+        size = tuple(int(v) for v in a.size.lower().split("x"))
+    print(f"[strips] output {size[0]}x{size[1]} ({size[0] * size[1] / 1e6:.0f} MP), {a.strip_rows} rows per strip, "
+          f"mask {a.mask_format}" + (f", cutout {a.cutout_format}" if a.cutout else ""))
+
+    import multiprocessing as mp
+    ctx = mp.get_context("spawn")  # fresh process per mode so peak RSS is not shared
+    with tempfile.TemporaryDirectory() as d:
+        for mode in ("whole", "strips"):
+            with ctx.Pool(1) as pool:
+                secs, rss = pool.apply(_run, (mode, size, a.image if a.cutout else None, d, a.strip_rows,
+                                              a.mask_format, a.cutout_format, a.approx_postprocess))
+            print(f"[{mode:<6}] {secs:6.2f}s  peak RSS {'n/a' if rss is None else f'{rss:.0f} MiB'}")
+        same = _same_pixels(os.path.join(d, f"whole_mask{a.mask_format.ext}"),
+                            os.path.join(d, f"strips_mask{a.mask_format.ext}"))
+        if a.cutout:
+            same &= _same_pixels(os.path.join(d, f"whole_cutout{a.cutout_format.ext}"),
+                                 os.path.join(d, f"strips_cutout{a.cutout_format.ext}"))
+        print(f"[strips] pixel-identical: {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""Per-stage timing spans and per-operator profiles for the BiRefNet scripts, exported as one Chrome trace.
+
+Stages (decode, resize, normalise, infer, sigmoid, upsample, encode) are wrapped in `span(name)`.
+Until `enable()` is called `span()` returns a shared no-op context manager, so instrumented code costs
+one global lookup per stage (see `--overhead`). With operator profiling on, ORT's session profile
+(`enable_profiling`) and MNN's per-op callbacks (`runSessionWithCallBackInfo`) are merged into the
+same timeline on their own tracks. Open the JSON in chrome://tracing or https://ui.perfetto.dev.
+
+    python models/birefnet/birefnet_infer_local.py ... --trace trace.json --profile-ops
+    python models/birefnet/birefnet_trace.py trace.json --top 20   # summary of a saved trace
+    python models/birefnet/birefnet_trace.py --overhead            # cost of a disabled/enabled span
+"""
+import argparse
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+_ACTIVE: Optional["Tracer"] = None
+_NULL = contextlib.nullcontext()
+OP_TRACKS = {"onnxruntime": 1, "mnn": 2}  # synthetic thread ids for operator tracks
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "cat", "t0")
+
+    def __init__(self, tracer: "Tracer", name: str, cat: str):
+        self.tracer, self.name, self.cat = tracer, name, cat
+
+    def __enter__(self):
+        self.t0 = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        t1 = time.perf_counter_ns()
+        self.tracer.add(self.name, self.cat, (self.t0 - self.tracer.perf0) / 1000, (t1 - self.t0) / 1000)
+        return False
+
+
+class Tracer:
+    """Collects complete ("X") events in Chrome trace format; timestamps are microseconds since creation."""
+
+    def __init__(self):
+        self.perf0 = time.perf_counter_ns()
+        self.wall0 = time.time_ns()  # ORT profiles are stamped with the wall clock
+        self.pid = os.getpid()
+        self.events: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def span(self, name: str, cat: str = "stage") -> _Span:
+        return _Span(self, name, cat)
+
+    def add(self, name: str, cat: str, ts_us: float, dur_us: float, tid: Optional[int] = None,
+            args: Optional[Dict] = None):
+        ev = {"name": name, "cat": cat, "ph": "X", "ts": ts_us, "dur": dur_us, "pid": self.pid,
+              "tid": threading.get_native_id() if tid is None else tid}
+        if args:
+            ev["args"] = args
+        with self._lock:
+            self.events.append(ev)
+
+    def add_ort_profile(self, sess) -> int:
+        """End the session's profiling and import its node events; returns the number imported."""
+        path = sess.end_profiling()
+        if not path or not os.path.exists(path):
+            return 0
+        with open(path, "r", encoding="utf-8") as f:
+            events = json.load(f)
+        os.remove(path)
+        offset_us = (sess.get_profiling_start_time_ns() - self.wall0) / 1000
+        n = 0
+        for ev in events:
+            if ev.get("ph") != "X" or ev.get("cat") not in ("Node", "Session"):
+                continue
+            args = ev.get("args", {})
+            node = ev["cat"] == "Node"
+            name = ev["name"][:-len("_kernel_time")] if ev["name"].endswith("_kernel_time") else ev["name"]
+            if node and not ev["name"].endswith("_kernel_time"):
+                continue  # fence_before/after events
+            self.add(name, "op" if node else "ort", ev["ts"] + offset_us, ev["dur"], OP_TRACKS["onnxruntime"],
+                     {"op_type": args.get("op_name", ""), "provider": args.get("provider", "")} if node else None)
+            n += int(node)
+        return n
+
+    def mnn_callbacks(self):
+        """(begin, end) callbacks for `Interpreter.runSessionWithCallBackInfo`, one op event per end."""
+        started: Dict[str, int] = {}
+
+        def begin(tensors, op):
+            started[op.getName()] = time.perf_counter_ns()
+            return True
+
+        def end(tensors, op):
+            t1 = time.perf_counter_ns()
+            t0 = started.pop(op.getName(), t1)
+            self.add(op.getName(), "op", (t0 - self.perf0) / 1000, (t1 - t0) / 1000, OP_TRACKS["mnn"],
+                     {"op_type": op.getType(), "mflops": round(float(op.getFlops()), 4)})
+            return True
+
+        return begin, end
+
+    def chrome_trace(self) -> Dict:
+        meta = [{"name": "process_name", "ph": "M", "pid": self.pid, "args": {"name": "birefnet"}}]
+        tracks = {ev["tid"] for ev in self.events}
+        for label, tid in OP_TRACKS.items():
+            if tid in tracks:
+                meta.append({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid,
+                             "args": {"name": f"{label} ops"}})
+        return {"traceEvents": meta + sorted(self.events, key=lambda e: e["ts"]), "displayTimeUnit": "ms"}
+
+    def save(self, path: str):
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f)
+
+
+def enable() -> Tracer:
+    global _ACTIVE
+    if _ACTIVE is None:
+        _ACTIVE = Tracer()
+    return _ACTIVE
+
+
+def disable():
+    global _ACTIVE
+    _ACTIVE = None
+
+
+def active() -> Optional[Tracer]:
+    return _ACTIVE
+
+
+def span(name: str, cat: str = "stage"):
+    """`with span("decode"):` -- a no-op unless tracing is enabled."""
+    t = _ACTIVE
+    return _NULL if t is None else _Span(t, name, cat)
+
+
+def summary(events: List[Dict], top: int = 15) -> str:
+    """Text tables: stage totals and the top operators by type and by node."""
+    stages: Dict[str, List[float]] = defaultdict(list)
+    by_type: Dict[str, List[float]] = defaultdict(list)
+    by_node: Dict[str, List[float]] = defaultdict(list)
+    for ev in events:
+        if ev.get("ph") != "X":
+            continue
+        ms = ev["dur"] / 1000
+        if ev.get("cat") == "stage":
+            stages[ev["name"]].append(ms)
+        elif ev.get("cat") == "op":
+            by_type[ev.get("args", {}).get("op_type") or "?"].append(ms)
+            by_node[ev["name"]].append(ms)
+
+    lines = []
+    if stages:
+        lines.append(f"{'stage':<12} {'calls':>6} {'total ms':>10} {'mean ms':>9} {'max ms':>9}")
+        for name, v in sorted(stages.items(), key=lambda kv: -sum(kv[1])):
+            lines.append(f"{name:<12} {len(v):>6} {sum(v):>10.2f} {sum(v) / len(v):>9.3f} {max(v):>9.3f}")
+    op_total = sum(sum(v) for v in by_type.values())
+    for title, table in (("op type", by_type), ("node", by_node)):
+        if not table:
+            continue
+        lines.append("")
+        lines.append(f"{title:<32} {'calls':>6} {'total ms':>10} {'share':>7}")
+        for name, v in sorted(table.items(), key=lambda kv: -sum(kv[1]))[:top]:
+            lines.append(f"{name[-32:]:<32} {len(v):>6} {sum(v):>10.2f} {100 * sum(v) / op_total:>6.1f}%")
+    return "\n".join(lines) if lines else "(no events)"
+
+
+def add_trace_args(ap: argparse.ArgumentParser):
+    g = ap.add_argument_group("tracing")
+    g.add_argument("--trace", default=None, help="Write per-stage spans as a Chrome/Perfetto trace JSON.")
+    g.add_argument("--profile-ops", action="store_true",
+                   help="Also profile individual operators (ORT session profiling / MNN op callbacks).")
+
+
+def finish(path: Optional[str], top: int = 15):
+    """Save the active trace (if any) to `path` and print its summary."""
+    t = active()
+    if t is None or not path:
+        return
+    t.save(path)
+    print(summary(t.events, top))
+    print(f"[trace] {len(t.events)} events -> {path}")
+
+
+def _overhead(n: int = 200000):
+    disable()
+    t0 = time.perf_counter_ns()
+    for _ in range(n):
+        pass
+    loop = (time.perf_counter_ns() - t0) / n
+    t0 = time.perf_counter_ns()
+    for _ in range(n):
+        with span("x"):
+            pass
+    off = (time.perf_counter_ns() - t0) / n
+    enable()
+    t0 = time.perf_counter_ns()
+    for _ in range(n):
+        with span("x"):
+            pass
+    on = (time.perf_counter_ns() - t0) / n
+    disable()
+    print(f"[overhead] span() disabled {off - loop:.0f} ns/call, enabled {on - loop:.0f} ns/call "
+          f"(x{n}, empty loop {loop:.0f} ns subtracted)")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Summarise a BiRefNet Chrome trace, or measure span overhead.")
+    ap.add_argument("trace", nargs="?", help="Trace JSON written with --trace.")
+    ap.add_argument("--top", type=int, default=15)
+    ap.add_argument("--overhead", action="store_true")
+    a = ap.parse_args()
+    if a.overhead or not a.trace:
+        _overhead()
+    if a.trace:
+        with open(a.trace, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        print(summary(data["traceEvents"] if isinstance(data, dict) else data, a.top))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""Temporal-reuse BiRefNet matting for frame sequences (frame directories or raw RGB streams).
+
+Consecutive video frames are mostly the same picture. Each frame is reduced to a small grayscale
+thumbnail and compared with the thumbnail of the last inferred frame (the keyframe); below
+--threshold (mean absolute difference, 0..1) the keyframe's mask is reused instead of running the
+model. With --warp, a global translation between the thumbnails is estimated by phase correlation
+and the reused mask is shifted by it, so slow pans still reuse. Every --refresh frames inference is
+forced so errors cannot accumulate. Comparing against the keyframe (not the previous frame) keeps
+slow drifts from slipping under the threshold one small step at a time.
+
+    # frame directory (sorted by name), masks written per frame
+    python models/birefnet/birefnet_video.py --model model.onnx --frames clip_frames/ --out-dir outputs/clip
+    # raw rgb24 stream, e.g. from ffmpeg, with per-frame baseline for drift / speed-up numbers
+    ffmpeg -i clip.mp4 -f rawvideo -pix_fmt rgb24 - | \\
+        python models/birefnet/birefnet_video.py --model model.onnx --frames - --raw 1920x1080 --baseline
+"""
+import argparse
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from birefnet_io import collect_inputs, load_image_reduced, output_names
+from birefnet_postprocess import APPROX, EXACT
+
+
+@dataclass
+class VideoStats:
+    frames: int = 0
+    inferred: int = 0
+    forced: int = 0         # keyframes caused by --refresh rather than by change
+    decode_s: float = 0.0
+    detect_s: float = 0.0   # thumbnails, difference, shift estimate
+    infer_s: float = 0.0    # preprocess + model + postprocess of keyframes
+    reuse_s: float = 0.0    # copying / shifting reused masks
+    baseline_s: float = 0.0
+    drift: List[float] = field(default_factory=list)  # MAE vs per-frame inference, reused frames only
+
+    @property
+    def reused(self) -> int:
+        return self.frames - self.inferred
+
+    @property
+    def effective_fps(self) -> float:
+        busy = self.decode_s + self.detect_s + self.infer_s + self.reuse_s
+        return self.frames / busy if busy > 0 else 0.0
+
+    @property
+    def baseline_fps(self) -> float:
+        busy = self.decode_s + self.baseline_s
+        return self.frames / busy if busy > 0 else 0.0
+
+
+def iter_frames(spec: str, size: Tuple[int, int],
+                raw: Optional[Tuple[int, int]] = None) -> Iterator[Tuple[str, Image.Image, Tuple[int, int]]]:
+    """Yield (name, RGB image, original (w, h)) per frame.
+
+    `spec` is a frame directory / glob / manifest (decoded near the model `size`, like the mask-only
+    path of the inference scripts), or with `raw=(w, h)` a file of packed rgb24 frames ('-' for stdin).
+    """
+    if raw is None:
+        paths = collect_inputs(spec)
+        for path, out in zip(paths, output_names(paths, "")):
+            img, orig = load_image_reduced(path, size)
+            yield os.path.splitext(out)[0], img, orig
+        return
+    w, h = raw
+    n = w * h * 3
+    f = sys.stdin.buffer if spec == "-" else open(spec, "rb")
+    try:
+        for i in range(sys.maxsize):
+            buf = f.read(n)
+            if len(buf) < n:
+                if buf:
+                    print(f"[WARN] Dropping a truncated trailing frame ({len(buf)} of {n} bytes).")
+                return
+            yield f"frame_{i:06d}", Image.frombuffer("RGB", (w, h), buf, "raw", "RGB", 0, 1), (w, h)
+    finally:
+        if f is not sys.stdin.buffer:
+            f.close()
+
+
+def thumbnail(img: Image.Image, width: int) -> np.ndarray:
+    height = max(1, round(width * img.height / img.width))
+    return np.asarray(img.convert("L").resize((width, height), Image.BILINEAR), dtype=np.float32)
+
+
+def estimate_shift(ref: np.ndarray, cur: np.ndarray) -> Tuple[int, int]:
+    """Integer (dy, dx) translation taking `ref` to `cur`, by phase correlation."""
+    a = np.fft.rfft2(ref - ref.mean())
+    b = np.fft.rfft2(cur - cur.mean())
+    r = b * np.conj(a)
+    r /= np.abs(r) + 1e-9
+    corr = np.fft.irfft2(r, s=ref.shape)
+    dy, dx = np.unravel_index(int(np.argmax(corr)), corr.shape)
+    h, w = ref.shape
+    return (dy - h if dy > h // 2 else dy), (dx - w if dx > w // 2 else dx)
+
+
+def shift(arr: np.ndarray, dy: int, dx: int) -> np.ndarray:
+    """`arr` translated by (dy, dx) with edge replication (no wrap-around)."""
+    h, w = arr.shape
+    ys = np.clip(np.arange(h) - dy, 0, h - 1)
+    xs = np.clip(np.arange(w) - dx, 0, w - 1)
+    return arr.take(ys, axis=0).take(xs, axis=1)
+
+
+class TemporalMatting:
+    """Feed frames in order; returns (uint8 full-size mask, reused?) per frame."""
+
+    def __init__(self, preprocess, infer, threshold: float = 0.01, refresh: int = 30, warp: bool = False,
+                 thumb: int = 96, approx: bool = False, stats: Optional[VideoStats] = None):
+        self.preprocess, self.infer = preprocess, infer
+        self.threshold, self.refresh, self.warp, self.thumb = threshold, max(1, refresh), warp, thumb
+        self.post = APPROX if approx else EXACT
+        self.stats = stats or VideoStats()
+        self._key_thumb: Optional[np.ndarray] = None
+        self._key_mask: Optional[np.ndarray] = None
+        self._since = 0
+
+    def infer_mask(self, img: Image.Image, size: Tuple[int, int]) -> np.ndarray:
+        x, _ = self.preprocess(img)
+        return np.asarray(self.post(self.infer(x), size))
+
+    def __call__(self, img: Image.Image, size: Tuple[int, int]) -> Tuple[np.ndarray, bool]:
+        st = self.stats
+        st.frames += 1
+        t0 = time.perf_counter()
+        cur = thumbnail(img, self.thumb)
+        reuse, dy, dx = False, 0, 0
+        key = self._key_mask
+        if key is not None and key.shape == (size[1], size[0]) and cur.shape == self._key_thumb.shape:
+            ref = self._key_thumb
+            if self.warp:
+                dy, dx = estimate_shift(ref, cur)
+                ref = shift(ref, dy, dx)
+            if float(np.abs(ref - cur).mean()) / 255.0 < self.threshold:
+                if self._since + 1 < self.refresh:
+                    reuse = True
+                else:
+                    st.forced += 1
+        t1 = time.perf_counter()
+        st.detect_s += t1 - t0
+
+        if reuse:
+            self._since += 1
+            sy, sx = size[1] / cur.shape[0], size[0] / cur.shape[1]
+            mask = shift(key, round(dy * sy), round(dx * sx)) if (dy or dx) else key
+            st.reuse_s += time.perf_counter() - t1
+            return mask, True
+        mask = self.infer_mask(img, size)
+        self._key_thumb, self._key_mask, self._since = cur, mask, 0
+        st.inferred += 1
+        st.infer_s += time.perf_counter() - t1
+        return mask, False
+
+
+def _parse_size(s: str) -> Tuple[int, int]:
+    w, h = s.lower().split("x")
+    return int(w), int(h)
+
+
+def main():
+    from birefnet_buckets import add_bucket_args
+    from birefnet_server import load_backend
+
+    ap = argparse.ArgumentParser(description="BiRefNet on frame sequences with temporal mask reuse.")
+    ap.add_argument("--backend", choices=["ort", "mnn"], default="ort")
+    ap.add_argument("--model", default=None, help="Local ONNX model (ORT backend).")
+    ap.add_argument("--mnn", default=None, help="MNN model (MNN backend).")
+    ap.add_argument("--pp-json", default=None, help="Local preprocessor_config.json (default: built-in config).")
+    ap.add_argument("--providers", default=None, help="Comma-separated ORT providers.")
+    ap.add_argument("--threads", type=int, default=4, help="MNN threads.")
+    add_bucket_args(ap)
+    ap.add_argument("--frames", required=True, help="Frame directory / glob / manifest, or a raw rgb24 file ('-': stdin).")
+    ap.add_argument("--raw", type=_parse_size, default=None, metavar="WxH", help="Frame size of a raw rgb24 stream.")
+    ap.add_argument("--out-dir", default=None, help="Write one mask PNG per frame here.")
+    ap.add_argument("--threshold", type=float, default=0.01, help="Reuse the keyframe mask below this mean change (0..1).")
+    ap.add_argument("--refresh", type=int, default=30, help="Force inference at least every N frames.")
+    ap.add_argument("--warp", action="store_true", help="Shift reused masks by the estimated global translation.")
+    ap.add_argument("--thumb", type=int, default=96, help="Thumbnail width for change detection.")
+    ap.add_argument("--approx-postprocess", action="store_true")
+    ap.add_argument("--baseline", action="store_true",
+                    help="Also infer every frame, to report the per-frame FPS and the drift of reused masks.")
+    args = ap.parse_args()
+    if (args.backend == "ort") != bool(args.model) or (args.backend == "mnn") != bool(args.mnn):
+        ap.error("--backend ort needs --model, --backend mnn needs --mnn")
+
+    preprocess, size, infer, _ = load_backend(args)
+    tm = TemporalMatting(preprocess, infer, args.threshold, args.refresh, args.warp, args.thumb, args.approx_postprocess)
+    tm.infer_mask(Image.new("RGB", (size[1], size[0])), (64, 64))  # warm up before timing
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+
+    st = tm.stats
+    frames = iter_frames(args.frames, size, args.raw)
+    t_wall = time.perf_counter()
+    while True:
+        t0 = time.perf_counter()
+        item = next(frames, None)
+        st.decode_s += time.perf_counter() - t0
+        if item is None:
+            break
+        name, img, orig = item
+        mask, reused = tm(img, orig)
+        if args.baseline:
+            t0 = time.perf_counter()
+            ref = tm.infer_mask(img, orig)
+            st.baseline_s += time.perf_counter() - t0
+            if reused:
+                st.drift.append(float(np.abs(mask.astype(np.int16) - ref).mean()))
+        if args.out_dir:
+            Image.fromarray(mask, mode="L").save(os.path.join(args.out_dir, name + ".png"))
+    wall = time.perf_counter() - t_wall
+
+    if not st.frames:
+        print("[WARN] No frames read.")
+        return
+    print(f"[video] {st.frames} frames in {wall:.2f}s: {st.inferred} inferred ({st.forced} forced refresh), "
+          f"{st.reused} reused ({100 * st.reused / st.frames:.1f}% reuse)")
+    print(f"  effective {st.effective_fps:.1f} fps  (per frame: decode {1000 * st.decode_s / st.frames:.1f} ms, "
+          f"detect {1000 * st.detect_s / st.frames:.2f} ms; per keyframe: infer "
+          f"{1000 * st.infer_s / max(st.inferred, 1):.1f} ms)")
+    if args.baseline:
+        drift = np.array(st.drift or [0.0])
+        print(f"  per-frame baseline {st.baseline_fps:.1f} fps (speed-up {st.effective_fps / max(st.baseline_fps, 1e-9):.2f}x); "
+              f"drift of reused masks vs baseline: MAE mean {drift.mean():.2f}, max {drift.max():.2f} grey levels")
+
+
+if __name__ == "__main__":
+    main()
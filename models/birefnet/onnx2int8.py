@@ -1,29 +1,111 @@
 
-import argparse, glob, io, os, random
+import argparse, glob, hashlib, io, json, os, random, shutil, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional
 import numpy as np
 from PIL import Image
 import onnx
 from onnx import numpy_helper
 from onnxruntime.quantization import quantize_static, CalibrationDataReader, QuantType, QuantFormat, CalibrationMethod
-try:
-    import requests
-except Exception:
-    requests = None
+from birefnet_io import open_image, synth_image
+from birefnet_postprocess import EXACT
+from birefnet_preprocess import Preprocessor
 
 MEAN = np.array([0.485, 0.456, 0.406], np.float32).reshape(1,1,3)
 STD  = np.array([0.229, 0.224, 0.225], np.float32).reshape(1,1,3)
 
-def upcast_fp16_to_fp32(in_path, out_path):
-    m = onnx.load(in_path); ch=0
-    inits=list(m.graph.initializer)
-    for i,init in enumerate(inits):
-        if init.data_type == onnx.TensorProto.FLOAT16:
-            arr = numpy_helper.to_array(init).astype(np.float32)
-            new = numpy_helper.from_array(arr, name=init.name)
-            m.graph.initializer.remove(init); m.graph.initializer.insert(i,new); ch+=1
-    onnx.checker.check_model(m); onnx.save(m,out_path)
-    print(f"[fp16->fp32] {ch} tensors -> {out_path}")
+F16,F32=onnx.TensorProto.FLOAT16,onnx.TensorProto.FLOAT
+EXTERNAL_LIMIT=1800*2**20  # protobuf caps a serialized model at 2GB; above this, weights go to an external file
+SMALL_TENSOR=1024
+CHUNK=1<<22  # elements read/converted/written per step (16MB of fp32)
+
+def _ext_info(t):
+    d={e.key:e.value for e in t.external_data}
+    return d["location"],int(d.get("offset",0)),(int(d["length"]) if "length" in d else None)
+
+def _numel(t): return int(np.prod(t.dims,dtype=np.int64)) if len(t.dims) else 1
+
+def _chunks(t,base,dtype):
+    """Yield a tensor's data as 1-D chunks; external data is read piecewise, so it is never fully resident."""
+    if t.data_location!=onnx.TensorProto.EXTERNAL:
+        a=numpy_helper.to_array(t).reshape(-1)
+        for i in range(0,len(a),CHUNK): yield a[i:i+CHUNK]
+        return
+    loc,off,n=_ext_info(t)
+    left=_numel(t) if dtype!=np.uint8 else (n if n is not None else _numel(t)*onnx.helper.tensor_dtype_to_np_dtype(t.data_type).itemsize)
+    with open(os.path.join(base,loc),"rb") as f:
+        f.seek(off)
+        while left>0:
+            c=np.fromfile(f,dtype=dtype,count=min(CHUNK,left)); left-=len(c); yield c
+
+class _ExtWriter:
+    """Appends tensor payloads to one external data file (64-byte aligned so they can be memory-mapped)."""
+    def __init__(self,path): self.f=open(path,"wb"); self.loc=os.path.basename(path); self.off=0
+    def write(self,t,chunks,dtype=None):
+        pad=-self.off%64; self.f.write(b"\0"*pad); self.off+=pad; start=self.off
+        for c in chunks:
+            c=np.ascontiguousarray(c,dtype=dtype); c.tofile(self.f); self.off+=c.nbytes
+        t.ClearField("raw_data"); del t.external_data[:]; t.data_location=onnx.TensorProto.EXTERNAL
+        for k,v in (("location",self.loc),("offset",str(start)),("length",str(self.off-start))):
+            e=t.external_data.add(); e.key=k; e.value=v
+    def close(self): self.f.close()
+
+def _upcast_tensor(t,base,writer=None):
+    """fp32 copy of an fp16 TensorProto; written through `writer` (streamed, chunked) when given."""
+    if writer is None:
+        a=np.concatenate(list(_chunks(t,base,np.float16))) if _numel(t) else np.zeros(0,np.float16)
+        return numpy_helper.from_array(a.astype(np.float32).reshape(tuple(t.dims)),name=t.name)
+    new=onnx.TensorProto(); new.name=t.name; new.dims.extend(t.dims); new.data_type=F32
+    writer.write(new,_chunks(t,base,np.float16),np.float32); return new
+
+def _fix_graph(g,base,writer,stats):
+    """Single-pass fp16->fp32 over one graph (and its subgraphs): initializers, types, Cast/dtype attrs, constants."""
+    inits=[]
+    for t in g.initializer:
+        small=_numel(t)*4<SMALL_TENSOR  # kept inline (like onnx.save's size_threshold) so shape inference can read it
+        if t.data_type==F16: inits.append(_upcast_tensor(t,base,None if small else writer)); stats["init"]+=1
+        elif writer is not None and t.data_location==onnx.TensorProto.EXTERNAL:  # re-home into the new data file
+            new=onnx.TensorProto(); new.CopyFrom(t)
+            if small:
+                raw=b"".join(c.tobytes() for c in _chunks(t,base,np.uint8))
+                del new.external_data[:]; new.data_location=onnx.TensorProto.DEFAULT; new.raw_data=raw
+            else: writer.write(new,_chunks(t,base,np.uint8))
+            inits.append(new)
+        else: inits.append(t)
+    del g.initializer[:]; g.initializer.extend(inits)
+    for vi in list(g.input)+list(g.output)+list(g.value_info):
+        tt=vi.type.tensor_type
+        if vi.type.HasField("tensor_type") and tt.elem_type==F16: tt.elem_type=F32; stats["types"]+=1
+    for node in g.node:
+        for at in node.attribute:
+            if at.type==onnx.AttributeProto.INT and at.name in ("to","dtype") and at.i==F16:
+                at.i=F32; stats["casts" if node.op_type=="Cast" else "attrs"]+=1
+            elif at.type==onnx.AttributeProto.TENSOR and at.t.data_type==F16:
+                at.t.CopyFrom(_upcast_tensor(at.t,base)); stats["consts"]+=1
+            elif at.type==onnx.AttributeProto.GRAPH: _fix_graph(at.g,base,writer,stats)
+            elif at.type==onnx.AttributeProto.GRAPHS:
+                for sg in at.graphs: _fix_graph(sg,base,writer,stats)
+
+def upcast_fp16_to_fp32(in_path,out_path,external=None):
+    """Convert an fp16 ONNX model to fp32 without materialising the weights twice.
+
+    The graph is loaded without external data; fp16 weights are read in chunks and, when the result
+    would not fit in one protobuf (or the source already uses external data), streamed in chunks to
+    `<out>.data`. Graph inputs/outputs/value_info, Cast(to=fp16) and fp16 constants are rewritten too."""
+    m=onnx.load(in_path,load_external_data=False); base=os.path.dirname(os.path.abspath(in_path))
+    def out_bytes(t):
+        return _numel(t)*(4 if t.data_type==F16 else onnx.helper.tensor_dtype_to_np_dtype(t.data_type).itemsize)
+    src_ext=any(t.data_location==onnx.TensorProto.EXTERNAL for t in m.graph.initializer)
+    if external is None: external=src_ext or sum(out_bytes(t) for t in m.graph.initializer)>EXTERNAL_LIMIT
+    writer=_ExtWriter(out_path+".data") if external else None
+    stats={"init":0,"types":0,"casts":0,"attrs":0,"consts":0}
+    try: _fix_graph(m.graph,base,writer,stats)
+    finally:
+        if writer: writer.close()
+    onnx.save(m,out_path); onnx.checker.check_model(out_path)
+    print(f"[fp16->fp32] {stats['init']} tensors, {stats['types']} types, {stats['casts']} casts, "
+          f"{stats['consts']+stats['attrs']} consts/attrs -> {out_path}"+(f" (+{os.path.basename(out_path)}.data)" if external else ""))
 
 def detect_input(model_path):
     m=onnx.load(model_path)
@@ -33,52 +115,168 @@ def detect_input(model_path):
     return m.graph.input[0].name
 
 def read_image(path_or_url):
-    if path_or_url and path_or_url.startswith(("http://","https://")) and requests is not None:
-        r=requests.get(path_or_url,timeout=30); r.raise_for_status()
-        from PIL import Image; import io as _io
-        return Image.open(_io.BytesIO(r.content)).convert("RGB")
-    return Image.open(path_or_url).convert("RGB")
+    return open_image(path_or_url).convert("RGB")  # URLs: pooled session with retries (birefnet_fetch)
 
 def preprocess(im,h,w):
-    im=im.resize((w,h), Image.Resampling.BILINEAR)
-    arr=np.asarray(im,np.float32)/255.0
-    arr=(arr-MEAN)/STD
-    arr=np.transpose(arr,(2,0,1))[None,...].astype(np.float32)
-    return arr
-
-def synth_image(h,w):
-    yy,xx=np.meshgrid(np.linspace(0,1,h),np.linspace(0,1,w),indexing="ij")
-    base=(0.6*xx+0.4*yy)[...,None]
-    noise=0.15*np.random.randn(h,w,3)
-    arr=(base+noise+0.2)*255.0
-    arr=np.clip(arr,0,255).astype(np.uint8)
-    return Image.fromarray(arr,"RGB")
+    return Preprocessor((h,w),1.0/255.0,MEAN.ravel(),STD.ravel(),Image.BILINEAR)(im)[0]
 
 class ComboReader(CalibrationDataReader):
-    def __init__(self,input_name,h,w,calib_dir,image,repeats,synthetic):
-        self.input_name=input_name; self.samples=[]
-        def add(im): self.samples.append({input_name: preprocess(im,h,w)})
-        added=0
+    """Streaming calibration reader: samples are decoded lazily by a small thread pool with a bounded
+    prefetch window, so peak memory stays flat regardless of sample count. `--repeats` yields the same
+    tensor again instead of storing copies. With `cache` (a .npy path) the preprocessed tensors are
+    written into a memmap on the first full pass; rewind() and later runs with the same sources read it back."""
+    def __init__(self,input_name,h,w,calib_dir,image,repeats,synthetic,workers=4,prefetch=8,cache=None):
+        self.input_name=input_name; self.h=h; self.w=w; self.workers=max(1,workers); self.prefetch=max(1,prefetch)
+        self.pre=Preprocessor((h,w),1.0/255.0,MEAN.ravel(),STD.ravel(),Image.BILINEAR)
+        self.loaders=[]; self.order=[]; key=[h,w]  # unique sources / sample -> source index / cache key
         if calib_dir:
-            paths=[];
+            paths=[]
             for e in ("*.jpg","*.jpeg","*.png","*.bmp","*.webp"): paths+=glob.glob(os.path.join(calib_dir,e))
             for p in sorted(paths):
-                try: add(Image.open(p).convert("RGB")); added+=1
-                except: pass
-        if added==0 and image:
+                self.loaders.append(lambda p=p: Image.open(p).convert("RGB")); key.append([p,os.path.getsize(p),os.path.getmtime(p)])
+            self.order=list(range(len(self.loaders)))
+        if not self.order and image:
             try:
-                im=read_image(image)
-                for _ in range(max(1,repeats)): add(im); added+=1
+                im=read_image(image)  # one decode up front so a bad --image still falls through to --synthetic
+                self.loaders=[lambda: im]; self.order=[0]*max(1,repeats); key.append(image)
             except Exception as e:
                 print("[warn] load --image failed:", e)
-        if added==0 and synthetic>0:
-            for _ in range(synthetic): add(synth_image(h,w)); added+=1
-        self.i=0
-        print(f"[calib] {added} samples prepared.")
-    def get_next(self):
-        if self.i>=len(self.samples): return None
-        x=self.samples[self.i]; self.i+=1; return x
-    def rewind(self): self.i=0
+        if not self.order and synthetic>0:
+            self.loaders=[lambda i=i: synth_image(h,w,np.random.default_rng(i)) for i in range(synthetic)]
+            self.order=list(range(synthetic)); key.append(["synthetic",synthetic])
+        self.key=hashlib.sha1(json.dumps(key).encode()).hexdigest()
+        self.cache=cache; self.mm=None; self.cached=False; self.bad=set()
+        if cache and self.loaders: self._open_cache()
+        self._gen=None; self.rewind()
+        src="cache" if self.cached else "lazy"
+        print(f"[calib] {len(self.order)} samples ({len(self.loaders)} unique, {src}).")
+    def __len__(self): return len(self.order)
+    def _meta_path(self): return self.cache+".json"
+    def _open_cache(self):
+        shape=(len(self.loaders),)+self.pre.shape
+        try:
+            with open(self._meta_path()) as f: meta=json.load(f)
+        except Exception: meta={}
+        if meta.get("key")==self.key and meta.get("complete") and os.path.exists(self.cache):
+            mm=np.load(self.cache,mmap_mode="r")
+            if mm.shape==shape:
+                self.mm=mm; self.cached=True; self.bad=set(meta.get("bad",[])); return
+        d=os.path.dirname(os.path.abspath(self.cache)); os.makedirs(d,exist_ok=True)
+        self.mm=np.lib.format.open_memmap(self.cache,mode="w+",dtype=np.float32,shape=shape)
+    def _load(self,k):
+        if self.cached: return self.mm[k]
+        out=self.mm[k] if self.mm is not None else np.empty(self.pre.shape,np.float32)
+        self.pre.into(self.loaders[k](),out); return out
+    def _iter(self):
+        runs=[]  # consecutive repeats of one source share a single decode
+        for k in self.order:
+            if runs and runs[-1][0]==k: runs[-1][1]+=1
+            else: runs.append([k,1])
+        bad=set(self.bad)
+        with ThreadPoolExecutor(self.workers) as ex:
+            pending=deque(); it=iter(runs)
+            def fill():
+                for k,n in it:
+                    if k in bad: continue
+                    pending.append((k,n,ex.submit(self._load,k)))
+                    if len(pending)>=self.prefetch: break
+            fill()
+            while pending:
+                k,n,fut=pending.popleft()
+                try: x=fut.result()
+                except Exception as e:
+                    print(f"[warn] calib sample {k} failed: {e}"); bad.add(k); fill(); continue
+                fill()
+                for _ in range(n): yield {self.input_name: x}
+        if self.mm is not None and not self.cached:  # first full pass done: publish the cache
+            self.mm.flush(); self.bad=bad
+            with open(self._meta_path(),"w") as f: json.dump({"key":self.key,"complete":True,"bad":sorted(bad)},f)
+            self.mm=np.load(self.cache,mmap_mode="r"); self.cached=True
+    def get_next(self): return next(self._gen,None)
+    def rewind(self):
+        if self._gen is not None: self._gen.close()
+        self._gen=self._iter()
+
+def uses_external_data(path):
+    return any(t.data_location==onnx.TensorProto.EXTERNAL for t in onnx.load(path,load_external_data=False).graph.initializer)
+
+def quantize(fm,out,dr,per_channel=False,method="minmax",op_types=None):
+    calib=CalibrationMethod.MinMax if method=="minmax" else CalibrationMethod.Entropy
+    quantize_static(model_input=fm, model_output=out, calibration_data_reader=dr, quant_format=QuantFormat.QDQ,
+                    per_channel=per_channel, activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                    calibrate_method=calib, op_types_to_quantize=op_types, use_external_data_format=uses_external_data(fm))
+
+def ort_runner(path,threads):
+    import onnxruntime as ort
+    so=ort.SessionOptions(); so.intra_op_num_threads=threads
+    sess=ort.InferenceSession(path,so,providers=["CPUExecutionProvider"])
+    inp=sess.get_inputs()[0].name; out=sess.get_outputs()[0].name
+    return lambda x: sess.run([out],{inp:x})[0]
+
+def time_and_score(path,xs,refs,threads,runs):
+    """p50 latency on xs[0] plus mean MAE (0..1) / IoU@0.5 of the masks against the fp32 `refs`."""
+    run=ort_runner(path,threads); run(xs[0]); lat=[]
+    for _ in range(runs):
+        t=time.perf_counter(); run(xs[0]); lat.append(1000*(time.perf_counter()-t))
+    mae=[]; iou=[]
+    for x,ref in zip(xs,refs):
+        m=EXACT.to_uint8(run(x)); mae.append(np.abs(m.astype(np.int16)-ref).mean()/255.0)
+        a,b=m>=128,ref>=128; u=np.logical_or(a,b).sum(); iou.append(np.logical_and(a,b).sum()/u if u else 1.0)
+    return float(np.median(lat)),float(np.mean(mae)),float(np.mean(iou))
+
+def pareto(rows):
+    """Mark rows not dominated on (p50_ms, mae)."""
+    ok=[r for r in rows if not r.get("error")]
+    for r in ok:
+        r["pareto"]=not any(o is not r and o["p50_ms"]<=r["p50_ms"] and o["mae"]<=r["mae"] and
+                            (o["p50_ms"]<r["p50_ms"] or o["mae"]<r["mae"]) for o in ok)
+
+def sweep(fm,dr,xs,out,work_dir,exclude_sets,threads=4,runs=10,max_mae=0.01,min_iou=0.98,keep_all=False):
+    """Quantise every (per-channel, method, excluded op types) variant, time + score it, keep the fastest within budget."""
+    os.makedirs(work_dir,exist_ok=True)
+    ref_run=ort_runner(fm,threads); refs=[EXACT.to_uint8(ref_run(x)) for x in xs]; del ref_run
+    all_ops=sorted({n.op_type for n in onnx.load(fm,load_external_data=False).graph.node})
+    lat,_,_=time_and_score(fm,xs,refs,threads,runs)
+    rows=[{"variant":"fp32","path":fm,"p50_ms":lat,"mae":0.0,"iou":1.0,"error":""}]
+    for pc in (False,True):
+        for method in ("minmax","entropy"):
+            for ex in [[]]+exclude_sets:
+                ops=[o for o in all_ops if o not in ex] if ex else None
+                if ex and (not ops or len(ops)==len(all_ops)):
+                    if not pc and method=="minmax": print(f"[warn] --exclude-ops {','.join(ex)}: nothing to exclude or nothing left; skipped")
+                    continue
+                name=f"{'pc' if pc else 'pt'}_{method}"+(f"_no-{'-'.join(ex)}" if ex else "")
+                path=os.path.join(work_dir,name+".onnx"); row={"variant":name,"path":path,"error":""}
+                try:
+                    dr.rewind(); t=time.perf_counter()
+                    quantize(fm,path,dr,pc,method,ops)
+                    row["quant_s"]=time.perf_counter()-t
+                    row["p50_ms"],row["mae"],row["iou"]=time_and_score(path,xs,refs,threads,runs)
+                except Exception as e:
+                    row["error"]=" ".join(f"{type(e).__name__}: {e}".split())
+                rows.append(row); print(fmt_row(row),flush=True)
+    pareto(rows)
+    fit=[r for r in rows[1:] if not r["error"] and r["mae"]<=max_mae and r["iou"]>=min_iou]
+    best=min(fit,key=lambda r:r["p50_ms"]) if fit else None
+    print("\n[sweep] variant                      p50 ms    speedup   MAE      IoU     pareto")
+    for r in rows:
+        if r["error"]: print(f"  {r['variant']:<28} ERROR {r['error']}"); continue
+        mark="<- best" if r is best else ""
+        print(f"  {r['variant']:<28} {r['p50_ms']:8.2f}  {rows[0]['p50_ms']/r['p50_ms']:6.2f}x  {r['mae']:.5f}  {r['iou']:.4f}  "
+              f"{'*' if r.get('pareto') else ' '}  {mark}")
+    if best is None:
+        print(f"[warn] no variant within MAE<={max_mae} IoU>={min_iou}; nothing kept")
+    else:
+        shutil.copyfile(best["path"],out); print(f"[sweep] kept {best['variant']} -> {out}")
+        if best["p50_ms"]>=rows[0]["p50_ms"]: print("[warn] fp32 is still faster than every INT8 variant on this host")
+    if not keep_all:
+        for r in rows[1:]:
+            if os.path.exists(r["path"]): os.remove(r["path"])
+    return rows,best
+
+def fmt_row(r):
+    if r["error"]: return f"[variant] {r['variant']:<28} ERROR {r['error']}"
+    return f"[variant] {r['variant']:<28} quant {r['quant_s']:6.1f}s  p50 {r['p50_ms']:8.2f} ms  MAE {r['mae']:.5f}  IoU {r['iou']:.4f}"
 
 def main():
     ap=argparse.ArgumentParser("INT8 QDQ quant without real dataset")
@@ -88,8 +286,20 @@ def main():
     ap.add_argument("--height",type=int,default=1024); ap.add_argument("--width",type=int,default=1024)
     ap.add_argument("--calib-dir",default=None); ap.add_argument("--image",default=None)
     ap.add_argument("--repeats",type=int,default=32); ap.add_argument("--synthetic",type=int,default=64)
+    ap.add_argument("--workers",type=int,default=4,help="calibration decode threads")
+    ap.add_argument("--prefetch",type=int,default=8,help="max decoded samples held ahead of the calibrator")
+    ap.add_argument("--calib-cache",default=None,help="memmapped .npy cache of preprocessed samples (reused across runs)")
     ap.add_argument("--per-channel",action="store_true")
     ap.add_argument("--method",choices=["minmax","entropy"],default="minmax")
+    ap.add_argument("--sweep",action="store_true",help="try per-tensor/per-channel x minmax/entropy (x --exclude-ops), keep the fastest within budget as --out")
+    ap.add_argument("--exclude-ops",action="append",default=[],help="comma-separated op types left in float; repeat for more variants")
+    ap.add_argument("--eval-dir",default=None,help="images scored against fp32 masks (default: calibration source)")
+    ap.add_argument("--eval-count",type=int,default=8)
+    ap.add_argument("--max-mae",type=float,default=0.01,help="mask MAE budget (0..1)")
+    ap.add_argument("--min-iou",type=float,default=0.98)
+    ap.add_argument("--threads",type=int,default=4); ap.add_argument("--runs",type=int,default=10)
+    ap.add_argument("--sweep-dir",default="int8_sweep"); ap.add_argument("--keep-all",action="store_true")
+    ap.add_argument("--report",default=None,help="write sweep rows as JSON")
     a=ap.parse_args()
     if a.upcast:
         if not a.fp16_model: raise SystemExit("need --fp16-model with --upcast")
@@ -98,13 +308,20 @@ def main():
         if not a.float_model: raise SystemExit("provide --float-model or use --fp16-model + --upcast")
         fm=a.float_model
     input_name=a.input_name or detect_input(fm); print("[info] input:", input_name)
-    dr=ComboReader(input_name,a.height,a.width,a.calib_dir,a.image,a.repeats,a.synthetic)
-    if not dr.samples: raise SystemExit("no calibration samples; provide --calib-dir or --image or --synthetic>0")
-    qfmt=QuantFormat.QDQ; calib=CalibrationMethod.MinMax if a.method=="minmax" else CalibrationMethod.Entropy
+    dr=ComboReader(input_name,a.height,a.width,a.calib_dir,a.image,a.repeats,a.synthetic,a.workers,a.prefetch,a.calib_cache)
+    if not len(dr): raise SystemExit("no calibration samples; provide --calib-dir or --image or --synthetic>0")
+    if a.sweep:
+        ev=ComboReader(input_name,a.height,a.width,a.eval_dir or a.calib_dir,a.image,1,a.eval_count)
+        xs=[np.array(x[input_name]) for _,x in zip(range(a.eval_count),iter(ev.get_next,None))]; del ev
+        if not xs: raise SystemExit("no evaluation samples")
+        ex=[[o.strip() for o in e.split(",") if o.strip()] for e in a.exclude_ops]
+        rows,_=sweep(fm,dr,xs,a.out,a.sweep_dir,ex,a.threads,a.runs,a.max_mae,a.min_iou,a.keep_all)
+        if a.report:
+            with open(a.report,"w") as f: json.dump(rows,f,indent=2)
+            print("[sweep] report:", a.report)
+        return
     print("[quant] quantize_static...")
-    quantize_static(model_input=fm, model_output=a.out, calibration_data_reader=dr, quant_format=qfmt,
-                    per_channel=a.per_channel, activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
-                    calibrate_method=calib)
+    quantize(fm,a.out,dr,a.per_channel,a.method)
     print("[done] saved:", a.out)
 
 if __name__=="__main__":
@@ -0,0 +1,53 @@
+"""Checks for the aspect-ratio bucket helpers.
+
+    python -m pytest -q models/birefnet/test_birefnet_buckets.py
+"""
+import pytest
+
+from birefnet_buckets import DEFAULT_BUCKETS, default_buckets, max_shape, nearest_bucket, parse_buckets
+
+
+def test_explicit_shapes_are_taken_literally():
+    # WxH in, (h, w) out; no rescaling for a non-512 model size
+    assert parse_buckets("512x512, 704x384,384X704", (1024, 1024)) == [(512, 512), (384, 704), (704, 384)]
+    assert parse_buckets("1000x250", (512, 512)) == [(250, 1000)]
+
+
+def test_duplicates_and_empty_items_are_dropped():
+    assert parse_buckets("512x512,,512x512,256x768,") == [(512, 512), (768, 256)]
+
+
+def test_empty_spec_raises():
+    with pytest.raises(ValueError):
+        parse_buckets(" , ")
+
+
+def test_default_is_scaled_to_the_model_size():
+    base = parse_buckets("default")
+    assert base == parse_buckets(DEFAULT_BUCKETS) == default_buckets((512, 512))
+    assert parse_buckets("Default", (1024, 1024)) == [(2 * h, 2 * w) for h, w in base]
+    for h, w in default_buckets((448, 448)):
+        assert h % 32 == 0 and w % 32 == 0
+    assert all(h >= 32 and w >= 32 for h, w in default_buckets((32, 32)))
+
+
+def test_default_buckets_do_not_exceed_the_square_pixel_count_by_much():
+    for h, w in default_buckets():
+        assert h * w <= 1.05 * 512 * 512
+
+
+@pytest.mark.parametrize("size,bucket", [((800, 800), (512, 512)), ((1280, 720), (384, 704)),
+                                         ((720, 1280), (704, 384)), ((1500, 500), (256, 768)),
+                                         ((500, 1500), (768, 256)), ((4000, 100), (256, 768)),
+                                         ((900, 800), (512, 512))])
+def test_nearest_bucket_by_aspect_ratio(size, bucket):
+    assert nearest_bucket(size, default_buckets()) == bucket
+
+
+def test_nearest_bucket_ties_go_to_fewer_pixels():
+    assert nearest_bucket((300, 300), [(512, 512), (256, 256)]) == (256, 256)
+
+
+def test_max_shape_is_per_axis():
+    assert max_shape(default_buckets()) == (768, 768)
+    assert max_shape([(384, 704), (512, 512)]) == (512, 704)
@@ -0,0 +1,116 @@
+"""Fetcher against the local HTTP stand-in (`serve_dir`): order, retries, pooling and decode equality.
+
+    python -m pytest -q models/birefnet/test_birefnet_fetch.py
+"""
+import numpy as np
+import pytest
+from PIL import Image
+
+from birefnet_fetch import Fetcher, serve_dir
+from birefnet_io import load_image_reduced
+
+# decreasing sizes, so later images finish first on a pool unless results are put back in order
+SIZES = [(1600, 1200), (1200, 300), (640, 480), (300, 900), (200, 200), (97, 61), (33, 33), (8, 8)]
+
+
+@pytest.fixture(scope="module")
+def images(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp("served")
+    rng = np.random.default_rng(0)
+    names = []
+    for i, (w, h) in enumerate(SIZES):
+        arr = rng.integers(0, 256, (h, w, 3), dtype=np.uint8)
+        name = f"im{i}.png" if i % 3 == 0 else f"im{i}.jpg"
+        img = Image.fromarray(arr, "RGB")
+        if i % 3 == 0:
+            img.putalpha(128)  # RGBA source: fetch must convert like the local loader
+        img.save(tmp_path / name)
+        names.append(name)
+    return tmp_path, names
+
+
+def stop(server):
+    server.shutdown()
+    server.server_close()
+
+
+def test_imap_keeps_input_order_and_decodes_like_a_local_open(images):
+    root, names = images
+    server, base = serve_dir(str(root), latency_ms=5)
+    try:
+        fetcher = Fetcher(workers=4, retries=0)
+        urls = [f"{base}/{n}" for n in names]
+        results = list(fetcher.imap(urls))
+        fetcher.close()
+    finally:
+        stop(server)
+    assert [r.index for r in results] == list(range(len(names)))
+    assert [r.source for r in results] == urls
+    for r, name in zip(results, names):
+        assert r.error is None
+        with Image.open(root / name) as ref:
+            assert r.size == ref.size
+            assert np.array_equal(np.asarray(r.image), np.asarray(ref.convert("RGB")))
+    assert server.connections <= 4  # keep-alive: at most one connection per worker
+
+
+def test_reduced_decode_matches_local_reduced_decode(images):
+    root, names = images
+    server, base = serve_dir(str(root))
+    try:
+        fetcher = Fetcher(workers=0)
+        for name in names:
+            r = fetcher.fetch(f"{base}/{name}", (256, 256))
+            ref, orig = load_image_reduced(str(root / name), (256, 256))
+            assert r.error is None and r.size == orig
+            assert np.array_equal(np.asarray(r.image), np.asarray(ref))
+        fetcher.close()
+    finally:
+        stop(server)
+
+
+def test_5xx_is_retried(images):
+    root, names = images
+    server, base = serve_dir(str(root), fail_every=3)  # requests 3, 6, 9, ... get a 503
+    try:
+        fetcher = Fetcher(workers=0, retries=2, backoff=0.0)
+        results = list(fetcher.imap(f"{base}/{n}" for n in names))
+        fetcher.close()
+    finally:
+        stop(server)
+    assert all(r.error is None for r in results)
+    assert fetcher.stats.retries == server.requests - len(names) > 0
+    assert fetcher.stats.images == len(names)
+
+
+def test_retries_give_up_and_4xx_is_not_retried(images):
+    root, names = images
+    server, base = serve_dir(str(root), fail_every=1)  # every request fails
+    try:
+        fetcher = Fetcher(workers=0, retries=2, backoff=0.0)
+        r = fetcher.fetch(f"{base}/{names[0]}")
+        assert r.error is not None and "503" in r.error
+        assert server.requests == 3
+    finally:
+        stop(server)
+
+    server, base = serve_dir(str(root))
+    try:
+        fetcher = Fetcher(workers=0, retries=2, backoff=0.0)
+        r = fetcher.fetch(f"{base}/missing.jpg")
+        assert r.error is not None and server.requests == 1
+    finally:
+        stop(server)
+
+
+def test_get_bytes_returns_the_file(images):
+    root, names = images
+    server, base = serve_dir(str(root), fail_every=2)  # the second call's first try gets a 503
+    try:
+        fetcher = Fetcher(workers=0, retries=1, backoff=0.0)
+        for name in names[1:3]:
+            assert fetcher.get_bytes(f"{base}/{name}") == (root / name).read_bytes()
+        assert server.requests == 3
+        fetcher.close()
+    finally:
+        stop(server)
@@ -0,0 +1,74 @@
+"""Regression checks: postprocess output against the scripts' original numpy + PIL code.
+
+    python -m pytest -q models/birefnet/test_birefnet_postprocess.py
+"""
+import numpy as np
+import pytest
+from PIL import Image
+
+from birefnet_postprocess import APPROX, EXACT, MaskPostprocessor, postprocess, to_rgba
+
+
+def baseline(logits: np.ndarray, out_size) -> Image.Image:
+    """The original scripts' postprocess (sigmoid -> uint8 -> PIL bilinear resize)."""
+    if logits.ndim == 4:
+        logits = logits[0, 0]
+    elif logits.ndim == 3:
+        logits = logits[0]
+    with np.errstate(over="ignore"):
+        mask = 1.0 / (1.0 + np.exp(-logits))
+    mask = (mask * 255.0).clip(0, 255).astype(np.uint8)
+    return Image.fromarray(mask, mode="L").resize(out_size, resample=Image.BILINEAR)
+
+
+def logits(shape, dtype=np.float32, seed=0) -> np.ndarray:
+    """Per-pixel random logits (every pixel an edge) plus zero, saturating and exp-overflowing values."""
+    rng = np.random.default_rng(seed)
+    x = rng.normal(0.0, 6.0, shape).astype(dtype)
+    x.flat[:6] = [0.0, -0.0, 30.0, -30.0, 88.0, -88.0]
+    return x
+
+
+@pytest.mark.parametrize("shape", [(1, 1, 64, 64), (1, 48, 80), (37, 100)])
+@pytest.mark.parametrize("out_size", [(64, 64), (640, 480), (33, 17), (3840, 2160)])
+def test_exact_matches_baseline_float32(shape, out_size):
+    x = logits(shape)
+    assert np.array_equal(np.asarray(postprocess(x, out_size)), np.asarray(baseline(x, out_size)))
+
+
+def test_exact_matches_baseline_float16():
+    x = logits((1, 1, 96, 128), np.float16, seed=1)
+    assert np.array_equal(np.asarray(EXACT(x, (500, 400))), np.asarray(baseline(x, (500, 400))))
+
+
+def test_every_float16_value_matches_reference():
+    values = np.arange(65536, dtype=np.uint32).astype(np.uint16).view(np.float16)
+    finite = values[np.isfinite(values)].reshape(1, -1)
+    with np.errstate(over="ignore"):
+        ref = (1.0 / (1.0 + np.exp(-finite)) * 255.0).clip(0, 255).astype(np.uint8)
+    assert np.array_equal(EXACT.to_uint8(finite), ref)
+
+
+def test_scratch_reuse_does_not_leak_between_calls():
+    post = MaskPostprocessor()
+    a, b = logits((64, 64), seed=2), logits((64, 64), seed=3)
+    first = post.to_uint8(a)
+    post.to_uint8(b)
+    assert np.array_equal(first, post.to_uint8(a))
+
+
+def test_approx_stays_within_a_grey_level_on_average():
+    # smooth, matte-like logits: approx mode only drifts further along sharp edges
+    coarse = np.random.default_rng(4).normal(0.0, 8.0, (8, 8)).astype(np.float32)
+    x = np.asarray(Image.fromarray(coarse, mode="F").resize((128, 128), Image.BILINEAR))
+    diff = np.abs(np.asarray(APPROX(x, (1024, 1024)), np.int16) - np.asarray(baseline(x, (1024, 1024)), np.int16))
+    assert diff.mean() < 1.0
+
+
+def test_to_rgba_matches_copy_and_putalpha():
+    rng = np.random.default_rng(5)
+    rgb = Image.fromarray(rng.integers(0, 256, (40, 60, 3), dtype=np.uint8), "RGB")
+    alpha = Image.fromarray(rng.integers(0, 256, (40, 60), dtype=np.uint8), "L")
+    ref = rgb.copy()
+    ref.putalpha(alpha)
+    assert np.array_equal(np.asarray(to_rgba(rgb.copy(), alpha)), np.asarray(ref))
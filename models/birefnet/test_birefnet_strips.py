@@ -0,0 +1,68 @@
+"""Regression checks: strip-wise output against the whole-image resize + save path.
+
+    python -m pytest -q models/birefnet/test_birefnet_strips.py
+"""
+import numpy as np
+import pytest
+from PIL import Image
+
+from birefnet_encode import decode, parse_format
+from birefnet_postprocess import APPROX, EXACT, to_rgba
+from birefnet_strips import PngStripWriter, StripUpsampler, write_strips
+
+# (mask h, mask w), output (w, h): up- and downsampling, odd sizes, one unchanged axis
+CASES = [((64, 64), (640, 480)), ((48, 80), (81, 1001)), ((100, 37), (37, 250)), ((96, 96), (50, 40)),
+         ((33, 65), (2049, 33))]
+
+
+def mask(shape, seed=0) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 256, shape, dtype=np.uint8)
+
+
+@pytest.mark.parametrize("approx", [False, True])
+@pytest.mark.parametrize("strip_rows", [1, 7, 64, 10000])
+@pytest.mark.parametrize("shape,size", CASES)
+def test_upsampler_rows_match_resize(shape, size, strip_rows, approx):
+    m = mask(shape)
+    up = StripUpsampler(m, size, approx)
+    rows = np.vstack([up.rows(r0, min(size[1], r0 + strip_rows)) for r0 in range(0, size[1], strip_rows)])
+    ref = (APPROX if approx else EXACT).resize(m, size)
+    assert np.array_equal(rows, np.asarray(ref))
+
+
+@pytest.mark.parametrize("channels,mode", [(1, "L"), (4, "RGBA")])
+def test_png_strip_writer_decodes_to_the_rows(tmp_path, channels, mode):
+    rng = np.random.default_rng(1)
+    img = rng.integers(0, 256, (123, 77) if channels == 1 else (123, 77, 4), dtype=np.uint8)
+    img[:40] = 200  # flat rows, so every filter type gets chosen somewhere
+    path = str(tmp_path / "out.png")
+    wr = PngStripWriter(path, (77, 123), channels, level=1)
+    for r0 in range(0, 123, 10):
+        wr.write(img[r0:r0 + 10])
+    wr.close()
+    with Image.open(path) as out:
+        assert out.mode == mode
+        assert np.array_equal(np.asarray(out), img)
+
+
+@pytest.mark.parametrize("mask_fmt,cutout_fmt", [("png", "png"), ("npy", "npy"), ("png:1", "alpha"), ("png:0", "png:9")])
+@pytest.mark.parametrize("approx", [False, True])
+def test_write_strips_matches_resize_and_save(tmp_path, mask_fmt, cutout_fmt, approx):
+    rng = np.random.default_rng(2)
+    m = mask((48, 80), seed=3)
+    size = (333, 211)
+    rgb = Image.fromarray(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8), "RGB")
+    mf, cf = parse_format(mask_fmt), parse_format(cutout_fmt)
+    mask_path, cutout_path = str(tmp_path / f"m{mf.ext}"), str(tmp_path / f"c{cf.ext}")
+    st = write_strips(m, size, mask_path, mf, rgb, cutout_path, cf, strip_rows=50, approx=approx)
+
+    ref = (APPROX if approx else EXACT).resize(m, size)
+    ref_path = str(tmp_path / "ref.png")
+    ref.save(ref_path)  # the whole-image path: resize, then save
+    ref_mask = np.asarray(Image.open(ref_path))
+    ref_cutout = ref_mask if cf.kind == "alpha" else np.asarray(to_rgba(rgb.copy(), ref))
+    assert np.array_equal(decode(mask_path), ref_mask)
+    assert np.array_equal(decode(cutout_path), ref_cutout)
+    assert rgb.mode == "RGB"  # the source is only read
+    assert (st.strips, st.mask_min, st.mask_max) == (5, ref_mask.min(), ref_mask.max())
+    assert st.mask_mean == pytest.approx(ref_mask.mean())